@@ -66,6 +66,7 @@ async def delete_puzzle(app_state: PychessGlobalAppState, message):
     parts = message.split()
     if len(parts) == 2 and len(parts[1]) == 5:
         await app_state.db.puzzle.delete_one({"_id": parts[1]})
+        app_state.puzzle_cache.discard(parts[1])
 
 
 async def ban(app_state: PychessGlobalAppState, message):
@@ -80,7 +81,10 @@ async def ban(app_state: PychessGlobalAppState, message):
 async def crosstable(app_state: PychessGlobalAppState, message):
     parts = message.split()
     print(parts)
-    if len(parts) == 2:
+    if len(parts) == 1:
+        # add games played since the last crosstable regeneration
+        await generate_crosstable(app_state, incremental=True)
+    elif len(parts) == 2:
         user = await app_state.users.get(parts[1])
         if user.username != NONE_USER:
             await generate_crosstable(app_state, user.username)
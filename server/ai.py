@@ -3,9 +3,8 @@ import asyncio
 import json
 import random
 import string
-from time import monotonic
 
-from const import MOVE, STARTED
+from const import STARTED
 from const import TYPE_CHECKING
 from fairy import WHITE
 
@@ -15,6 +14,35 @@ from utils import play_move
 from logger import log
 
 
+def move_work_position(game):
+    """
+    Return the start position and the move list of a fishnet move work
+
+    Moves before the last irreversible one (capture, pawn move) can't repeat any later
+    position, so the work starts from the position after it. This keeps the payload and the
+    engine setup short in long games. Variants where the legal moves depend on the whole
+    history (janggi, ataxx) and variants where captured pieces go to the hand (so positions
+    before a capture can repeat) get the initial position and every move of the game.
+    """
+    board = game.board
+    if (
+        board.legal_moves_need_history
+        or board.sf.captures_to_hand(board.variant)
+        or len(game.steps) != len(board.move_stack) + 1
+    ):
+        return board.initial_fen, board.move_stack
+
+    try:
+        halfmove_clock = int(board.fen.split()[-2])
+    except (IndexError, ValueError):
+        return board.initial_fen, board.move_stack
+
+    start = max(0, len(board.move_stack) - halfmove_clock)
+    if start == 0:
+        return board.initial_fen, board.move_stack
+    return game.steps[start]["fen"], board.move_stack[start:]
+
+
 async def BOT_task(bot, app_state: PychessGlobalAppState):
     async def game_task(bot, game, level, random_mover):
         while game.status <= STARTED:
@@ -42,6 +70,7 @@ async def BOT_task(bot, app_state: PychessGlobalAppState):
                 AI_move(game, level)
 
     def AI_move(game, level):
+        position, moves = move_work_position(game)
         work_id = "".join(random.choice(string.ascii_letters + string.digits) for x in range(6))
         work = {
             "work": {
@@ -49,16 +78,14 @@ async def BOT_task(bot, app_state: PychessGlobalAppState):
                 "id": work_id,
                 "level": level,
             },
-            "time": monotonic(),
             "game_id": game.id,  # optional
-            "position": game.board.initial_fen,  # start position (X-FEN)
+            "position": position,  # start position (X-FEN)
             "variant": game.variant,
             "chess960": game.chess960,
-            "moves": " ".join(game.board.move_stack),  # moves of the game (UCI)
+            "moves": " ".join(moves),  # moves from the start position (UCI)
             "nnue": game.board.nnue,
         }
-        app_state.fishnet_works[work_id] = work
-        app_state.fishnet_queue.put_nowait((MOVE, work_id))
+        app_state.fishnet_works.put(work)
 
     # After server restart we may have to wait for fairyfishnet workers to join...
     while not bot.online:
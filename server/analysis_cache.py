@@ -0,0 +1,53 @@
+from __future__ import annotations
+from collections import OrderedDict
+from hashlib import blake2b
+
+# Number of analysed positions kept in memory
+ANALYSIS_CACHE_SIZE = 200000
+
+
+def position_keys(variant, chess960, initial_fen, moves):
+    """
+    Return the cache keys of the positions of a game, the start position first
+
+    The key of a position is a hash chained over the variant, the initial FEN and the moves
+    leading to it, so games sharing an opening prefix share the keys of that prefix.
+    """
+    key = blake2b(("%s %s %s" % (variant, chess960, initial_fen)).encode(), digest_size=16).digest()
+    keys = [key]
+    for move in moves:
+        key = blake2b(key + move.encode(), digest_size=16).digest()
+        keys.append(key)
+    return keys
+
+
+class AnalysisCache:
+    """LRU cache of fishnet position evaluations ({"s": score, "d": depth, "p": pv} dicts)"""
+
+    def __init__(self, size=ANALYSIS_CACHE_SIZE):
+        self.size = size
+        self.evals: OrderedDict[bytes, dict] = OrderedDict()
+
+    def __len__(self):
+        return len(self.evals)
+
+    def get(self, key):
+        ceval = self.evals.get(key)
+        if ceval is not None:
+            self.evals.move_to_end(key)
+        return ceval
+
+    def put(self, key, ceval):
+        self.evals[key] = ceval
+        self.evals.move_to_end(key)
+        if len(self.evals) > self.size:
+            self.evals.popitem(last=False)
+
+    def lookup(self, keys):
+        """Return {ply: ceval} of the cached positions"""
+        found = {}
+        for ply, key in enumerate(keys):
+            ceval = self.get(key)
+            if ceval is not None:
+                found[ply] = ceval
+        return found
@@ -1,6 +1,7 @@
 from itertools import product
 from random import random
 
+from auto_pairing_index import AutoPairingIndex
 from variants import BYOS
 from misc import time_control_str
 from newid import new_id
@@ -45,7 +46,7 @@ def add_to_auto_pairings(app_state, user, data):
             continue
 
         if variant_tc not in app_state.auto_pairings:
-            app_state.auto_pairings[variant_tc] = set()
+            app_state.auto_pairings[variant_tc] = AutoPairingIndex(variant, chess960)
 
         app_state.auto_pairings[variant_tc].add(user)
         added = True
@@ -120,19 +121,23 @@ async def auto_pair(app_state, user, auto_variant_tc, other_user=None, matching_
 def find_matching_user(app_state, user, variant_tc):
     """Return first compatible user from app_state.auto_pairing_users if there is any, else None"""
 
+    if not user.ready_for_auto_pairing:
+        return None
+
     variant, chess960, _, _, _ = variant_tc
+    rating = user.get_rating_value(variant, chess960)
+    rrmin, rrmax = app_state.auto_pairing_users[user]
+
     return next(
         (
             user_candidate
-            for user_candidate in (
-                auto_pairing_user
-                for auto_pairing_user in app_state.auto_pairings[variant_tc]
-                if auto_pairing_user in app_state.auto_pairing_users
-                and auto_pairing_user != user
-                and user.ready_for_auto_pairing
-                and auto_pairing_user.ready_for_auto_pairing
+            for user_candidate in app_state.auto_pairings[variant_tc].candidates(
+                rating + rrmin, rating + rrmax
             )
-            if user.auto_compatible_with_other_user(user_candidate, variant, chess960)
+            if user_candidate in app_state.auto_pairing_users
+            and user_candidate != user
+            and user_candidate.ready_for_auto_pairing
+            and user.auto_compatible_with_other_user(user_candidate, variant, chess960)
         ),
         None,
     )
@@ -144,22 +149,13 @@ def find_matching_seek(app_state, user, variant_tc):
     variant, chess960, base, inc, byoyomi_period = variant_tc
     return next(
         (
-            seek_candidate
-            for seek_candidate in (
-                seek
-                for seek in app_state.seeks.values()
-                if seek.day == 0
-                and seek.variant == variant
-                and seek.chess960 == chess960
-                and seek.rated
-                and seek.base == base
-                and seek.inc == inc
-                and seek.byoyomi_period == byoyomi_period
-                and seek.color == "r"
-                and seek.fen == ""
-                and user != seek.creator
-            )
-            if user.auto_compatible_with_seek(seek_candidate)
+            seek
+            for seek in app_state.seeks.matching(variant, chess960, base, inc, byoyomi_period, True)
+            if seek.day == 0
+            and seek.color == "r"
+            and seek.fen == ""
+            and user != seek.creator
+            and user.auto_compatible_with_seek(seek)
         ),
         None,
     )
@@ -171,14 +167,13 @@ def find_matching_user_for_seek(app_state, seek, variant_tc):
     return next(
         (
             user_candidate
-            for user_candidate in (
-                auto_pairing_user
-                for auto_pairing_user in app_state.auto_pairings[variant_tc]
-                if auto_pairing_user in app_state.auto_pairing_users
-                and auto_pairing_user.ready_for_auto_pairing
-                and auto_pairing_user != seek.creator
+            for user_candidate in app_state.auto_pairings[variant_tc].candidates(
+                seek.rating + seek.rrmin, seek.rating + seek.rrmax
             )
-            if user_candidate.auto_compatible_with_seek(seek)
+            if user_candidate in app_state.auto_pairing_users
+            and user_candidate.ready_for_auto_pairing
+            and user_candidate != seek.creator
+            and user_candidate.auto_compatible_with_seek(seek)
         ),
         None,
     )
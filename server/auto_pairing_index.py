@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from sortedcontainers import SortedList
+
+
+class AutoPairingIndex:
+    """
+    Users waiting for auto pairing with one (variant, chess960, base, inc, byoyomi) combo
+
+    It works as a set of users, but also keeps the users sorted by their rating,
+    so candidates() can return the users inside a rating interval without scanning all of them.
+    Rating range and block list compatibility has to be checked on this shortlist only.
+    """
+
+    def __init__(self, variant, chess960):
+        self.variant = variant
+        self.chess960 = chess960
+        self.ratings = {}  # {user: rating, ...}
+        self.users = {}  # {username: user, ...}
+        self.by_rating = SortedList()  # [(rating, username), ...]
+
+    def __contains__(self, user):
+        return user in self.ratings
+
+    def __iter__(self):
+        return iter(list(self.ratings))
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def add(self, user):
+        if user in self.ratings:
+            return
+        rating = user.get_rating_value(self.variant, self.chess960)
+        self.ratings[user] = rating
+        self.users[user.username] = user
+        self.by_rating.add((rating, user.username))
+
+    def discard(self, user):
+        rating = self.ratings.pop(user, None)
+        if rating is None:
+            return
+        del self.users[user.username]
+        self.by_rating.remove((rating, user.username))
+
+    def update_rating(self, user):
+        """Move the user to its new place after a rating change"""
+        if user in self.ratings:
+            self.discard(user)
+            self.add(user)
+
+    def candidates(self, rating_min, rating_max):
+        """Yield the users with rating_min <= rating <= rating_max in rating order"""
+        for _, username in self.by_rating.irange(
+            (rating_min,), (rating_max + 1,), inclusive=(True, False)
+        ):
+            yield self.users[username]
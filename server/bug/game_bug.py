@@ -33,6 +33,7 @@ from const import (
 from fairy import FairyBoard, BLACK, WHITE
 from spectators import spectators
 from variants import get_server_variant, GRANDS
+from variant_stats import inc_variant_stats
 
 MAX_HIGH_SCORE = 10
 MAX_PLY = 2 * 600
@@ -119,9 +120,9 @@ class GameBug:
 
         self.lastmove = None
         self.lastmovePerBoardAndUser = {"a": {}, "b": {}}
+        self.id = gameId
         self.status = STARTED  # CREATED
         self.result = "*"
-        self.id = gameId
 
         start_fen = initial_fen if initial_fen else FairyBoard.start_fen(variant, chess960)
         if chess960:
@@ -328,9 +329,20 @@ class GameBug:
                     {"_id": self.id}, {"$set": new_data}
                 )
 
+            await inc_variant_stats(self.app_state, self)
+
     async def update_ratings(self):
         pass  # todo no rating in bughouse for now
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+        self.app_state.live_games.update(self)
+
     @property
     def corr(self):
         return False
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from logger import log
+
+
+async def bulk_update(collection, updates, upsert=False):
+    """
+    Apply {_id: update, ...} to a collection with one unordered bulk_write
+
+    Returns the set of _ids whose update was not applied, so callers can keep them
+    for the next write. Every _id counts as failed if the write failed as a whole.
+    """
+    if not updates:
+        return set()
+
+    try:
+        requests = [
+            UpdateOne({"_id": _id}, update, upsert=upsert) for _id, update in updates.items()
+        ]
+        await collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        ids = list(updates)
+        failed = {ids[error["index"]] for error in e.details["writeErrors"]}
+        log.error("Failed to save %s of %s updates to %s", len(failed), len(ids), collection.name)
+        return failed
+    except Exception:
+        log.exception("Failed to save updates to %s", collection.name)
+        return set(updates)
+
+    return set()
@@ -1,12 +1,11 @@
 from __future__ import annotations
-import asyncio
 import json
 from datetime import datetime, timezone
 from functools import partial
-from time import monotonic
 
 from aiohttp import web
 
+from analysis_cache import position_keys
 from const import ANALYSIS
 from const import TYPE_CHECKING
 
@@ -18,7 +17,20 @@ from utils import load_game, play_move
 from logger import log
 
 REQUIRED_FISHNET_VERSION = "1.16.42"
-MOVE_WORK_TIME_OUT = 5.0
+
+
+def game_position_keys(game):
+    return position_keys(game.variant, game.chess960, game.board.initial_fen, game.board.move_stack)
+
+
+async def send_analysis(app_state: PychessGlobalAppState, username, game, ply):
+    response = {
+        "type": "analysis",
+        "ply": str(ply),
+        "color": "w" if ply % 2 == 0 else "b",
+        "ceval": game.steps[ply]["analysis"],
+    }
+    await app_state.users[username].send_game_message(game.id, response)
 
 
 async def get_work(app_state: PychessGlobalAppState, data):
@@ -26,82 +38,54 @@ async def get_work(app_state: PychessGlobalAppState, data):
     key = data["fishnet"]["apikey"]
     worker = FISHNET_KEYS[key]
 
-    fishnet_work_queue = app_state.fishnet_queue
+    works = app_state.fishnet_works
+    work_id = works.next_work_id()
+    if work_id is None:
+        return web.Response(status=204)
 
-    # priority can be "move" or "analysis"
-    try:
-        (priority, work_id) = fishnet_work_queue.get_nowait()
-        try:
-            fishnet_work_queue.task_done()
-        except ValueError:
-            log.error(
-                "task_done() called more times than there were items placed in the queue in fishnet.py get_work()"
+    work = works[work_id]
+    works.lease(work_id, key)
+    again = " AGAIN" if works.attempts[work_id] > 1 else ""
+
+    if works.priority(work) == ANALYSIS:
+        fm[worker].append(
+            "%s %s %s %s of %s moves"
+            % (
+                datetime.now(timezone.utc),
+                work_id,
+                "request",
+                "analysis" + again,
+                work["moves"].count(" ") + 1,
             )
+        )
 
-        work = app_state.fishnet_works[work_id]
-        if priority == ANALYSIS:
-            fm[worker].append(
-                "%s %s %s %s of %s moves"
-                % (
-                    datetime.now(timezone.utc),
-                    work_id,
-                    "request",
-                    "analysis",
-                    work["moves"].count(" ") + 1,
-                )
-            )
+        gameId = work["game_id"]
+        game = await load_game(app_state, gameId)
+        if game is None:
+            del works[work_id]
+            return web.Response(status=204)
 
-            # delete previous analysis
-            gameId = work["game_id"]
-            game = await load_game(app_state, gameId)
-            if game is None:
-                return web.Response(status=204)
-
-            for step in game.steps:
-                if "analysis" in step:
-                    del step["analysis"]
-
-            if "username" in work:
-                response = {
-                    "type": "roundchat",
-                    "user": "",
-                    "room": "spectator",
-                    "message": "Work for fishnet sent...",
-                }
-                await app_state.users[work["username"]].send_game_message(work["game_id"], response)
-        else:
-            fm[worker].append(
-                "%s %s %s %s for level %s"
-                % (
-                    datetime.now(timezone.utc),
-                    work_id,
-                    "request",
-                    "move",
-                    work["work"]["level"],
-                )
+        if "username" in work:
+            response = {
+                "type": "roundchat",
+                "user": "",
+                "room": "spectator",
+                "message": "Work for fishnet sent...",
+            }
+            await app_state.users[work["username"]].send_game_message(work["game_id"], response)
+    else:
+        fm[worker].append(
+            "%s %s %s %s for level %s"
+            % (
+                datetime.now(timezone.utc),
+                work_id,
+                "request",
+                "move" + again,
+                work["work"]["level"],
             )
+        )
 
-        return web.json_response(work, status=202)
-    except asyncio.QueueEmpty:
-        # There was no new work in the queue. Ok
-        # Now let see are there any long time pending work in app[fishnet_works_key]
-        # (in case when worker grabbed it from queue but not responded after MOVE_WORK_TIME_OUT secs)
-        now = monotonic()
-        for work_id in app_state.fishnet_works:
-            work = app_state.fishnet_works[work_id]
-            if work["work"]["type"] == "move" and (now - work["time"] > MOVE_WORK_TIME_OUT):
-                fm[worker].append(
-                    "%s %s %s %s for level %s"
-                    % (
-                        datetime.now(timezone.utc),
-                        work_id,
-                        "request",
-                        "move AGAIN",
-                        work["work"]["level"],
-                    )
-                )
-                return web.json_response(work, status=202)
-        return web.Response(status=204)
+    return web.json_response(work, status=202)
 
 
 async def fishnet_acquire(request):
@@ -142,7 +126,12 @@ async def fishnet_analysis(request):
     if key not in FISHNET_KEYS:
         return web.Response(status=404)
 
-    work = app_state.fishnet_works[work_id]
+    works = app_state.fishnet_works
+    if work_id not in works or works.leased_to_other(work_id, key):
+        # finished by an other worker, dropped or handed out again after its lease expired
+        return web.Response(status=204)
+
+    work = works[work_id]
     app_state.fishnet_monitor[worker].append(
         "%s %s %s" % (datetime.now(timezone.utc), work_id, "analysis")
     )
@@ -151,44 +140,46 @@ async def fishnet_analysis(request):
     game = await load_game(app_state, gameId)
 
     username = work["username"]
+    keys = game_position_keys(game)
+    new_data = {}
 
     length = len(data["analysis"])
     for j, analysis in enumerate(reversed(data["analysis"])):
         i = length - j - 1
-        if analysis is not None:
-            try:
-                if "analysis" not in game.steps[i]:
-                    # TODO: save PV only for inaccuracy, mistake and blunder
-                    # see https://github.com/lichess-org/lila/blob/master/modules/analyse/src/main/Advice.scala
-                    game.steps[i]["analysis"] = {
-                        "s": analysis["score"],
-                        "d": analysis["depth"],
-                        "p": analysis["pv"],
-                    }
-                else:
-                    continue
-            except KeyError:
-                game.steps[i]["analysis"] = {
-                    "s": analysis["score"],
-                }
-
-            ply = str(i)
-            # response = {"type": "roundchat", "user": bot_name, "room": "spectator", "message": ply + " " + json.dumps(analysis)}
-            # await user_ws.send_json(response)
+        if analysis is None or analysis.get("skipped"):
+            continue
+        if game.steps[i].get("analysis") is not None:
+            continue
 
-            response = {
-                "type": "analysis",
-                "ply": ply,
-                "color": "w" if i % 2 == 0 else "b",
-                "ceval": game.steps[i]["analysis"],
+        try:
+            # TODO: save PV only for inaccuracy, mistake and blunder
+            # see https://github.com/lichess-org/lila/blob/master/modules/analyse/src/main/Advice.scala
+            ceval = {
+                "s": analysis["score"],
+                "d": analysis["depth"],
+                "p": analysis["pv"],
             }
-            await app_state.users[username].send_game_message(gameId, response)
+        except KeyError:
+            ceval = {
+                "s": analysis["score"],
+            }
+
+        game.steps[i]["analysis"] = ceval
+        app_state.analysis_cache.put(keys[i], ceval)
+        new_data["a.%s" % i] = ceval
+
+        await send_analysis(app_state, username, game, i)
+
+    # the game document got the analysis array in handle_analysis(), set the new plies only
+    if new_data:
+        await app_state.db.game.find_one_and_update({"_id": game.id}, {"$set": new_data})
 
     # remove completed work
     if all(data["analysis"]):
-        del app_state.fishnet_works[work_id]
-        new_data = {"a": [step["analysis"] for step in game.steps]}
-        await app_state.db.game.find_one_and_update({"_id": game.id}, {"$set": new_data})
+        works.release(work_id)
+        del works[work_id]
+    else:
+        works.renew(work_id)
 
     return web.Response(status=204)
 
@@ -208,15 +199,18 @@ async def fishnet_move(request):
         "%s %s %s" % (datetime.now(timezone.utc), work_id, "move")
     )
 
-    if work_id not in app_state.fishnet_works:
+    # finished by an other worker, dropped or handed out again after its lease expired
+    works = app_state.fishnet_works
+    if work_id not in works or works.leased_to_other(work_id, key):
         response = await get_work(app_state, data)
         return response
 
-    work = app_state.fishnet_works[work_id]
+    work = works[work_id]
     gameId = work["game_id"]
 
     # remove work from works
-    del app_state.fishnet_works[work_id]
+    works.release(work_id)
+    del works[work_id]
 
     game = await load_game(app_state, gameId)
     if game is None:
@@ -259,7 +253,7 @@ async def fishnet_abort(request):
         log.debug("Worker %s was already removed", key)
 
     # re-schedule the job
-    app_state.fishnet_queue.put_nowait((ANALYSIS, work_id))
+    app_state.fishnet_works.requeue(work_id)
 
     if len(app_state.workers) == 0:
         app_state.users["Fairy-Stockfish"].online = False
@@ -284,3 +278,8 @@ async def fishnet_monitor(request):
         if app_state.fishnet_monitor[worker]
     }
     return web.json_response(workers, dumps=partial(json.dumps, default=datetime.isoformat))
+
+
+async def fishnet_metrics(request):
+    app_state = get_app_state(request.app)
+    return web.json_response(app_state.fishnet_works.metrics())
@@ -0,0 +1,180 @@
+from __future__ import annotations
+import asyncio
+import heapq
+from collections import Counter, deque
+from itertools import count
+from time import monotonic
+
+from const import ANALYSIS, MOVE, STARTED
+from logger import log
+
+# Seconds a worker has to answer a work before it is handed out again.
+# Partial analysis results renew the lease of analysis works.
+LEASE_TIME = {MOVE: 5.0, ANALYSIS: 120.0}
+
+# Works leased this many times without a result are dropped,
+# except move works of running games, their bot would never move again
+MAX_LEASES = 3
+
+# Number of recent lease latencies kept for the metrics
+LATENCY_SAMPLES = 100
+
+WORK_TYPES = {"move": MOVE, "analysis": ANALYSIS}
+
+
+class Lease:
+    __slots__ = "lease_id", "work_id", "worker", "acquired", "deadline"
+
+    def __init__(self, lease_id, work_id, worker, acquired, deadline):
+        self.lease_id = lease_id
+        self.work_id = work_id
+        self.worker = worker
+        self.acquired = acquired
+        self.deadline = deadline
+
+
+class FishnetWorks(dict):
+    """
+    Pending fishnet works by work id, their priority queue and their leases
+
+    A work taken from the queue is leased to the worker until its deadline. Lease deadlines
+    are kept in a heap, so finding the expired ones doesn't need to check every pending work.
+    Expired works are put back to the queue, or dropped after MAX_LEASES attempts.
+    """
+
+    def __init__(self, games=None):
+        super().__init__()
+        self.games = {} if games is None else games  # {game_id: Game, ...} to check move works
+        self.queue = asyncio.PriorityQueue()  # (priority, work_id) items
+        self.queued = Counter()  # {priority: number of queued works, ...}
+        self.leases: dict[str, Lease] = {}  # {work_id: Lease, ...}
+        self.deadlines: list[tuple] = []  # heap of (deadline, lease_id, work_id)
+        self.attempts = Counter()  # {work_id: number of leases, ...}
+        self.lease_ids = count(1)
+        self.latencies = {MOVE: deque([], LATENCY_SAMPLES), ANALYSIS: deque([], LATENCY_SAMPLES)}
+        self.requeued = 0
+        self.dropped = 0
+
+    def __delitem__(self, work_id):
+        super().__delitem__(work_id)
+        self.leases.pop(work_id, None)
+        self.attempts.pop(work_id, None)
+
+    def pop(self, work_id, *args):
+        if work_id in self:
+            work = self[work_id]
+            del self[work_id]
+            return work
+        return super().pop(work_id, *args)
+
+    def clear(self):
+        super().clear()
+        self.leases.clear()
+        self.attempts.clear()
+
+    @staticmethod
+    def priority(work):
+        return WORK_TYPES[work["work"]["type"]]
+
+    def put(self, work):
+        self[work["work"]["id"]] = work
+        self.enqueue(work["work"]["id"])
+
+    def enqueue(self, work_id):
+        priority = self.priority(self[work_id])
+        self.queued[priority] += 1
+        self.queue.put_nowait((priority, work_id))
+
+    def next_work_id(self):
+        """Return the id of the next work to hand out, or None if there is no waiting work"""
+        self.expire()
+        while True:
+            try:
+                priority, work_id = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+            self.queue.task_done()
+            self.queued[priority] -= 1
+            # skip finished and dropped works
+            if work_id in self and work_id not in self.leases:
+                return work_id
+
+    def lease(self, work_id, worker) -> Lease:
+        now = monotonic()
+        deadline = now + LEASE_TIME[self.priority(self[work_id])]
+        lease = Lease(next(self.lease_ids), work_id, worker, now, deadline)
+        self.leases[work_id] = lease
+        self.attempts[work_id] += 1
+        heapq.heappush(self.deadlines, (deadline, lease.lease_id, work_id))
+        return lease
+
+    def leased_to_other(self, work_id, worker):
+        """True if the work is leased to an other worker, so the result of this one is late"""
+        lease = self.leases.get(work_id)
+        return lease is not None and lease.worker != worker
+
+    def renew(self, work_id):
+        """Extend the lease of a work the worker is still working on"""
+        lease = self.leases.get(work_id)
+        if lease is not None:
+            lease.deadline = monotonic() + LEASE_TIME[self.priority(self[work_id])]
+            heapq.heappush(self.deadlines, (lease.deadline, lease.lease_id, work_id))
+
+    def release(self, work_id):
+        """End the lease of a work answered by the worker"""
+        lease = self.leases.pop(work_id, None)
+        if lease is not None:
+            self.latencies[self.priority(self[work_id])].append(monotonic() - lease.acquired)
+        return lease
+
+    def requeue(self, work_id):
+        """Put a leased work back to the queue, e.g. when the worker aborted it"""
+        if self.leases.pop(work_id, None) is not None:
+            self.requeued += 1
+            self.enqueue(work_id)
+
+    def expire(self):
+        """Requeue or drop the works with expired leases"""
+        now = monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, lease_id, work_id = heapq.heappop(self.deadlines)
+            lease = self.leases.get(work_id)
+            if lease is None or lease.lease_id != lease_id or lease.deadline != deadline:
+                # released or renewed lease
+                continue
+
+            if self.attempts[work_id] >= MAX_LEASES and not self.game_waits_for(work_id):
+                log.warning(
+                    "Fishnet work %s dropped after %s leases", work_id, self.attempts[work_id]
+                )
+                del self[work_id]
+                self.dropped += 1
+            else:
+                self.requeue(work_id)
+
+    def game_waits_for(self, work_id):
+        """True if the work is a move work of a running game"""
+        work = self[work_id]
+        if self.priority(work) != MOVE:
+            return False
+        game = self.games.get(work.get("game_id"))
+        return game is not None and game.status <= STARTED
+
+    def metrics(self):
+        self.expire()
+        latencies = {}
+        for priority, samples in self.latencies.items():
+            name = "move" if priority == MOVE else "analysis"
+            latencies[name] = {
+                "n": len(samples),
+                "avg": round(sum(samples) / len(samples), 3) if samples else None,
+                "max": round(max(samples), 3) if samples else None,
+            }
+        return {
+            "works": len(self),
+            "queued": {"move": self.queued[MOVE], "analysis": self.queued[ANALYSIS]},
+            "leased": len(self.leases),
+            "requeued": self.requeued,
+            "dropped": self.dropped,
+            "leaseLatency": latencies,
+        }
@@ -26,18 +26,19 @@ from const import (
     RATED,
     IMPORTED,
     HIGHSCORE_MIN_GAMES,
-    MAX_HIGHSCORE_ITEM_LIMIT,
     MAX_CHAT_LINES,
     TYPE_CHECKING,
 )
 from convert import grand2zero, uci2usi, mirror5, mirror9
 from fairy import get_fog_fen, get_san_moves, NOTATION_SAN, FairyBoard, BLACK, WHITE
+from generate_highscore import update_highscore
 from glicko2.glicko2 import gl2
 from draw import reject_draw
 from settings import URI
 from spectators import spectators
 from logger import log
 from variants import get_server_variant, GRANDS
+from variant_stats import inc_variant_stats
 
 if TYPE_CHECKING:
     from pychess_global_app_state import PychessGlobalAppState
@@ -148,14 +149,14 @@ class Game:
         self.clocks_w = [clocks_init]
         self.clocks_b = [clocks_init]
 
+        self.id = gameId
+
         self.lastmove = None
         self.check = False
         self.status = CREATED
         self.result = "*"
         self.last_server_clock = monotonic()
 
-        self.id = gameId
-
         self.fow = variant == "fogofwar"
 
         self.n_fold_is_draw = self.variant in (
@@ -547,6 +548,8 @@ class Game:
                     {"_id": self.id}, {"$set": new_data}
                 )
 
+            await inc_variant_stats(self.app_state, self)
+
     def set_crosstable(self):
         if (
             (not self.has_crosstable)
@@ -609,22 +612,7 @@ class Game:
         return (0, 0)
 
     async def set_highscore(self, variant, chess960, value):
-        self.app_state.highscore[variant + ("960" if chess960 else "")].update(value)
-        new_data = {
-            "scores": dict(
-                self.app_state.highscore[variant + ("960" if chess960 else "")].items()[
-                    :MAX_HIGHSCORE_ITEM_LIMIT
-                ]
-            )
-        }
-        try:
-            await self.app_state.db.highscore.find_one_and_update(
-                {"_id": variant + ("960" if chess960 else "")},
-                {"$set": new_data},
-                upsert=True,
-            )
-        except Exception:
-            log.error("Failed to save new %s highscore to mongodb!", variant)
+        await update_highscore(self.app_state, variant + ("960" if chess960 else ""), value)
 
     async def update_ratings(self):
         if self.result == "1-0":
@@ -686,6 +674,15 @@ class Game:
     def is_player(self, user: User) -> bool:
         return user.username in (self.wplayer.username, self.bplayer.username)
 
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+        self.app_state.live_games.update(self)
+
     @property
     def fen(self):
         return self.board.fen
@@ -1012,7 +1009,9 @@ class Game:
             count_started = -1
             count_ended = -1
 
-        if self.analysis is not None:
+        # analysis arrays of unfinished fishnet analyses have None (or are missing)
+        # for the plies without result, they must not become step["analysis"]
+        if self.analysis and self.analysis[0] is not None:
             self.steps[0]["analysis"] = self.analysis[0]
 
         self.board.fen = self.board.initial_fen
@@ -1060,10 +1059,8 @@ class Game:
                 self.steps.append(step)
 
                 if (self.analysis is not None) and (not self.usi_format):
-                    try:
+                    if ply + 1 < len(self.analysis) and self.analysis[ply + 1] is not None:
                         self.steps[-1]["analysis"] = self.analysis[ply + 1]
-                    except IndexError:
-                        log.error("IndexError in create_steps() %d %s %s", ply, move, san)
 
             except Exception:
                 log.exception(
@@ -2,86 +2,29 @@ from __future__ import annotations
 
 import asyncio
 import json
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from functools import partial
 
 import aiohttp_session
 from aiohttp import web
 from aiohttp_sse import sse_response
-import pymongo
 
 from compress import C2R, decode_move_standard
-from const import DARK_FEN, STARTED, MATE, INVALIDMOVE, VARIANTEND, CLAIM
+from const import DARK_FEN, IMPORTED, STARTED, MATE, INVALIDMOVE, VARIANTEND, CLAIM
 from convert import zero2grand
+from indexes import month_range
 from settings import ADMINS
-from tournament.tournaments import get_tournament_name
+from tournament.tournaments import get_tournament_names
 from utils import pgn
 from pychess_global_app_state_utils import get_app_state
 from logger import log
 from variants import C2V, GRANDS, get_server_variant, VARIANTS
+from variant_stats import get_variant_stats_docs
 
 GAME_PAGE_SIZE = 12
 
-
-async def variant_counts_aggregation(app_state, humans, query_period=None):
-    pipeline = [
-        {
-            "$group": {
-                "_id": {
-                    "p": {"$dateToString": {"format": "%Y%m", "date": "$d"}},
-                    "v": "$v",
-                    "z": "$z",
-                },
-                "c": {"$sum": 1},
-            }
-        },
-        {"$sort": {"_id": 1}},
-    ]
-
-    match_cond = {}
-
-    if query_period is not None:
-        year, month = int(query_period[:4]), int(query_period[4:])
-        match_cond["$expr"] = {
-            "$and": [
-                {"$eq": [{"$month": "$d"}, month]},
-                {"$eq": [{"$year": "$d"}, year]},
-            ]
-        }
-
-    if humans:
-        match_cond["$and"] = [
-            {"us.0": {"$nin": ["Fairy-Stockfish", "Random-Mover"]}},
-            {"us.1": {"$nin": ["Fairy-Stockfish", "Random-Mover"]}},
-        ]
-
-    if len(match_cond) > 0:
-        pipeline.insert(0, {"$match": match_cond})
-
-    cursor = await app_state.db.game.aggregate(pipeline)
-
-    docs = []
-
-    cur_period = datetime.now().isoformat()[:7].replace("-", "")
-
-    async for doc in cursor:
-        # print(doc)
-        period = doc["_id"]["p"]
-        if period < "201907":
-            continue
-        # skip current period
-        if period == cur_period:
-            break
-
-        docs.append(doc)
-
-    if docs:
-        if humans:
-            await app_state.db.stats_humans.insert_many(docs)
-        else:
-            await app_state.db.stats.insert_many(docs)
-
-    return docs
+# number of game documents fetched from mongodb at once while streaming
+STREAM_BATCH_SIZE = 100
 
 
 def variant_counts_from_docs(variant_counts, docs):
@@ -115,29 +58,8 @@ async def get_variant_stats(request):
         series = stats[cur_period]
     else:
         variant_counts = {variant: [] for variant in VARIANTS}
-        if humans:
-            n = await app_state.db.stats_humans.count_documents({})
-        else:
-            n = await app_state.db.stats.count_documents({})
-
-        if n > 0:
-            # We already have some stats
-            if humans:
-                cursor = app_state.db.stats_humans.find()
-            else:
-                cursor = app_state.db.stats.find()
-            cursor.sort("_id", pymongo.ASCENDING)
-            docs = await cursor.to_list(n)
-            variant_counts_from_docs(variant_counts, docs)
-
-            # If cur_period is missing from the stats we call the aggregation
-            if docs[-1]["_id"]["p"] != cur_period:
-                docs = await variant_counts_aggregation(app_state, humans, cur_period)
-                variant_counts_from_docs(variant_counts, docs)
-        else:
-            # Call the aggregation on the whole games collection
-            docs = await variant_counts_aggregation(app_state, humans)
-            variant_counts_from_docs(variant_counts, docs)
+        docs = await get_variant_stats_docs(app_state, humans, cur_period)
+        variant_counts_from_docs(variant_counts, docs)
 
         series = [{"name": variant, "data": variant_counts[variant]} for variant in VARIANTS]
 
@@ -299,20 +221,6 @@ async def get_user_games(request):
                 continue
 
             doc["r"] = C2R[doc["r"]]
-            doc["wt"] = (
-                app_state.users[doc["us"][0]].title if doc["us"][0] in app_state.users else ""
-            )
-            doc["bt"] = (
-                app_state.users[doc["us"][1]].title if doc["us"][1] in app_state.users else ""
-            )
-
-            if len(doc["us"]) > 2:
-                doc["wtB"] = (
-                    app_state.users[doc["us"][2]].title if doc["us"][2] in app_state.users else ""
-                )
-                doc["btB"] = (
-                    app_state.users[doc["us"][3]].title if doc["us"][3] in app_state.users else ""
-                )
 
             server_variant = get_server_variant(variant, bool(doc.get("z", 0)))
             if server_variant.two_boards:
@@ -327,24 +235,10 @@ async def get_user_games(request):
             if variant in GRANDS and doc["lm"] != "":
                 doc["lm"] = zero2grand(doc["lm"])
 
-            tournament_id = doc.get("tid")
-            if tournament_id is not None:
-                doc["tn"] = await get_tournament_name(request, tournament_id)
-
             doc["initialFen"] = doc.get("if", "")
 
             if uci_moves:
-                game_doc_list.append(
-                    {
-                        "id": doc["_id"],
-                        "variant": variant,
-                        "is960": doc.get("z", 0),
-                        "users": doc["us"],
-                        "result": doc["r"],
-                        "fen": doc.get("f"),
-                        "moves": [*map(decode_method, doc["m"])],
-                    }
-                )
+                game_doc_list.append(uci_game_json(doc, decode_method))
             else:
                 if doc["s"] <= STARTED and variant == "fogofwar":
                     doc["f"] = DARK_FEN
@@ -353,9 +247,135 @@ async def get_user_games(request):
 
                 game_doc_list.append(doc)
 
+        if not uci_moves:
+            await add_titles_and_tournament_names(request, game_doc_list)
+
     return web.json_response(game_doc_list, dumps=partial(json.dumps, default=datetime.isoformat))
 
 
+def uci_game_json(doc, decode_method):
+    """Game document converted for the puzzle generator (doc v and r are already decoded)"""
+    return {
+        "id": doc["_id"],
+        "variant": doc["v"],
+        "is960": doc.get("z", 0),
+        "users": doc["us"],
+        "result": doc["r"],
+        "fen": doc.get("f"),
+        "moves": [*map(decode_method, doc["m"])],
+    }
+
+
+async def stream_user_games(request):
+    """
+    Stream the games of a user as newline delimited JSON with UCI move lists
+
+    Games are sent oldest first, one per line, so the whole history never has to be
+    held in memory. An interrupted download can be resumed by sending the "date" and "id"
+    of the last received game as since= and id= query parameters.
+    """
+    app_state = get_app_state(request.app)
+    profileId = request.match_info.get("profileId")
+
+    if profileId not in app_state.users:
+        await asyncio.sleep(3)
+        return web.json_response({})
+
+    # Who made the request?
+    session = await aiohttp_session.get_session(request)
+    session_user = session.get("user_name")
+    user = await app_state.users.get(session_user)
+    if user.anon:
+        await asyncio.sleep(3)
+        return web.json_response({})
+
+    query = request.rel_url.query
+    filter_cond = {"us": profileId, "y": {"$ne": IMPORTED}}
+
+    variant = query.get("variant")
+    if variant is not None:
+        if variant not in VARIANTS:
+            return web.json_response({"error": "Unknown variant %s" % variant}, status=400)
+        variant960 = variant.endswith("960")
+        v = get_server_variant(variant[:-3] if variant960 else variant, variant960)
+        filter_cond["v"] = v.code
+        filter_cond["z"] = 1 if variant960 else 0
+
+    since = query.get("since")
+    if since is not None:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return web.json_response({"error": "Invalid since date %s" % since}, status=400)
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+
+        last_id = query.get("id")
+        if last_id is None:
+            filter_cond["d"] = {"$gt": since}
+        else:
+            filter_cond["$or"] = [
+                {"d": {"$gt": since}},
+                {"d": since, "_id": {"$gt": last_id}},
+            ]
+
+    response = web.StreamResponse()
+    response.content_type = "application/x-ndjson"
+    await response.prepare(request)
+
+    cursor = app_state.db.game.find(filter_cond)
+    cursor.sort([("d", 1), ("_id", 1)]).batch_size(STREAM_BATCH_SIZE)
+    try:
+        async for doc in cursor:
+            # filter out private games
+            if doc.get("p") == 1 and session_user not in doc["us"]:
+                continue
+
+            try:
+                variant = C2V[doc["v"]]
+            except KeyError:
+                log.error("stream_user_games() KeyError. Unknown variant %r", doc["v"])
+                continue
+            doc["v"] = variant
+            doc["r"] = C2R[doc["r"]]
+
+            decode_method = get_server_variant(variant, bool(doc.get("z", 0))).move_decoding
+            game = uci_game_json(doc, decode_method)
+            game["date"] = doc["d"]
+
+            # write() waits for the transport to drain, so a slow client slows down the cursor
+            line = json.dumps(game, default=datetime.isoformat) + "\n"
+            await response.write(line.encode())
+    except ConnectionResetError:
+        log.debug("stream_user_games() client disconnected")
+        return response
+
+    await response.write_eof()
+    return response
+
+
+async def add_titles_and_tournament_names(request, docs):
+    """Resolve player titles and tournament names of a whole game list page at once"""
+    app_state = get_app_state(request.app)
+
+    usernames = {username for doc in docs for username in doc["us"]}
+    titles = await app_state.users.get_titles(usernames)
+
+    tournament_ids = {doc["tid"] for doc in docs if doc.get("tid") is not None}
+    tournament_names = await get_tournament_names(request, tournament_ids)
+
+    for doc in docs:
+        doc["wt"] = titles[doc["us"][0]]
+        doc["bt"] = titles[doc["us"][1]]
+        if len(doc["us"]) > 2:
+            doc["wtB"] = titles[doc["us"][2]]
+            doc["btB"] = titles[doc["us"][3]]
+
+        tournament_id = doc.get("tid")
+        if tournament_id is not None:
+            doc["tn"] = tournament_names[tournament_id]
+
+
 async def cancel_invite(request):
     app_state = get_app_state(request.app)
     gameId = request.match_info.get("gameId")
@@ -414,11 +434,11 @@ async def subscribe_games(request):
 
 async def get_games(request):
     app_state = get_app_state(request.app)
-    games = app_state.games.values()
     variant = request.match_info.get("variant")
     chess960 = variant.endswith("960") if variant else False
     if chess960:
         variant = variant[:-3]
+    games = app_state.live_games.newest(variant, chess960)
     return web.json_response(
         [
             {
@@ -439,9 +459,7 @@ async def get_games(request):
                 "day": game.base if game.corr else 0,
             }
             for game in games
-            if game.status == STARTED
-            and ((game.variant == variant and game.chess960 == chess960) if variant else True)
-        ][-20:]
+        ]
     )
 
 
@@ -468,12 +486,10 @@ async def export(request):
     elif session_user in ADMINS:
         yearmonth = request.match_info.get("yearmonth")
         print("---", yearmonth[:4], yearmonth[4:])
+        start, end = month_range(int(yearmonth[:4]), int(yearmonth[4:]))
         filter_cond = {
-            "$and": [
-                {"$expr": {"s": {"$gt": STARTED}}},  # prevent leaking ongoing fogofwar game info
-                {"$expr": {"$eq": [{"$year": "$d"}, int(yearmonth[:4])]}},
-                {"$expr": {"$eq": [{"$month": "$d"}, int(yearmonth[4:])]}},
-            ]
+            "s": {"$gt": STARTED},  # prevent leaking ongoing fogofwar game info
+            "d": {"$gte": start, "$lt": end},
         }
         cursor = app_state.db.game.find(filter_cond)
 
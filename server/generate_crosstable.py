@@ -1,82 +1,230 @@
 from __future__ import annotations
+from datetime import datetime, timedelta, timezone
 
+from bulk_update import bulk_update
+from const import ABORTED
+from indexes import month_range
+from logger import log
 from variants import TWO_BOARD_VARIANT_CODES
 
+# Number of latest game results kept in crosstable documents
+CROSSTABLE_RESULTS = 20
 
-async def generate_crosstable(app_state, username=None):
-    db = app_state.db
-    ct = {}
+# Number of player pairs whose games are read with one query in incremental mode
+CROSSTABLE_PAIRS_PER_QUERY = 100
+
+CROSSTABLE_WATERMARK = "crosstable"
+
+# (s1, s2) scores by crosstable result tail
+RESULT_SCORES = {"+": (10, 0), "-": (0, 10), "=": (5, 5)}
+
+NOT_IN_CROSSTABLE = ("Random-Mover", "Fairy-Stockfish")
+
+
+def crosstable_result(doc):
+    """Return (ct_id, s1, s2, result) of a game document or None if it doesn't count"""
+    if doc["v"] in TWO_BOARD_VARIANT_CODES:
+        return None  # todo:bughouse has no crosstable implemented at the moment
+
+    game_id = doc["_id"]
+    wp, bp = doc["us"]
+    result = doc["r"]
 
-    if username is None:
-        cursor = db.game.find().sort("d")
+    # R2C = {"1-0": "a", "0-1": "b", "1/2-1/2": "c", "*": "d"}
+    if (
+        result == "d"
+        or wp.startswith("Anon")
+        or bp.startswith("Anon")
+        or wp in NOT_IN_CROSSTABLE
+        or bp in NOT_IN_CROSSTABLE
+    ):
+        return None
+
+    if wp < bp:
+        s1p = wp
+        s2p = bp
+    else:
+        s1p = bp
+        s2p = wp
+    ct_id = s1p + "/" + s2p
+
+    if result == "c":
+        tail = "="
+    elif (result == "a" and s1p == wp) or (result == "b" and s1p == bp):
+        tail = "+"
     else:
-        cursor = db.game.find({"us": username}).sort("d")
-        print("START generate_crosstable", username)
+        tail = "-"
+
+    s1, s2 = RESULT_SCORES[tail]
+    return ct_id, s1, s2, "%s%s" % (game_id, tail)
+
+
+def add_to_crosstable(ct, doc):
+    row = crosstable_result(doc)
+    if row is None:
+        return
+    ct_id, s1, s2, result = row
+
+    if ct_id not in ct:
+        ct[ct_id] = {"_id": ct_id, "s1": s1, "s2": s2, "r": [result]}
+    else:
+        ct[ct_id]["s1"] += s1
+        ct[ct_id]["s2"] += s2
+        ct[ct_id]["r"].append(result)
+        ct[ct_id]["r"] = ct[ct_id]["r"][-CROSSTABLE_RESULTS:]
+
+
+async def generate_crosstable(app_state, username=None, incremental=False):
+    """
+    Regenerate crosstable documents from the game collection
+
+    With username given only the crosstables of this user are recomputed.
+    With incremental=True only the crosstables of pairs who played games after the stored
+    watermark are recomputed, otherwise the whole crosstable collection is rebuilt.
+    """
+    if username is not None:
+        await generate_user_crosstable(app_state, username)
+        return
+
+    db = app_state.db
+    if incremental:
+        watermark = await db.watermark.find_one({"_id": CROSSTABLE_WATERMARK})
+        if watermark is None:
+            log.warning("No crosstable watermark found. Rebuilding the whole crosstable.")
+            incremental = False
+
+    if not incremental:
+        await db.crosstable.drop()
+        await db.watermark.delete_one({"_id": CROSSTABLE_WATERMARK})
+        watermark = None
+
+    await update_crosstable(app_state, watermark)
+    print("DONE generate_crosstable", "incremental" if incremental else "")
+
+
+async def generate_user_crosstable(app_state, username):
+    db = app_state.db
+    ct: dict[str, dict] = {}
 
+    print("START generate_crosstable", username)
+    cursor = db.game.find({"us": username}).sort("d")
     async for doc in cursor:
-        if doc["v"] in TWO_BOARD_VARIANT_CODES:
-            continue  # todo:bughouse has no crosstable implemented at the moment
+        add_to_crosstable(ct, doc)
+
+    await bulk_update(
+        db.crosstable, {key: {"$set": value} for key, value in ct.items()}, upsert=True
+    )
+    print("DONE generate_crosstable", username)
 
-        game_id = doc["_id"]
-        wp, bp = doc["us"]
-        result = doc["r"]
 
-        if wp < bp:
-            s1p = wp
-            s2p = bp
-        else:
-            s1p = bp
-            s2p = wp
-        ct_id = s1p + "/" + s2p
-        # print(ct_id, game_id)
-        # R2C = {"1-0": "a", "0-1": "b", "1/2-1/2": "c", "*": "d"}
-        if (
-            result == "d"
-            or wp.startswith("Anon")
-            or bp.startswith("Anon")
-            or wp == "Random-Mover"
-            or wp == "Fairy-Stockfish"
-            or bp == "Random-Mover"
-            or bp == "Fairy-Stockfish"
-        ):
-            continue
-
-        if result == "c":
-            s1 = s2 = 5
-            tail = "="
-        elif (result == "a" and s1p == wp) or (result == "b" and s1p == bp):
-            s1 = 10
-            s2 = 0
-            tail = "+"
+def may_finish(doc, now):
+    """True if an unfinished game may still get a result (see init_from_db())"""
+    if doc["r"] != "d" or doc["s"] >= ABORTED:
+        return False
+    return doc.get("c", False) or doc["d"] >= now - timedelta(days=1)
+
+
+async def update_crosstable(app_state, watermark=None):
+    """
+    Walk games newer than the watermark month by month, so we never keep more than
+    one month of crosstable changes in memory.
+
+    Without a watermark every month is added to the (empty) crosstable collection.
+    With a watermark the crosstables of the pairs found in a month are recomputed from
+    all of their games instead, because Game.save_crosstable() has already applied
+    most of these games live and the saved documents can't tell which ones.
+
+    After every month the watermark is moved forward, but never past a game that
+    is still in play, so its result is picked up when a later run finds it finished.
+    """
+    db = app_state.db
+
+    if watermark is None:
+        first_game = await db.game.find_one({}, sort=[("d", 1)])
+        if first_game is None:
+            return
+        date = first_game["d"]
+        rebuild = True
+    else:
+        date = watermark["d"]
+        rebuild = False
+
+    year, month = date.year, date.month
+    now = datetime.now(timezone.utc)
+    unfinished = None
+
+    while (year, month) <= (now.year, now.month):
+        start, end = month_range(year, month)
+        if watermark is None:
+            filter_cond = {"d": {"$gte": start, "$lt": end}}
         else:
-            s1 = 0
-            s2 = 10
-            tail = "-"
-
-        if ct_id not in ct:
-            ct[ct_id] = {
-                "_id": ct_id,
-                "s1": s1,
-                "s2": s2,
-                "r": ["%s%s" % (game_id, tail)],
+            filter_cond = {
+                "d": {"$lt": end},
+                "$or": [
+                    {"d": {"$gt": watermark["d"]}},
+                    {"d": watermark["d"], "_id": {"$gt": watermark["gid"]}},
+                ],
             }
+
+        ct: dict[str, dict] = {}
+        last_doc = None
+        cursor = db.game.find(filter_cond).sort([("d", 1), ("_id", 1)])
+        async for doc in cursor:
+            add_to_crosstable(ct, doc)
+            last_doc = doc
+            if unfinished is None and may_finish(doc, now):
+                unfinished = doc
+
+        if ct:
+            if rebuild:
+                await merge_crosstable(db, ct)
+            else:
+                await recompute_crosstable(db, ct)
+
+        if unfinished is not None:
+            # "" is lower than any game id, so the next run starts with this game
+            saved_watermark = {"d": unfinished["d"], "gid": ""}
+        elif last_doc is not None:
+            saved_watermark = {"d": last_doc["d"], "gid": last_doc["_id"]}
         else:
-            ct[ct_id]["s1"] += s1
-            ct[ct_id]["s2"] += s2
-            ct[ct_id]["r"].append("%s%s" % (game_id, tail))
+            saved_watermark = None
 
-    for i, item in enumerate(sorted(ct.values(), key=lambda x: x["_id"])):
-        # print(i, item)
-        ct[item["_id"]]["r"] = ct[item["_id"]]["r"][-20:]
-        # print(i, item)
+        if saved_watermark is not None:
+            await db.watermark.update_one(
+                {"_id": CROSSTABLE_WATERMARK}, {"$set": saved_watermark}, upsert=True
+            )
+        if last_doc is not None:
+            watermark = {"d": last_doc["d"], "gid": last_doc["_id"]}
 
-    if username is None:
-        await db.crosstable.drop()
-        # bulk insert to crosstable
-        if len(ct) > 0:
-            await db.crosstable.insert_many(ct.values())
-    else:
-        for key, value in ct.items():
-            # print(key, value)
-            await db.crosstable.find_one_and_update({"_id": key}, {"$set": value}, upsert=True)
-    print("DONE generate_crosstable", username)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+async def merge_crosstable(db, ct):
+    """Add partial crosstables to the saved ones with one unordered bulk write"""
+    updates = {
+        ct_id: {
+            "$inc": {"s1": value["s1"], "s2": value["s2"]},
+            "$push": {"r": {"$each": value["r"], "$slice": -CROSSTABLE_RESULTS}},
+        }
+        for ct_id, value in ct.items()
+    }
+    await bulk_update(db.crosstable, updates, upsert=True)
+
+
+async def recompute_crosstable(db, ct):
+    """Replace the saved crosstables of the given pairs with ones computed from all their games"""
+    ct_ids = list(ct)
+    for i in range(0, len(ct_ids), CROSSTABLE_PAIRS_PER_QUERY):
+        pairs = [ct_id.split("/", 1) for ct_id in ct_ids[i : i + CROSSTABLE_PAIRS_PER_QUERY]]
+        filter_cond = {
+            "$or": [{"us": [p1, p2]} for p1, p2 in pairs] + [{"us": [p2, p1]} for p1, p2 in pairs]
+        }
+
+        recomputed: dict[str, dict] = {}
+        cursor = db.game.find(filter_cond).sort([("d", 1), ("_id", 1)])
+        async for doc in cursor:
+            add_to_crosstable(recomputed, doc)
+
+        await bulk_update(
+            db.crosstable, {key: {"$set": value} for key, value in recomputed.items()}, upsert=True
+        )
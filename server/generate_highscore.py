@@ -1,39 +1,77 @@
 from __future__ import annotations
+import asyncio
 from decimal import Decimal
 from operator import neg
 
 from sortedcollections import ValueSortedDict
 
-from const import HIGHSCORE_MIN_GAMES, MAX_HIGHSCORE_ITEM_LIMIT
+from const import HIGHSCORE_MIN_GAMES, MAX_HIGHSCORE_ITEM_LIMIT, TYPE_CHECKING
+from logger import log
 from variants import VARIANTS
 
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
 
-async def generate_highscore(app_state, one_variant=None):
+
+async def generate_highscore(app_state: PychessGlobalAppState, one_variant=None):
     variants = VARIANTS if one_variant is None else (one_variant,)
+    await asyncio.gather(*(generate_variant_highscore(app_state, variant) for variant in variants))
+
+
+async def generate_variant_highscore(app_state: PychessGlobalAppState, variant):
     db = app_state.db
 
-    for variant in variants:
-        # print(variant)
-        d = "perfs.%s.gl.d" % variant
-        r = "perfs.%s.gl.r" % variant
-        nb = "perfs.%s.nb" % variant
-        filt = {
-            d: {"$lt": 350},
-            "enabled": {"$ne": False},
-            nb: {"$gte": HIGHSCORE_MIN_GAMES},
-        }
-
-        scores = {}
-        cursor = db.user.find(filt, sort=[(r, -1)], limit=MAX_HIGHSCORE_ITEM_LIMIT)
-        async for doc in cursor:
-            _id = "%s|%s" % (doc["_id"], doc["title"])
-            scores[_id] = int(round(Decimal(doc["perfs"][variant]["gl"]["r"]), 0))
-
-        if len(scores) > 0:
-            # update app_state
-            app_state.highscore[variant] = ValueSortedDict(neg, scores)
-
-            # insert/update to db.highscore
-            await db.highscore.find_one_and_update(
-                {"_id": variant}, {"$set": {"scores": scores}}, upsert=True
-            )
+    d = "perfs.%s.gl.d" % variant
+    r = "perfs.%s.gl.r" % variant
+    nb = "perfs.%s.nb" % variant
+    filt = {
+        d: {"$lt": 350},
+        "enabled": {"$ne": False},
+        nb: {"$gte": HIGHSCORE_MIN_GAMES},
+    }
+
+    scores = {}
+    cursor = db.user.find(filt, sort=[(r, -1)], limit=MAX_HIGHSCORE_ITEM_LIMIT)
+    async for doc in cursor:
+        _id = "%s|%s" % (doc["_id"], doc["title"])
+        scores[_id] = int(round(Decimal(doc["perfs"][variant]["gl"]["r"]), 0))
+
+    if len(scores) > 0:
+        # update app_state
+        app_state.highscore[variant] = ValueSortedDict(neg, scores)
+        app_state.trophies.update_highscore(variant, app_state.highscore[variant])
+
+        # insert/update to db.highscore
+        await db.highscore.find_one_and_update(
+            {"_id": variant}, {"$set": {"scores": scores}}, upsert=True
+        )
+
+
+async def update_highscore(app_state: PychessGlobalAppState, variant, scores):
+    """
+    Add new "username|title": rating scores to a variant highscore list
+
+    The in memory list is kept at MAX_HIGHSCORE_ITEM_LIMIT length, and only the changed
+    entries of the db.highscore document are $set/$unset instead of rewriting the whole list.
+    """
+    hs = app_state.highscore[variant]
+    hs.update(scores)
+
+    dropped = []
+    while len(hs) > MAX_HIGHSCORE_ITEM_LIMIT:
+        dropped.append(hs.popitem()[0])
+    app_state.trophies.update_highscore(variant, hs)
+
+    new_data = {}
+    changed = {"scores.%s" % key: value for key, value in scores.items() if key in hs}
+    if changed:
+        new_data["$set"] = changed
+    if dropped:
+        new_data["$unset"] = {"scores.%s" % key: "" for key in dropped}
+    if not new_data:
+        return
+
+    try:
+        await app_state.db.highscore.update_one({"_id": variant}, new_data, upsert=True)
+    except Exception:
+        log.error("Failed to save new %s highscore to mongodb!", variant)
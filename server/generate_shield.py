@@ -27,3 +27,4 @@ async def generate_shield(app_state: PychessGlobalAppState):
             app_state.shield_owners[variant] = app_state.shield[variant][0][0]
         else:
             app_state.shield_owners[variant] = "Fairy-Stockfish"
+        app_state.trophies.set_shield_owner(variant, app_state.shield_owners[variant])
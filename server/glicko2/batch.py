@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized Glicko2.rate() for many one game rating periods at once
+
+Every array element is one (rating, [(score, other_rating)]) series as rated by
+Game.update_ratings(), so the result is the same as calling Glicko2.rate() element by element.
+"""
+import numpy as np
+
+from glicko2.glicko2 import EPSILON, MAX_SIGMA, MIN_MU, MIN_PHI, MU, TAU
+
+RATIO = 173.7178
+# Length of a rating period in days, see pre_rating_RD()
+RATING_PERIOD_DAYS = 4.665
+MAX_PHI = 350.0 / RATIO
+
+
+def determine_sigma(phi, sigma, difference, variance, tau=TAU, epsilon=EPSILON):
+    """Glicko2.determine_sigma() Illinois iteration running until every element converged"""
+    difference_squared = difference**2
+    phi_variance = phi**2 + variance
+    alpha = np.log(sigma**2)
+
+    def f(x):
+        tmp = phi_variance + np.exp(x)
+        return np.exp(x) * (difference_squared - tmp) / (2 * tmp**2) - (x - alpha) / tau**2
+
+    a = alpha.copy()
+    b = np.empty_like(alpha)
+    big = difference_squared > phi_variance
+    b[big] = np.log(difference_squared[big] - phi_variance[big])
+
+    small = ~big
+    k = np.ones_like(alpha)
+    while True:
+        step = small & (f(alpha - k * tau) < 0)
+        if not step.any():
+            break
+        k[step] += 1
+    b[small] = alpha[small] - k[small] * tau
+
+    f_a, f_b = f(a), f(b)
+    active = np.abs(b - a) > epsilon
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while active.any():
+            c = a + (a - b) * f_a / (f_b - f_a)
+            f_c = f(c)
+            flip = active & (f_c * f_b < 0)
+            f_a = np.where(flip, f_b, np.where(active, f_a / 2, f_a))
+            a = np.where(flip, b, a)
+            b = np.where(active, c, b)
+            f_b = np.where(active, f_c, f_b)
+            active = np.abs(b - a) > epsilon
+
+    return np.exp(a / 2)
+
+
+def rate_batch(mu, phi, sigma, other_mu, other_phi, score, days, tau=TAU, epsilon=EPSILON):
+    """
+    Rate many players against one opponent each
+
+    mu, phi, sigma, other_mu, other_phi are on the original (1500 based) scale,
+    score is WIN/DRAW/LOSS and days is the time passed since the player's last rated game.
+    Returns the (mu, phi, sigma) arrays of the new ratings.
+    """
+    mu = (np.asarray(mu, dtype=float) - MU) / RATIO
+    phi = np.asarray(phi, dtype=float) / RATIO
+    sigma = np.asarray(sigma, dtype=float)
+    other_mu = (np.asarray(other_mu, dtype=float) - MU) / RATIO
+    other_phi = np.asarray(other_phi, dtype=float) / RATIO
+    score = np.asarray(score, dtype=float)
+    days = np.asarray(days, dtype=float)
+
+    impact = 1.0 / np.sqrt(1 + (3 * other_phi**2) / (np.pi**2))
+    expected_score = 1.0 / (1 + np.exp(-impact * (mu - other_mu)))
+    variance = 1.0 / (impact**2 * expected_score * (1 - expected_score))
+    difference = variance * impact * (score - expected_score)
+
+    sigma = determine_sigma(phi, sigma, difference, variance, tau, epsilon)
+
+    periods = np.maximum(1, days / RATING_PERIOD_DAYS)
+    phi_star = np.minimum(np.sqrt(phi**2 + periods * sigma**2), MAX_PHI)
+
+    phi = 1.0 / np.sqrt(1 / phi_star**2 + 1 / variance)
+    mu = mu + phi**2 * (difference / variance)
+
+    return (
+        np.maximum(mu * RATIO + MU, MIN_MU),
+        np.maximum(phi * RATIO, MIN_PHI),
+        np.minimum(sigma, MAX_SIGMA),
+    )
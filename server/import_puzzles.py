@@ -1,43 +1,207 @@
-import os
+"""
+Import puzzles from a JSON lines file to the puzzle collection
+
+    python server/import_puzzles.py puzzles.json
+    python server/import_puzzles.py puzzles.json -n       # dry run, validate only
+    python server/import_puzzles.py puzzles.json -a       # not only puzzles having "uploaded_by"
+
+Lines are read in chunks and validated (known variant, valid FEN, legal solution moves)
+with FairyBoard in a process pool. Valid puzzles are upserted with unordered bulk writes,
+rejected lines and lines that failed to be written are written to <json file>.rejected
+with the line number and the reason.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
 import json
+import os
 import sys
-import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from pymongo import AsyncMongoClient
+
+from bulk_update import bulk_update
+from fairy import FEN_OK, FairyBoard, validate_fen
+from settings import MONGO_DB_NAME, MONGO_HOST
+from variants import VARIANTS
+
+# Number of lines validated by one process pool job
+CHUNK_SIZE = 500
+
+WRITE_BATCH_SIZE = 1000
+
+REQUIRED_FIELDS = ("_id", "variant", "fen", "moves")
+
+
+def solution_moves(variant, moves):
+    """Split the comma separated puzzle solution to FairyBoard moves"""
+    parts = moves.split(",")
+    if variant == "duck":
+        # a duck move is a piece move and a duck move
+        return [",".join(parts[i : i + 2]) for i in range(0, len(parts), 2)]
+    return parts
+
+
+def validate_puzzle(doc):
+    """Return the reason why the puzzle is invalid, or None if it is valid"""
+    if not isinstance(doc, dict):
+        return "not a JSON object"
 
-from motor import motor_asyncio as ma
+    missing = [field for field in REQUIRED_FIELDS if not doc.get(field)]
+    if missing:
+        return "missing %s" % ", ".join(missing)
 
-MONGO_HOST = os.getenv("MONGO_HOST")
+    variant = doc["variant"]
+    if variant not in VARIANTS or variant.endswith("960"):
+        return "unknown variant %s" % variant
 
+    # pyffish doesn't accept the duck square in FEN, see sanitize_fen()
+    if variant != "duck" and validate_fen(doc["fen"], variant, False) != FEN_OK:
+        return "invalid FEN"
 
-async def upsert_from_json(json_file):
-    client = ma.AsyncIOMotorClient(MONGO_HOST)
-    db = client["pychess-variants"]
+    board = FairyBoard(variant, initial_fen=doc["fen"])
+    for i, move in enumerate(solution_moves(variant, doc["moves"])):
+        if move not in board.legal_moves():
+            return "illegal move %s (%s)" % (move, i + 1)
+        board.push(move)
+    return None
 
-    i = 0
-    with open(json_file) as p:
-        for line in p:
-            i += 1
+
+def validate_lines(lines, uploaded_only=False):
+    """
+    Validate a chunk of (line number, line) pairs in a worker process
+    Returns the (line number, doc) of the valid puzzles and the (line number, reason, line)
+    of the rejected ones.
+    """
+    docs, rejected = [], []
+    for lineno, line in lines:
+        if not line.strip():
+            continue
+        try:
             doc = json.loads(line)
-            if "uploaded_by" in doc:
-                print(i)
-                try:
-                    # puzzle = await db.puzzle.find_one({"_id": doc["_id"]})
-                    # if puzzle is not None:
-                    #    print("EXISTS!", doc["_id"])
+        except ValueError as e:
+            rejected.append((lineno, "invalid JSON: %s" % e, line))
+            continue
+
+        if uploaded_only and isinstance(doc, dict) and "uploaded_by" not in doc:
+            continue
+
+        try:
+            reason = validate_puzzle(doc)
+        except Exception as e:
+            reason = "validation failed: %s" % e
+        if reason is None:
+            docs.append((lineno, doc))
+        else:
+            rejected.append((lineno, reason, line))
+    return docs, rejected
+
+
+def read_chunks(json_file):
+    with open(json_file) as f:
+        lines = enumerate(f, start=1)
+        while chunk := list(islice(lines, CHUNK_SIZE)):
+            yield chunk
+
+
+async def upsert_puzzles(db, docs):
+    """Upsert (line number, doc) pairs, return the (line number, reason, line) of failed ones"""
+    failed = []
+    for i in range(0, len(docs), WRITE_BATCH_SIZE):
+        batch = docs[i : i + WRITE_BATCH_SIZE]
+        failed_ids = await bulk_update(
+            db.puzzle, {doc["_id"]: {"$set": doc} for _, doc in batch}, upsert=True
+        )
+        failed += [
+            (lineno, "write failed", json.dumps(doc))
+            for lineno, doc in batch
+            if doc["_id"] in failed_ids
+        ]
+    return failed
+
 
-                    await db.puzzle.find_one_and_update(
-                        {"_id": doc["_id"]}, {"$set": doc}, upsert=True
-                    )
-                except Exception:
-                    print("   ERROR", doc["_id"])
+async def import_puzzles(json_file, rejected_file, dry_run, uploaded_only, workers):
+    client = AsyncMongoClient(MONGO_HOST, tz_aware=True)
+    db = client[MONGO_DB_NAME]
 
-    client.close()
+    loop = asyncio.get_running_loop()
+    start = datetime.now()
+    nb_lines = nb_valid = nb_rejected = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(rejected_file, "w") as report:
+        # keep a limited number of chunks in flight, the file may not fit into memory
+        pending = []
+        chunks = read_chunks(json_file)
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                job = loop.run_in_executor(pool, validate_lines, chunk, uploaded_only)
+                pending.append((chunk[-1][0], job))
+            if not pending:
+                break
+
+            nb_lines, job = pending.pop(0)
+            docs, rejected = await job
+            if docs and not dry_run:
+                failed = await upsert_puzzles(db, docs)
+                rejected += failed
+                nb_valid -= len(failed)
+
+            for lineno, reason, line in rejected:
+                report.write("%s\t%s\t%s\n" % (lineno, reason, line.rstrip("\n")))
+
+            nb_valid += len(docs)
+            nb_rejected += len(rejected)
+            print(
+                "%s lines read, %s valid, %s rejected (%s)"
+                % (nb_lines, nb_valid, nb_rejected, datetime.now() - start),
+                flush=True,
+            )
+
+    print(
+        "%s %s puzzles, %s rejected lines written to %s"
+        % ("Validated" if dry_run else "Imported", nb_valid, nb_rejected, rejected_file)
+    )
+    await client.close()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Missing json file name")
-        sys.exit()
-    elif not sys.argv[1].endswith(".json"):
+    parser = argparse.ArgumentParser(description="Import puzzles from a JSON lines file")
+    parser.add_argument("json_file", help="*.json file with one puzzle document per line")
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Validate the puzzles, but don't write them to the puzzle collection.",
+    )
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help='Import every puzzle, not only the ones having an "uploaded_by" field.',
+    )
+    parser.add_argument(
+        "-r", "--rejected", help="Rejected lines report file. Default: <json_file>.rejected"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of validator processes. Default: number of CPUs",
+    )
+    args = parser.parse_args()
+
+    if not args.json_file.endswith(".json"):
         print("*.json needed")
         sys.exit()
-    asyncio.run(upsert_from_json(sys.argv[1]))
+
+    rejected_file = args.rejected or args.json_file + ".rejected"
+    asyncio.run(
+        import_puzzles(args.json_file, rejected_file, args.dry_run, not args.all, args.workers)
+    )
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from const import CREATED, STARTED, IMPORTED, RATED, T_CREATED, T_STARTED
+from logger import log
+
+# A mongodb index we want to exist. keys is a list of (field, direction) pairs
+# as accepted by create_index(), options are passed to create_index() as is.
+IndexSpec = namedtuple("IndexSpec", "collection, keys, options")
+
+# A query our code actually runs. The filter and sort should mirror the call site
+# (using sample values), so that explain() can tell us which index the planner picks.
+QueryShape = namedtuple("QueryShape", "name, collection, filter, sort")
+
+
+def index_spec(collection, keys, **options):
+    if isinstance(keys, str):
+        keys = [(keys, 1)]
+    return IndexSpec(collection, keys, options)
+
+
+INDEXES = (
+    # game_api.get_user_games() "all", stream_user_games() and export of a given user
+    index_spec("game", [("us", 1), ("d", -1), ("_id", -1)]),
+    # get_user_games() win/loss/rated/playing/me filters on one color
+    index_spec("game", [("us.0", 1), ("d", -1)]),
+    index_spec("game", [("us.1", 1), ("d", -1)]),
+    # get_user_games() perf/{variant} and games/json listing
+    index_spec("game", [("us.0", 1), ("v", 1), ("z", 1), ("d", -1)]),
+    index_spec("game", [("us.1", 1), ("v", 1), ("z", 1), ("d", -1)]),
+    # get_user_games() imported games
+    index_spec("game", [("by", 1), ("d", -1)]),
+    # tournament games listing and export
+    index_spec("game", "tid"),
+    # monthly export and crosstable regeneration
+    index_spec("game", [("d", -1), ("_id", -1)]),
+    # loading unfinished games in init_from_db() and other ad hoc queries
+    index_spec("game", "r"),
+    index_spec("game", "v"),
+    index_spec("game", "y"),
+    index_spec("game", "c"),
+    index_spec("tournament", "startsAt"),
+    index_spec("tournament", "status"),
+    index_spec("tournament_player", "tid"),
+    # leaderboard pages and player ranks of lazy loaded finished tournaments
+    index_spec("tournament_player", [("tid", 1), ("s", -1), ("e", -1)]),
+    index_spec("tournament_pairing", [("tid", 1), ("d", 1)]),
+    # games of one player in lazy loaded finished tournaments
+    index_spec("tournament_pairing", [("tid", 1), ("u", 1), ("d", 1)]),
+    index_spec("tournament_chat", "tid"),
+    index_spec("user", [("oauth_id", 1), ("oauth_provider", 1)]),
+    # variant_stats counters upsert and monthly stats
+    index_spec("stats_counters", [("p", 1), ("v", 1), ("z", 1), ("h", 1)], unique=True),
+    index_spec("notify", "notifies"),
+    index_spec("notify", "expireAt", expireAfterSeconds=0),
+    index_spec("seek", "expireAt", expireAfterSeconds=0),
+    index_spec("blog", "date"),
+    # PuzzleSelector id lists
+    index_spec("puzzle", "variant"),
+)
+
+_PROFILE = "profile"
+_OTHER = "other"
+
+
+def _not_imported(filter_cond):
+    return {"$and": [filter_cond, {"y": {"$ne": IMPORTED}}]}
+
+
+def month_range(year, month):
+    """Return the [start, end) datetime interval of a given month.
+    Date range filters can use the "d" index, $year/$month expressions can't."""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+_START, _END = month_range(2024, 1)
+
+QUERY_SHAPES = (
+    QueryShape("user_games_all", "game", _not_imported({"us": _PROFILE}), [("d", -1)]),
+    QueryShape(
+        "user_games_win",
+        "game",
+        _not_imported({"$or": [{"r": "a", "us.0": _PROFILE}, {"r": "b", "us.1": _PROFILE}]}),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_loss",
+        "game",
+        _not_imported({"$or": [{"r": "a", "us.1": _PROFILE}, {"r": "b", "us.0": _PROFILE}]}),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_rated",
+        "game",
+        _not_imported({"$or": [{"y": RATED, "us.1": _PROFILE}, {"y": RATED, "us.0": _PROFILE}]}),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_playing",
+        "game",
+        _not_imported(
+            {
+                "$and": [
+                    {"$or": [{"c": True, "us.1": _PROFILE}, {"c": True, "us.0": _PROFILE}]},
+                    {"s": STARTED},
+                ]
+            }
+        ),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_me",
+        "game",
+        _not_imported(
+            {"$or": [{"us.0": _OTHER, "us.1": _PROFILE}, {"us.1": _OTHER, "us.0": _PROFILE}]}
+        ),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_perf",
+        "game",
+        _not_imported(
+            {
+                "$or": [
+                    {"v": "n", "z": 0, "us.1": _PROFILE},
+                    {"v": "n", "z": 0, "us.0": _PROFILE},
+                ]
+            }
+        ),
+        [("d", -1)],
+    ),
+    QueryShape(
+        "user_games_stream",
+        "game",
+        {
+            "us": _PROFILE,
+            "y": {"$ne": IMPORTED},
+            "$or": [{"d": {"$gt": _START}}, {"d": _START, "_id": {"$gt": "gameid12"}}],
+        },
+        [("d", 1), ("_id", 1)],
+    ),
+    QueryShape("user_games_import", "game", {"by": _PROFILE, "y": IMPORTED}, [("d", -1)]),
+    QueryShape("tournament_games", "game", {"tid": "tid12345"}, None),
+    QueryShape(
+        "rebuild_ratings",
+        "game",
+        {"y": RATED, "r": {"$in": ["a", "b", "c"]}, "v": {"$in": ["n", "h"]}},
+        [("d", 1), ("_id", 1)],
+    ),
+    QueryShape("export_user", "game", {"us": _PROFILE}, None),
+    QueryShape(
+        "export_monthly",
+        "game",
+        {"s": {"$gt": STARTED}, "d": {"$gte": _START, "$lt": _END}},
+        None,
+    ),
+    QueryShape(
+        "crosstable_update",
+        "game",
+        {
+            "d": {"$lt": _END},
+            "$or": [{"d": {"$gt": _START}}, {"d": _START, "_id": {"$gt": "gameid12"}}],
+        },
+        [("d", 1), ("_id", 1)],
+    ),
+    QueryShape(
+        "crosstable_pairs",
+        "game",
+        {"$or": [{"us": [_PROFILE, "opponent"]}, {"us": ["opponent", _PROFILE]}]},
+        [("d", 1), ("_id", 1)],
+    ),
+    QueryShape(
+        "unfinished_games", "game", {"r": "d", "$or": [{"s": CREATED}, {"s": STARTED}]}, [("d", -1)]
+    ),
+    QueryShape("tournament_players", "tournament_player", {"tid": "tid12345"}, None),
+    QueryShape("tournament_pairings", "tournament_pairing", {"tid": "tid12345"}, [("d", 1)]),
+    QueryShape(
+        "tournament_players_page",
+        "tournament_player",
+        {"tid": "tid12345", "wd": {"$ne": True}},
+        [("s", -1), ("e", -1)],
+    ),
+    QueryShape(
+        "tournament_player_games",
+        "tournament_pairing",
+        {"tid": "tid12345", "u": _PROFILE},
+        [("d", 1)],
+    ),
+    QueryShape("tournament_chat", "tournament_chat", {"tid": "tid12345"}, None),
+    QueryShape(
+        "scheduled_tournaments",
+        "tournament",
+        {"$or": [{"status": T_STARTED}, {"status": T_CREATED}]},
+        [("startsAt", -1)],
+    ),
+    QueryShape("oauth_user", "user", {"oauth_id": _PROFILE, "oauth_provider": "lichess"}, None),
+    QueryShape(
+        "variant_stats", "stats_counters", {"p": {"$gte": "201907", "$lte": "202401"}}, None
+    ),
+    QueryShape("notifications", "notify", {"notifies": _PROFILE}, None),
+    QueryShape(
+        "puzzle_ids",
+        "puzzle",
+        {"variant": "chess", "cooked": {"$ne": True}, "review": {"$ne": False}},
+        None,
+    ),
+)
+
+
+async def create_indexes(db):
+    """Build every index declared in INDEXES. Existing indexes are left as they are."""
+    for spec in INDEXES:
+        try:
+            await db[spec.collection].create_index(spec.keys, **spec.options)
+        except Exception:
+            log.exception("Failed to create index %s on %s", spec.keys, spec.collection)
+
+
+def plan_stages(plan):
+    """Yield every stage name of an explain() query plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for key in ("inputStage", "queryPlan", "winningPlan"):
+            if key in plan:
+                yield from plan_stages(plan[key])
+        for child in plan.get("inputStages", ()):
+            yield from plan_stages(child)
+    elif isinstance(plan, list):
+        for child in plan:
+            yield from plan_stages(child)
+
+
+async def explain_query_shape(db, shape):
+    cursor = db[shape.collection].find(shape.filter)
+    if shape.sort is not None:
+        cursor = cursor.sort(shape.sort)
+    explain = await cursor.explain()
+    return list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+
+
+async def collscan_query_shapes(db, shapes=QUERY_SHAPES):
+    """Return the names of query shapes the planner can only serve with a collection scan"""
+    failed = []
+    for shape in shapes:
+        stages = await explain_query_shape(db, shape)
+        if "COLLSCAN" in stages:
+            log.warning("Query %s uses COLLSCAN: %s", shape.name, stages)
+            failed.append(shape.name)
+    return failed
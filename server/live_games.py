@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from const import STARTED
+
+# Number of games returned by /api/games
+LIVE_GAMES_LIMIT = 20
+
+
+class LiveGames:
+    """
+    Index of started games in the order they started
+
+    Game.status setters call update() on every status change,
+    so the newest games of a variant can be listed without scanning app_state.games.
+    Games created by load_game() only (f.e. for analysis) aren't in app_state.games,
+    newest() skips and drops them.
+    """
+
+    def __init__(self, app_games=None):
+        self.app_games = {} if app_games is None else app_games  # app_state.games
+        self.games = {}  # {game_id: game, ...}
+        self.variant_games = {}  # {(variant, chess960): {game_id: game, ...}, ...}
+
+    def update(self, game):
+        if game.status == STARTED:
+            self.games[game.id] = game
+            self.variant_games.setdefault((game.variant, game.chess960), {})[game.id] = game
+        else:
+            self.remove(game)
+
+    def remove(self, game):
+        if self.games.get(game.id) is game:
+            del self.games[game.id]
+            del self.variant_games[(game.variant, game.chess960)][game.id]
+
+    def newest(self, variant=None, chess960=False, limit=LIVE_GAMES_LIMIT):
+        """Return the last started games (oldest first)"""
+        if variant is None:
+            games = self.games
+        else:
+            games = self.variant_games.get((variant, chess960), {})
+
+        newest, stale = [], []
+        for game in reversed(games.values()):
+            if game.id not in self.app_games:
+                stale.append(game)
+                continue
+            newest.append(game)
+            if len(newest) == limit:
+                break
+
+        for game in stale:
+            self.remove(game)
+        return newest[::-1]
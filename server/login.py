@@ -327,6 +327,8 @@ async def confirm_username(request):
             }
         )
         print("db insert user result %s" % repr(result.inserted_id))
+        # get_titles() may have cached "" for this username before it was registered
+        app_state.users.set_title(username, title)
 
         # Set session username and clean up OAuth data
         session["user_name"] = username
@@ -18,3 +18,15 @@ async def new_id(table):
         existing = await table.find_one({"_id": {"$eq": new_id}})
         if not existing:
             return new_id
+
+
+async def new_ids(table, count):
+    """Return count different new ids checked against the table with one $in query per round"""
+    ids: set[str] = set()
+    while len(ids) < count:
+        candidates = {id8() for x in range(count - len(ids))} - ids
+        if table is not None:
+            cursor = table.find({"_id": {"$in": list(candidates)}}, projection={"_id": 1})
+            candidates -= {doc["_id"] async for doc in cursor}
+        ids |= candidates
+    return list(ids)
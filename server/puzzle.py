@@ -8,11 +8,15 @@ from aiohttp import web
 
 from mongomock_motor import AsyncMongoMockClient
 
+from const import TYPE_CHECKING
 from fairy import FairyBoard
 from glicko2.glicko2 import MU, gl2, Rating, rating
 from pychess_global_app_state_utils import get_app_state
 from variants import VARIANTS
 
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
+
 # variants having 0 puzzle so far
 NO_PUZZLE_VARIANTS = (
     "antichess",
@@ -32,6 +36,12 @@ NOT_VOTED = 0
 UP = 1
 DOWN = -1
 
+PLAYABLE_PUZZLE = {"cooked": {"$ne": True}, "review": {"$ne": False}}
+
+
+def is_playable(doc):
+    return doc.get("cooked") is not True and doc.get("review") is not False
+
 
 def empty_puzzle(variant):
     puzzle = {
@@ -46,7 +56,7 @@ def empty_puzzle(variant):
 
 
 async def get_puzzle(request, puzzleId):
-    puzzle = await get_app_state(request.app).db.puzzle.find_one({"_id": puzzleId})
+    puzzle = await get_app_state(request.app).puzzle_cache.get(puzzleId)
     return puzzle
 
 
@@ -96,44 +106,40 @@ async def get_daily_puzzle(request):
 
 async def next_puzzle(request, user):
     app_state = get_app_state(request.app)
-    skipped = list(user.puzzles.keys())
-    filters = [
-        {"_id": {"$nin": skipped}},
-        {"cooked": {"$ne": True}},
-        {"review": {"$ne": False}},
-    ]
-    if user.puzzle_variant is not None:
-        variant = user.puzzle_variant
-        filters.append({"variant": variant})
-    else:
-        variant = "chess"
+    variant = user.puzzle_variant
 
     puzzle = None
 
     if app_state.db is not None:
-        pipeline = [
-            {"$match": {"$and": filters}},
-            {"$sample": {"size": 1}},
-        ]
-        cursor = await app_state.db.puzzle.aggregate(pipeline)
-
-        async for doc in cursor:
-            puzzle = {
-                "_id": doc["_id"],
-                "variant": doc["variant"],
-                "fen": doc["fen"],
-                "moves": doc["moves"],
-                "type": doc["type"],
-                "eval": doc["eval"],
-                "site": doc.get("site", ""),
-                "gameId": doc.get("gameId", ""),
-                "played": doc.get("played", 0),
-                "lm": doc.get("lm", ""),
-            }
-            break
+        selector = app_state.puzzle_selector
+        if variant is None:
+            variant = await selector.random_variant(PUZZLE_VARIANTS)
+
+        while variant is not None:
+            rating = user.get_puzzle_rating(variant, False).mu
+            puzzle_id = await selector.next_puzzle_id(user, variant, rating)
+            if puzzle_id is None:
+                break
+
+            # the puzzle may be cooked or deleted since the selector loaded its ids
+            doc = await app_state.puzzle_cache.get(puzzle_id)
+            if doc is not None and is_playable(doc):
+                puzzle = {
+                    "_id": doc["_id"],
+                    "variant": doc["variant"],
+                    "fen": doc["fen"],
+                    "moves": doc["moves"],
+                    "type": doc["type"],
+                    "eval": doc["eval"],
+                    "site": doc.get("site", ""),
+                    "gameId": doc.get("gameId", ""),
+                    "played": doc.get("played", 0),
+                    "lm": doc.get("lm", ""),
+                }
+                break
 
     if puzzle is None:
-        puzzle = empty_puzzle(variant)
+        puzzle = empty_puzzle("chess" if variant is None else variant)
 
     return puzzle
 
@@ -145,9 +151,9 @@ async def puzzle_complete(request):
     rated = post_data["rated"] == "true"
 
     puzzle_data = await get_puzzle(request, puzzleId)
-    puzzle = Puzzle(app_state.db, puzzle_data)
+    puzzle = Puzzle(app_state, puzzle_data)
 
-    await puzzle.set_played()
+    puzzle.set_played()
 
     # Who made the request?
     session = await aiohttp_session.get_session(request)
@@ -202,14 +208,13 @@ async def puzzle_vote(request):
 
     user = await app_state.users.get(session_user)
 
-    if user.puzzles.get("puzzleId"):
+    if user.puzzles.get(puzzleId):
         return web.json_response({})
     else:
-        user.puzzles["puzzleId"] = UP if good else DOWN
+        user.puzzles[puzzleId] = UP if good else DOWN
 
-    db = app_state.db
-    if db is not None:
-        await db.puzzle.find_one_and_update({"_id": puzzleId}, {"$inc": {up_or_down: 1}})
+    if app_state.db is not None:
+        app_state.puzzle_cache.inc(puzzleId, up_or_down)
 
     return web.json_response({})
 
@@ -247,8 +252,8 @@ def default_puzzle_perf(puzzle_eval):
 
 
 class Puzzle:
-    def __init__(self, db, puzzle_data):
-        self.db = db
+    def __init__(self, app_state: PychessGlobalAppState, puzzle_data):
+        self.app_state = app_state
         self.puzzle_data = puzzle_data
         self.puzzleId = puzzle_data["_id"]
         self.perf = puzzle_data.get("perf", default_puzzle_perf(puzzle_data["eval"]))
@@ -268,13 +273,9 @@ class Puzzle:
             "nb": nb + 1,
         }
 
-        if self.db is not None:
-            await self.db.puzzle.find_one_and_update(
-                {"_id": self.puzzleId}, {"$set": {"perf": self.perf}}
-            )
+        if self.app_state.db is not None:
+            self.app_state.puzzle_cache.set_perf(self.puzzleId, self.perf)
 
-    async def set_played(self):
-        if self.db is not None:
-            await self.db.puzzle.find_one_and_update(
-                {"_id": self.puzzleId}, {"$set": {"played": self.puzzle_data.get("played", 0) + 1}}
-            )
+    def set_played(self):
+        if self.app_state.db is not None:
+            self.app_state.puzzle_cache.inc(self.puzzleId, "played")
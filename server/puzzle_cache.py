@@ -0,0 +1,128 @@
+from __future__ import annotations
+import asyncio
+from collections import Counter, OrderedDict
+
+from bulk_update import bulk_update
+from const import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
+    from user import User
+
+# Number of puzzle documents kept in memory
+PUZZLE_CACHE_SIZE = 2000
+
+# Seconds pending puzzle counters and ratings wait before they are written to mongodb
+PUZZLE_FLUSH_DELAY = 30
+
+
+class PuzzleCache:
+    """
+    LRU cache of the recently used puzzle documents and their pending writes
+
+    Plays and votes are collected as $inc counters, puzzle perfs and user pperfs
+    as the last value set, so popular puzzles (like the daily one) cause one read
+    and one write per flush instead of one read and several writes per completion.
+    Pending changes are applied to the cached documents immediately.
+    """
+
+    def __init__(self, app_state: PychessGlobalAppState, size=PUZZLE_CACHE_SIZE):
+        self.app_state = app_state
+        self.size = size
+        self.docs: OrderedDict[str, dict] = OrderedDict()  # {puzzle_id: doc, ...}
+        self.counters: dict[str, Counter] = {}  # {puzzle_id: Counter(played=n, up=n, ...), ...}
+        self.perfs: dict[str, dict] = {}  # {puzzle_id: perf, ...}
+        self.users: dict[str, User] = {}  # {username: user, ...} users with pending pperfs
+        self.flush_task = None
+
+    def __len__(self):
+        return len(self.counters) + len(self.perfs) + len(self.users)
+
+    async def get(self, puzzle_id):
+        doc = self.docs.get(puzzle_id)
+        if doc is not None:
+            self.docs.move_to_end(puzzle_id)
+            return doc
+
+        doc = await self.app_state.db.puzzle.find_one({"_id": puzzle_id})
+        if doc is None:
+            return None
+
+        # the doc may be evicted and reloaded before its pending changes were written
+        for field, value in self.counters.get(puzzle_id, {}).items():
+            doc[field] = doc.get(field, 0) + value
+        if puzzle_id in self.perfs:
+            doc["perf"] = self.perfs[puzzle_id]
+
+        self.docs[puzzle_id] = doc
+        if len(self.docs) > self.size:
+            self.docs.popitem(last=False)
+        return doc
+
+    def discard(self, puzzle_id):
+        self.docs.pop(puzzle_id, None)
+        self.counters.pop(puzzle_id, None)
+        self.perfs.pop(puzzle_id, None)
+
+    def inc(self, puzzle_id, field):
+        """Increment the played/up/down counter of the puzzle"""
+        doc = self.docs.get(puzzle_id)
+        if doc is not None:
+            doc[field] = doc.get(field, 0) + 1
+        self.counters.setdefault(puzzle_id, Counter())[field] += 1
+        self.schedule_flush()
+
+    def set_perf(self, puzzle_id, perf):
+        doc = self.docs.get(puzzle_id)
+        if doc is not None:
+            doc["perf"] = perf
+        self.perfs[puzzle_id] = perf
+        self.schedule_flush()
+
+    def set_user_pperfs(self, user: User):
+        """Save user.pperfs with the next flush"""
+        self.users[user.username] = user
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.delayed_flush(), name="puzzle-cache-flush")
+
+    async def delayed_flush(self):
+        await asyncio.sleep(PUZZLE_FLUSH_DELAY)
+        # changes made while we write are flushed by a new task
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.app_state.db is None or len(self) == 0:
+            return
+
+        db = self.app_state.db
+        counters, self.counters = self.counters, {}
+        perfs, self.perfs = self.perfs, {}
+        users, self.users = self.users, {}
+
+        puzzle_updates = {}
+        for puzzle_id, counter in counters.items():
+            puzzle_updates[puzzle_id] = {"$inc": dict(counter)}
+        for puzzle_id, perf in perfs.items():
+            puzzle_updates.setdefault(puzzle_id, {})["$set"] = {"perf": perf}
+
+        user_updates = {
+            username: {"$set": {"pperfs": user.pperfs}} for username, user in users.items()
+        }
+
+        failed = await bulk_update(db.puzzle, puzzle_updates)
+        for puzzle_id in failed:
+            if puzzle_id in counters:
+                self.counters.setdefault(puzzle_id, Counter()).update(counters[puzzle_id])
+            if puzzle_id in perfs:
+                self.perfs.setdefault(puzzle_id, perfs[puzzle_id])
+
+        failed = await bulk_update(db.user, user_updates)
+        for username in failed:
+            self.users.setdefault(username, users[username])
+
+        if len(self) > 0:
+            self.schedule_flush()
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta, timezone
+
+from const import TYPE_CHECKING
+from puzzle import PLAYABLE_PUZZLE, default_puzzle_perf
+
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
+    from user import User
+
+# Width of the puzzle rating buckets
+PUZZLE_RATING_BUCKET = 100
+
+# Puzzle id lists are reloaded from mongodb after this to pick up new/cooked puzzles
+PUZZLE_IDS_TTL = timedelta(hours=1)
+
+# Number of random draws tried in a rating bucket before moving to the next one
+DRAWS_PER_BUCKET = 8
+
+
+def puzzle_rating(doc):
+    perf = doc.get("perf")
+    if perf is None:
+        perf = default_puzzle_perf(doc.get("eval", ""))
+    return perf["gl"]["r"]
+
+
+class PuzzleIds:
+    """Ids of the playable puzzles of one variant sorted by rating and grouped to rating buckets"""
+
+    def __init__(self, generation, rated_ids):
+        rated_ids.sort()
+        self.generation = generation
+        self.loaded_at = datetime.now(timezone.utc)
+        self.ids = [puzzle_id for _, puzzle_id in rated_ids]
+        self.buckets: dict[int, tuple[int, int]] = {}  # {bucket: (start, end), ...}
+        for i, (rating, _) in enumerate(rated_ids):
+            bucket = int(rating) // PUZZLE_RATING_BUCKET
+            start, _ = self.buckets.get(bucket, (i, i))
+            self.buckets[bucket] = (start, i + 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def buckets_around(self, rating):
+        """Yield (start, end) index ranges of the buckets closest to the rating first"""
+        center = int(rating) // PUZZLE_RATING_BUCKET
+        for bucket in sorted(self.buckets, key=lambda bucket: abs(bucket - center)):
+            yield self.buckets[bucket]
+
+
+class PuzzleSelector:
+    """
+    Picks random unseen puzzles close to the user puzzle rating
+
+    Instead of running a $sample aggregation with an ever growing $nin list, the ids of
+    playable puzzles are kept in memory per variant, and every user has a bitset per variant
+    marking the already served puzzles by their index in the variant id list.
+    """
+
+    def __init__(self, app_state: PychessGlobalAppState):
+        self.app_state = app_state
+        self.variants: dict[str, PuzzleIds] = {}
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    async def puzzle_ids(self, variant) -> PuzzleIds:
+        puzzle_ids = self.variants.get(variant)
+        now = datetime.now(timezone.utc)
+        if puzzle_ids is not None and now - puzzle_ids.loaded_at < PUZZLE_IDS_TTL:
+            return puzzle_ids
+
+        async with self.lock:
+            puzzle_ids = self.variants.get(variant)
+            if puzzle_ids is None or now - puzzle_ids.loaded_at >= PUZZLE_IDS_TTL:
+                cursor = self.app_state.db.puzzle.find(
+                    {"variant": variant, **PLAYABLE_PUZZLE},
+                    projection={"perf.gl.r": 1, "eval": 1},
+                )
+                rated_ids = [(puzzle_rating(doc), doc["_id"]) async for doc in cursor]
+                self.generation += 1
+                puzzle_ids = PuzzleIds(self.generation, rated_ids)
+                self.variants[variant] = puzzle_ids
+        return puzzle_ids
+
+    def seen_bitset(self, user: User, variant, puzzle_ids: PuzzleIds) -> bytearray:
+        generation, seen = user.puzzle_seen.get(variant, (None, None))
+        if generation != puzzle_ids.generation:
+            # id list reloaded, indexes changed
+            seen = bytearray((len(puzzle_ids) + 7) // 8)
+            user.puzzle_seen[variant] = (puzzle_ids.generation, seen)
+        return seen
+
+    async def next_puzzle_id(self, user: User, variant, rating):
+        """Return a random puzzle id of the variant not seen by the user, or None if there is none.
+        The returned puzzle is marked as seen."""
+        puzzle_ids = await self.puzzle_ids(variant)
+        seen = self.seen_bitset(user, variant, puzzle_ids)
+
+        for start, end in puzzle_ids.buckets_around(rating):
+            size = end - start
+            # random draws first, then a scan from a random offset for almost fully seen buckets
+            draws = [random.randrange(start, end) for _ in range(min(DRAWS_PER_BUCKET, size))]
+            offset = random.randrange(size)
+            scan = (start + (offset + j) % size for j in range(size))
+            for i in itertools.chain(draws, scan):
+                if seen[i >> 3] & (1 << (i & 7)):
+                    continue
+                seen[i >> 3] |= 1 << (i & 7)
+                if puzzle_ids.ids[i] not in user.puzzles:
+                    return puzzle_ids.ids[i]
+        return None
+
+    async def random_variant(self, variants):
+        """Return a random variant weighted by the number of their puzzles"""
+        sizes = [len(await self.puzzle_ids(variant)) for variant in variants]
+        if sum(sizes) == 0:
+            return None
+        return random.choices(variants, weights=sizes)[0]
@@ -19,6 +19,8 @@ from sortedcollections import ValueSortedDict
 from mongomock_motor import AsyncMongoMockClient
 
 from ai import BOT_task
+from analysis_cache import AnalysisCache
+from auto_pairing_index import AutoPairingIndex
 from const import (
     NONE_USER,
     LANGUAGES,
@@ -34,10 +36,12 @@ from const import (
 )
 from broadcast import round_broadcast
 from discord_bot import DiscordBot, FakeDiscordBot
+from fishnet_works import FishnetWorks
 from game import Game
 from generate_crosstable import generate_crosstable
 from generate_highscore import generate_highscore
 from generate_shield import generate_shield
+from indexes import create_indexes
 from lobby import Lobby
 from tournament.scheduler import (
     MONTHLY_VARIANTS,
@@ -49,7 +53,9 @@ from tournament.scheduler import (
     new_scheduled_tournaments,
     create_scheduled_tournaments,
 )
-from seek import Seek
+from puzzle_cache import PuzzleCache
+from puzzle_selector import PuzzleSelector
+from seek import Seek, Seeks
 from settings import (
     FISHNET_KEYS,
     DISCORD_TOKEN,
@@ -59,21 +65,25 @@ from settings import (
     DEV,
     static_url,
 )
+from tournament.clock_scheduler import TournamentClockScheduler
 from tournament.tournament import Tournament
 from tournament.tournaments import (
     translated_tournament_name,
     get_scheduled_tournaments,
     load_tournament,
 )
+from trophies import Trophies
 from typedefs import anon_as_test_users_key, client_key
 from twitch import Twitch
 from user import User
 from users import Users, NotInDbUsers
 from utils import load_game
+from variant_stats import generate_variant_stats
 from blogs import BLOGS
 from videos import VIDEOS
 from youtube import Youtube
 from lang import LOCALE
+from live_games import LiveGames
 from logger import log
 from variants import VARIANTS, RATED_VARIANTS
 
@@ -92,6 +102,12 @@ class PychessGlobalAppState:
 
         self.db_client = app[client_key]
         self.db = app[db_key]
+
+        # Maintained by the User.online and User.ready_for_auto_pairing setters
+        self.online_users: Set[User] = set()
+        self.online_anons: Set[User] = set()
+        self.auto_pairing_ready_users: Set[User] = set()
+
         self.users = self.__init_users()
         self.disable_new_anons = False
         self.lobby = Lobby(self)
@@ -102,6 +118,7 @@ class PychessGlobalAppState:
         self.tourneynames: dict[str, dict] = {lang: {} for lang in LANGUAGES}
 
         self.tournaments: dict[str, Tournament] = {}
+        self.tournament_clock = TournamentClockScheduler()
 
         self.tourney_calendar = None
 
@@ -109,17 +126,21 @@ class PychessGlobalAppState:
         # TODO: save/restore from db
         self.sent_lichess_team_msg: List[date] = []
 
-        self.seeks: dict[str, Seek] = {}
+        self.seeks: Seeks = Seeks()
         self.auto_pairing_users: dict[User, (int, int)] = {}
-        self.auto_pairings: dict[str, set] = {}
+        self.auto_pairings: dict[tuple, AutoPairingIndex] = {}
         self.games: dict[str, Game] = {}
+        self.live_games = LiveGames(self.games)
         self.invites: dict[str, Seek] = {}
         self.game_channels: Set[queue] = set()
         self.invite_channels: Set[queue] = set()
         self.highscore = {variant: ValueSortedDict(neg) for variant in RATED_VARIANTS}
         self.shield = {}
         self.shield_owners = {}  # {variant: username, ...}
+        self.trophies = Trophies()
         self.daily_puzzle_ids = {}  # {date: puzzle._id, ...}
+        self.puzzle_selector = PuzzleSelector(self)
+        self.puzzle_cache = PuzzleCache(self)
 
         # monthly game stats per variant
         self.stats = {}
@@ -136,10 +157,10 @@ class PychessGlobalAppState:
 
         # fishnet active workers
         self.workers = set()
-        # fishnet works
-        self.fishnet_works = {}
-        # fishnet worker tasks
-        self.fishnet_queue = asyncio.PriorityQueue()
+        # fishnet works, their queue and leases
+        self.fishnet_works = FishnetWorks(self.games)
+        # fishnet analysis results by position
+        self.analysis_cache = AnalysisCache()
         # fishnet workers monitor
         self.fishnet_monitor = self.__init_fishnet_monitor()
         self.fishnet_versions = {}
@@ -166,10 +187,6 @@ class PychessGlobalAppState:
 
             if "tournament_chat" not in db_collections:
                 await self.db.create_collection("tournament_chat")
-                await self.db.tournament_chat.create_index("tid")
-
-            await self.db.tournament.create_index("startsAt")
-            await self.db.tournament.create_index("status")
 
             cursor = self.db.tournament.find(
                 {"$or": [{"status": T_STARTED}, {"status": T_CREATED}]}
@@ -198,10 +215,18 @@ class PychessGlobalAppState:
             async for doc in cursor:
                 if doc["_id"] in VARIANTS:
                     self.highscore[doc["_id"]] = ValueSortedDict(neg, doc["scores"])
+            for variant, hs in self.highscore.items():
+                self.trophies.update_highscore(variant, hs)
 
             if "crosstable" not in db_collections:
                 await generate_crosstable(self)
 
+            # Prevent unit test failure, mongomock aggregate() is not awaitable
+            if "stats_counters" not in db_collections and not isinstance(
+                self.db_client, AsyncMongoMockClient
+            ):
+                await generate_variant_stats(self)
+
             if "dailypuzzle" not in db_collections:
                 try:
                     await self.db.create_collection("dailypuzzle", capped=True, size=50000, max=365)
@@ -233,27 +258,19 @@ class PychessGlobalAppState:
                 docs = await cursor.to_list(length=MAX_CHAT_LINES)
                 self.lobby.lobbychat = docs
 
-            await self.db.game.create_index("us")
-            await self.db.game.create_index("r")
-            await self.db.game.create_index("v")
-            await self.db.game.create_index("y")
-            await self.db.game.create_index("by")
-            await self.db.game.create_index("c")
-
             if "notify" not in db_collections:
                 await self.db.create_collection("notify")
-            await self.db.notify.create_index("notifies")
-            await self.db.notify.create_index("expireAt", expireAfterSeconds=0)
 
             if "seek" not in db_collections:
                 await self.db.create_collection("seek")
-            await self.db.seek.create_index("expireAt", expireAfterSeconds=0)
+
+            await create_indexes(self.db)
 
             # Load auto pairings from database
             async for doc in self.db.autopairing.find():
                 variant_tc = tuple(doc["variant_tc"])
                 if variant_tc not in self.auto_pairings:
-                    self.auto_pairings[variant_tc] = set()
+                    self.auto_pairings[variant_tc] = AutoPairingIndex(variant_tc[0], variant_tc[1])
 
                 for username, rrange in doc["users"]:
                     user = await self.users.get(username)
@@ -340,7 +357,6 @@ class PychessGlobalAppState:
                 if DEV:
                     await self.db.blog.drop()
                 await self.db.blog.insert_many(BLOGS)
-                await self.db.blog.create_index("date")
 
             if "fishnet" in db_collections:
                 cursor = self.db.fishnet.find()
@@ -485,6 +501,7 @@ class PychessGlobalAppState:
 
         if game.id in self.games:
             del self.games[game.id]
+        self.live_games.remove(game)
 
         if game.bot_game:
             try:
@@ -522,6 +539,13 @@ class PychessGlobalAppState:
                 log.debug("saving regular seek to database: %s" % seek)
             await self.db.seek.insert_many(reg_seeks)
 
+        # save pending tournament updates
+        for tournament in self.tournaments.values():
+            await tournament.write_buffer.flush()
+
+        # save pending puzzle plays, votes and ratings
+        await self.puzzle_cache.flush()
+
         # save auto pairings
         await self.db.autopairing.delete_many({})
         auto_pairings = [
@@ -558,10 +582,10 @@ class PychessGlobalAppState:
                         await ws.close()
 
     def online_count(self):
-        return sum((1 for user in self.users.values() if user.online))
+        return len(self.online_users) + len(self.online_anons)
 
     def auto_pairing_count(self):
-        return sum((1 for user in self.auto_pairing_users if user.ready_for_auto_pairing))
+        return len(self.auto_pairing_ready_users)
 
     def __str__(self):
         return self.__stringify(str)
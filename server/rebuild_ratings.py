@@ -0,0 +1,161 @@
+"""
+Recompute user perfs by replaying the rated games of the game collection
+
+    python server/rebuild_ratings.py                # every rated variant
+    python server/rebuild_ratings.py -v crazyhouse960
+    python server/rebuild_ratings.py -v chess -n    # dry run, print the top ratings only
+
+Games are replayed in chronological order. Consecutive games of a variant without a common
+player don't depend on each other, so they are collected into one batch and rated with one
+vectorized rate_batch() call. Run generate_highscore() (admin page) afterwards.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo import AsyncMongoClient, UpdateOne
+
+from compress import R2C
+from const import RATED
+from glicko2.batch import rate_batch
+from glicko2.glicko2 import DRAW, LOSS, MU, PHI, SIGMA, WIN
+from settings import MONGO_DB_NAME, MONGO_HOST
+from variants import RATED_VARIANTS, VARIANTS
+
+WRITE_BATCH_SIZE = 1000
+
+# white player score by game result code
+WHITE_SCORES = {R2C["1-0"]: WIN, R2C["0-1"]: LOSS, R2C["1/2-1/2"]: DRAW}
+
+
+class Perf:
+    __slots__ = "mu", "phi", "sigma", "la", "nb"
+
+    def __init__(self):
+        self.mu = MU
+        self.phi = PHI
+        self.sigma = SIGMA
+        self.la = None
+        self.nb = 0
+
+    def perf_doc(self):
+        return {"gl": {"r": self.mu, "d": self.phi, "v": self.sigma}, "la": self.la, "nb": self.nb}
+
+
+def rate_games(perfs, games):
+    """Rate a batch of games where every player plays only once"""
+    players, others, scores, days = [], [], [], []
+    for date, wp, bp, score in games:
+        for player, other, player_score in ((wp, bp, score), (bp, wp, 1.0 - score)):
+            perf = perfs.setdefault(player, Perf())
+            players.append(perf)
+            others.append(perfs.setdefault(other, Perf()))
+            scores.append(player_score)
+            days.append(0 if perf.la is None else (date - perf.la).total_seconds() / 86400)
+
+    mu, phi, sigma = rate_batch(
+        [perf.mu for perf in players],
+        [perf.phi for perf in players],
+        [perf.sigma for perf in players],
+        [perf.mu for perf in others],
+        [perf.phi for perf in others],
+        scores,
+        days,
+    )
+
+    dates = [date for date, _, _, _ in games for _ in range(2)]
+    for i, perf in enumerate(players):
+        perf.mu, perf.phi, perf.sigma = float(mu[i]), float(phi[i]), float(sigma[i])
+        perf.la = dates[i]
+        perf.nb += 1
+
+
+async def replay_games(db, variants):
+    """Return {variant: {username: Perf}} of the players of the rated games of the given variants.
+    The game collection is read only once, in (d, _id) order for all variants together."""
+    variant_names = {
+        (VARIANTS[variant].code, VARIANTS[variant].chess960): variant for variant in variants
+    }
+    filter_cond = {
+        "y": RATED,
+        "r": {"$in": list(WHITE_SCORES)},
+        "v": {"$in": list({code for code, _ in variant_names})},
+    }
+    cursor = db.game.find(filter_cond, projection={"us": 1, "r": 1, "d": 1, "v": 1, "z": 1})
+    cursor.sort([("d", 1), ("_id", 1)])
+
+    perfs: dict[str, dict[str, Perf]] = {variant: {} for variant in variants}
+    # games and their players waiting to be rated by variant
+    batches: dict[str, tuple[list, set]] = {variant: ([], set()) for variant in variants}
+
+    async for doc in cursor:
+        variant = variant_names.get((doc["v"], bool(doc.get("z", 0))))
+        if variant is None:
+            continue
+
+        wp, bp = doc["us"]
+        games, in_batch = batches[variant]
+        if wp in in_batch or bp in in_batch:
+            rate_games(perfs[variant], games)
+            games, in_batch = [], set()
+            batches[variant] = (games, in_batch)
+
+        date = doc["d"] if doc["d"].tzinfo is not None else doc["d"].replace(tzinfo=timezone.utc)
+        games.append((date, wp, bp, WHITE_SCORES[doc["r"]]))
+        in_batch.update((wp, bp))
+
+    for variant, (games, _) in batches.items():
+        if games:
+            rate_games(perfs[variant], games)
+    return perfs
+
+
+async def save_perfs(db, perf_key, perfs):
+    requests = [
+        UpdateOne({"_id": username}, {"$set": {"perfs.%s" % perf_key: perf.perf_doc()}})
+        for username, perf in perfs.items()
+    ]
+    for i in range(0, len(requests), WRITE_BATCH_SIZE):
+        await db.user.bulk_write(requests[i : i + WRITE_BATCH_SIZE], ordered=False)
+
+
+async def rebuild_ratings(variants, dry_run):
+    client = AsyncMongoClient(MONGO_HOST, tz_aware=True)
+    db = client[MONGO_DB_NAME]
+
+    start = datetime.now()
+    all_perfs = await replay_games(db, variants)
+    print("Replayed %s variants in %s" % (len(variants), datetime.now() - start))
+
+    for variant, perfs in all_perfs.items():
+        print(variant, len(perfs), "players")
+        if dry_run:
+            top = sorted(perfs.items(), key=lambda item: item[1].mu, reverse=True)[:10]
+            for username, perf in top:
+                print("   %s %d (%d games)" % (username, round(perf.mu), perf.nb))
+        else:
+            await save_perfs(db, variant, perfs)
+
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute user ratings from rated games")
+    parser.add_argument(
+        "-v",
+        "--variant",
+        choices=RATED_VARIANTS,
+        help="Variant to recompute (with 960 suffix for 960 variants). Default: all rated variants",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Don't write the new perfs to the user collection, just print the top players.",
+    )
+    args = parser.parse_args()
+
+    variants = RATED_VARIANTS if args.variant is None else (args.variant,)
+    asyncio.run(rebuild_ratings(variants, args.dry_run))
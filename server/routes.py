@@ -17,6 +17,7 @@ from bot_api import (
     bot_analysis,
 )
 from fishnet import (
+    fishnet_metrics,
     fishnet_monitor,
     fishnet_validate_key,
     fishnet_acquire,
@@ -29,6 +30,7 @@ from game_api import (
     get_games,
     get_user_games,
     get_tournament_games,
+    stream_user_games,
     subscribe_games,
     subscribe_invites,
     get_variant_stats,
@@ -181,8 +183,10 @@ get_routes = (
     ("/games/export/{profileId}", export),
     ("/games/export/tournament/{tournamentId}", export),
     ("/games/json/{profileId}", get_user_games),
+    ("/games/ndjson/{profileId}", stream_user_games),
     ("/tournament/json/{tournamentId}", get_tournament_games),
     ("/fishnet/monitor", fishnet_monitor),
+    ("/fishnet/metrics", fishnet_metrics),
     ("/fishnet/key/{key}", fishnet_validate_key),
     ("/robots.txt", robots),
 )
@@ -144,6 +144,73 @@ class Seek:
         return "%s: **%s%s** %s" % (self.creator.username, self.variant, tail960, tc)
 
 
+def seek_key(variant, chess960, base, inc, byoyomi_period, rated):
+    return (variant, bool(chess960), base, inc, byoyomi_period, bool(rated))
+
+
+class Seeks(dict):
+    """
+    {seek_id: seek} dict used for app_state.seeks and user.seeks
+
+    It keeps the seeks also grouped by (variant, chess960, base, inc, byoyomi_period, rated),
+    so seeks with a given time control can be found without scanning all of them,
+    and counts the live and corr seeks it contains.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.by_key: dict[tuple, dict] = {}
+        self.live_count = 0
+        self.corr_count = 0
+
+    def __setitem__(self, seek_id, seek):
+        if seek_id in self:
+            del self[seek_id]
+        super().__setitem__(seek_id, seek)
+        key = seek_key(
+            seek.variant, seek.chess960, seek.base, seek.inc, seek.byoyomi_period, seek.rated
+        )
+        self.by_key.setdefault(key, {})[seek_id] = seek
+        if seek.day == 0:
+            self.live_count += 1
+        else:
+            self.corr_count += 1
+
+    def __delitem__(self, seek_id):
+        seek = self[seek_id]
+        super().__delitem__(seek_id)
+        key = seek_key(
+            seek.variant, seek.chess960, seek.base, seek.inc, seek.byoyomi_period, seek.rated
+        )
+        del self.by_key[key][seek_id]
+        if len(self.by_key[key]) == 0:
+            del self.by_key[key]
+        if seek.day == 0:
+            self.live_count -= 1
+        else:
+            self.corr_count -= 1
+
+    def pop(self, seek_id, *default):
+        if seek_id not in self:
+            if default:
+                return default[0]
+            raise KeyError(seek_id)
+        seek = self[seek_id]
+        del self[seek_id]
+        return seek
+
+    def clear(self):
+        super().clear()
+        self.by_key.clear()
+        self.live_count = 0
+        self.corr_count = 0
+
+    def matching(self, variant, chess960, base, inc, byoyomi_period, rated):
+        """Return the seeks with the given variant and time control in creation order"""
+        key = seek_key(variant, chess960, base, inc, byoyomi_period, rated)
+        return list(self.by_key.get(key, {}).values())
+
+
 async def create_seek(db, invites, seeks, user, data, empty=False):
     """Seek can be
     - invite (has reserved new game id stored in app[invites], and target is 'Invite-friend')
@@ -155,10 +222,9 @@ async def create_seek(db, invites, seeks, user, data, empty=False):
     They can only be created by trusted users
     """
     day = data.get("day", 0)
-    live_seeks = len([seek for seek in user.seeks.values() if seek.day == 0])
-    corr_seeks = len([seek for seek in user.seeks.values() if seek.day != 0])
     if (
-        (live_seeks >= MAX_USER_SEEKS and day == 0) or (corr_seeks >= MAX_USER_SEEKS and day != 0)
+        (user.seeks.live_count >= MAX_USER_SEEKS and day == 0)
+        or (user.seeks.corr_count >= MAX_USER_SEEKS and day != 0)
     ) and not empty:
         return
 
@@ -1,16 +1,21 @@
 from __future__ import annotations
 import time
-from itertools import product
+from itertools import combinations
 
 import rustworkx as rx
 
 from const import ARENA
+from logger import log
 from tournament.tournament import Tournament
 
 
 class ArenaTournament(Tournament):
     system = ARENA
     color_balance_limit = 3
+    # Number of nearest players by rank and by rating considered as opponents in create_pairing()
+    pairing_candidates = 8
+    # Let max_weight_matching() check the optimality of its result (slow, for tests only)
+    verify_pairing = False
 
     def just_played_together(self, x, y):
         # Players can play consecutive games with each other
@@ -64,57 +69,96 @@ class ArenaTournament(Tournament):
             return pairing
 
         rxg = rx.PyGraph()
-        rx_nodes = [rxg.add_node(p.username) for p in waiting_players]
-        # print(rx_nodes)
-        # print("---")
+        rx_nodes = rxg.add_nodes_from([p.username for p in waiting_players])
 
-        sorted_usernames = [p.username for p in self.leaderboard]
-        ranks = [sorted_usernames.index(p.username) + 1 for p in waiting_players]
+        ranks = [self.leaderboard.rank(p) for p in waiting_players]
+        ratings = [self.players[p].rating for p in waiting_players]
         rank_max = max(ranks)
 
         # https://github.com/lichess-org/lila/blob/master/modules/tournament/src/main/arena/PairingSystem.scala
         def rank_factor(rank_a, rank_b):
             return 300 + 1700 * round((rank_max - min(rank_a, rank_b)) / rank_max)
 
-        for pair in product(rx_nodes, rx_nodes):
-            player_a = waiting_players[pair[0]]
-            player_b = waiting_players[pair[1]]
-            if (
-                pair[0] != pair[1]
-                and (not self.just_played_together(player_a, player_b))
-                and (not self.color_balance_problem(player_a, player_b))
-            ):
-                rank_a = ranks[pair[0]]
-                rank_b = ranks[pair[1]]
-                rating_a = self.players[player_a].rating
-                rating_b = self.players[player_b].rating
+        # Every player is a candidate opponent for its nearest neighbours by rank and by rating only,
+        # so the graph has O(n * pairing_candidates) edges instead of O(n^2)
+        candidates = set()
+        for order in (
+            sorted(rx_nodes, key=lambda node: ranks[node]),
+            sorted(rx_nodes, key=lambda node: ratings[node]),
+        ):
+            for pos, node_a in enumerate(order):
+                for node_b in order[pos + 1 : pos + 1 + self.pairing_candidates]:
+                    candidates.add((min(node_a, node_b), max(node_a, node_b)))
+
+        def weighted_edges(pairs):
+            edges = []
+            for node_a, node_b in pairs:
+                player_a = waiting_players[node_a]
+                player_b = waiting_players[node_b]
+                if self.just_played_together(player_a, player_b) or self.color_balance_problem(
+                    player_a, player_b
+                ):
+                    continue
+
+                rank_a = ranks[node_a]
+                rank_b = ranks[node_b]
 
                 # https://github.com/lichess-org/lila/blob/master/modules/tournament/src/main/arena/AntmaPairing.scala
                 weight = abs(rank_a - rank_b) * rank_factor(rank_a, rank_b) + abs(
-                    rating_a - rating_b
+                    ratings[node_a] - ratings[node_b]
                 )
+                edges.append((node_a, node_b, weight))
+            return edges
 
-                rxg.add_edge(pair[0], pair[1], weight)
+        edges = weighted_edges(candidates)
+        rxg.add_edges_from(edges)
 
-        # print(rxg.edge_index_map())
-        # print("---")
+        graph_time = time.time()
 
         matching = rx.max_weight_matching(
-            rxg, max_cardinality=True, weight_fn=lambda x: x, verify_optimum=True
+            rxg,
+            max_cardinality=True,
+            weight_fn=lambda x: x,
+            verify_optimum=self.verify_pairing,
         )
 
-        edges = list(rxg.edge_list())
-        weights = rxg.edges()
+        # Pruning may leave players without any possible opponent among their neighbours
+        # (e.g. all of them were their previous opponents), so players left unmatched
+        # get a second chance against every other unmatched player.
+        matched = {node for pair in matching for node in pair}
+        unmatched = [node for node in rx_nodes if node not in matched]
+        if len(unmatched) > 1:
+            extra_edges = weighted_edges(
+                pair for pair in combinations(unmatched, 2) if pair not in candidates
+            )
+            if extra_edges:
+                rxg.add_edges_from(extra_edges)
+                edges += extra_edges
+
+                # nodes of the unmatched graph carry the index of the node in rxg
+                unmatched_rxg = rx.PyGraph()
+                index = dict(zip(unmatched, unmatched_rxg.add_nodes_from(unmatched)))
+                unmatched_rxg.add_edges_from(
+                    [
+                        (index[node_a], index[node_b], weight)
+                        for node_a, node_b, weight in extra_edges
+                    ]
+                )
+                extra_matching = rx.max_weight_matching(
+                    unmatched_rxg,
+                    max_cardinality=True,
+                    weight_fn=lambda x: x,
+                    verify_optimum=self.verify_pairing,
+                )
+                matching |= {(unmatched_rxg[a], unmatched_rxg[b]) for a, b in extra_matching}
+
         sum_weight = 0
-        for pair in matching:
-            try:
-                ind = edges.index(pair)
-            except ValueError:
-                ind = edges.index((pair[1], pair[0]))
-            sum_weight += weights[ind]
-            print(rxg[pair[0]], rxg[pair[1]], weights[ind])
+        for node_a, node_b in matching:
+            weight = rxg.get_edge_data(node_a, node_b)
+            sum_weight += weight
+            print(rxg[node_a], rxg[node_b], weight)
 
-            pair_them(waiting_players[pair[0]], waiting_players[pair[1]])
+            pair_them(waiting_players[node_a], waiting_players[node_b])
 
         print("len:%s weight_sum:%s" % (len(matching), sum_weight))
 
@@ -124,5 +168,13 @@ class ArenaTournament(Tournament):
         print("======================")
 
         end = time.time()
-        print("PAIRING TIME:", end - start)
+        log.info(
+            "%s pairing: %s waiting players, %s edges, %s pairs, graph %.3fs, matching %.3fs",
+            self.id,
+            nb_waiting_players,
+            len(edges),
+            len(pairing),
+            graph_time - start,
+            end - graph_time,
+        )
         return pairing
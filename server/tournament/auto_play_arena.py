@@ -137,6 +137,7 @@ class TestTournament(Tournament):
 
 class ArenaTestTournament(TestTournament, ArenaTournament):
     system = ARENA
+    verify_pairing = True
 
     def create_pairing(self, waiting_players):
         return ArenaTournament.create_pairing(self, waiting_players)
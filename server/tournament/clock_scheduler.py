@@ -0,0 +1,84 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import traceback
+from datetime import datetime, timezone
+from itertools import count
+
+from logger import log
+
+
+class TournamentClockScheduler:
+    """
+    One asyncio task driving the clock of every loaded tournament
+
+    Tournaments register the time of their next timed event (start, notifications,
+    arena pairing wave, end, pending broadcasts and db writes) with schedule(),
+    and the scheduler calls their clock_tick() only when that time has come.
+    """
+
+    def __init__(self):
+        self.queue: list[tuple] = []  # heap of (when, seq, tournament)
+        self.due = {}  # {tournament: when, ...} the valid queue entry of every tournament
+        self.running = set()  # tournaments having a clock_tick() in progress
+        self.counter = count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.tick_tasks = set()
+
+    def schedule(self, tournament, when):
+        """Make sure clock_tick() of tournament is called not later than when"""
+        if tournament in self.due and self.due[tournament] <= when:
+            return
+
+        self.due[tournament] = when
+        heapq.heappush(self.queue, (when, next(self.counter), tournament))
+        self.wakeup.set()
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="tournament-clock-scheduler")
+
+    async def run(self):
+        while self.queue or self.running:
+            self.wakeup.clear()
+            now = datetime.now(timezone.utc)
+
+            while self.queue and self.queue[0][0] <= now:
+                when, _, tournament = heapq.heappop(self.queue)
+                if self.due.get(tournament) != when or tournament in self.running:
+                    # outdated entry, or clock_tick() will be rescheduled when it's done
+                    continue
+
+                del self.due[tournament]
+                self.running.add(tournament)
+                task = asyncio.create_task(
+                    self.tick(tournament, now), name="tournament-clock-%s" % tournament.id
+                )
+                self.tick_tasks.add(task)
+                task.add_done_callback(self.tick_tasks.discard)
+
+            if self.queue:
+                timeout = (self.queue[0][0] - now).total_seconds()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.wakeup.wait()
+
+    async def tick(self, tournament, now):
+        try:
+            next_time = await tournament.clock_tick(now)
+        except Exception as exc:
+            log.critical("".join(traceback.format_exception(exc)))
+            next_time = None
+
+        self.running.discard(tournament)
+        pending = self.due.pop(tournament, None)
+
+        if next_time is not None or pending is not None:
+            self.schedule(
+                tournament,
+                min(time for time in (next_time, pending) if time is not None),
+            )
+        self.wakeup.set()
@@ -43,7 +43,7 @@ def performance(user, games):
 
 async def fix_first_minishogi_arena(app_state: PychessGlobalAppState):
     tid = "4RP5KEl8"  # First Minishogi Arena
-    t = await load_tournament(app_state, tid)
+    t = await load_tournament(app_state, tid, full=True)
     print(t)
 
     ubdip = app_state.users["ubdip"]
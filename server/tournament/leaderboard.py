@@ -0,0 +1,79 @@
+from __future__ import annotations
+from itertools import count
+
+from sortedcollections import ValueSortedDict
+from sortedcontainers import SortedDict
+
+
+class Leaderboard(ValueSortedDict):
+    """
+    {User: full_score} dict sorted by descending full score
+
+    Like ValueSortedDict(neg), equal scores are kept in the order they were set,
+    but through an explicit sequence number, so every player has a unique sort key.
+    This keeps rank lookups with index() O(log n) bisections even when lots of
+    players share the same score (e.g. before and right after the first pairing).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._func = None
+        self._seq = {}
+        self._counter = count()
+        SortedDict.__init__(self, self._rank_key, *args, **kwargs)
+
+    def _rank_key(self, user):
+        return (-self[user], self._seq[user])
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self._list_remove(key)
+            dict.__delitem__(self, key)
+        self._seq[key] = next(self._counter)
+        dict.__setitem__(self, key, value)
+        self._list_add(key)
+
+    _setitem = __setitem__
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        del self._seq[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self, index=-1):
+        key, value = super().popitem(index)
+        del self._seq[key]
+        return key, value
+
+    def clear(self):
+        super().clear()
+        self._seq.clear()
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    _update = update
+
+    def rank(self, user):
+        """1 based position of a player"""
+        return self.index(user) + 1
+
+    def copy(self):
+        return self.__class__(self.items())
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return (self.__class__, (list(self.items()),))
@@ -1,20 +1,17 @@
 from __future__ import annotations
 import asyncio
 import collections
+import json
 import random
-import traceback
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta, timezone
 from functools import cache
-from operator import neg
-from typing import ClassVar, Deque, Tuple, Set
+from typing import Callable, ClassVar, Deque, Tuple, Set
 
 from mongomock_motor import AsyncMongoMockClient
 from pymongo import ReturnDocument
-from sortedcollections import ValueSortedDict
-from sortedcontainers import SortedKeysView
 
-from compress import R2C
+from compress import C2R, R2C
 from const import (
     ABORTED,
     CASUAL,
@@ -38,16 +35,18 @@ from const import (
 from game import Game
 from lichess_team_msg import lichess_team_msg
 from misc import time_control_str
-from newid import new_id
+from newid import new_id, new_ids
+from tournament.leaderboard import Leaderboard
+from tournament.write_buffer import TournamentWriteBuffer
 from const import TYPE_CHECKING
-from websocket_utils import ws_send_json
+from websocket_utils import ws_send_json, ws_send_str
 
 if TYPE_CHECKING:
     from pychess_global_app_state import PychessGlobalAppState
 from spectators import spectators
 from tournament.tournament_spotlights import tournament_spotlights
 from user import User
-from utils import insert_game_to_db
+from utils import insert_games_to_db
 from logger import log
 from variants import get_server_variant
 
@@ -56,6 +55,9 @@ SCORE, STREAK, DOUBLE = range(1, 4)
 
 SCORE_SHIFT = 100000
 
+# players listed on one leaderboard page
+PLAYERS_PAGE_SIZE = 10
+
 NOTIFY1_MINUTES = 60 * 6
 NOTIFY2_MINUTES = 10
 
@@ -137,6 +139,20 @@ class PlayerData:
         return (" ").join(self.points)
 
 
+def player_data_from_doc(doc, title):
+    """Return PlayerData of a mongodb tournament-player document"""
+    player = PlayerData(title, doc["uid"], doc["r"], doc["pr"])
+    player.id = doc["_id"]
+    player.paused = doc["a"]
+    player.withdrawn = doc.get("wd", False)
+    player.points = doc["p"]
+    player.nb_win = doc["w"]
+    player.nb_berserk = doc.get("b", 0)
+    player.performance = doc["e"]
+    player.win_streak = doc["f"]
+    return player
+
+
 @cache
 def player_json(player, full_score, paused):
     return {
@@ -239,6 +255,7 @@ class Tournament(ABC):
     ):
         self.app_state = app_state
         self.id = tournamentId
+        self.write_buffer = TournamentWriteBuffer(app_state, tournamentId)
         self.name = name
         self.description = description
         self.variant = variant
@@ -268,13 +285,15 @@ class Tournament(ABC):
         self.wave_delta = timedelta(seconds=1)
         self.current_round = 0
         self.prev_pairing = None
+        self.next_wave = None
 
         self.messages: collections.deque = collections.deque([], MAX_CHAT_LINES)
         self.spectators: Set[User] = set()
+        # {msg_type: response getter, ...} sent by the next flush_broadcasts()
+        self.pending_broadcasts: dict[str, Callable[[], dict]] = {}
         self.players: dict[User, PlayerData] = {}
 
-        self.leaderboard = ValueSortedDict(neg)
-        self.leaderboard_keys_view = SortedKeysView(self.leaderboard)
+        self.leaderboard = Leaderboard()
         self.status = T_CREATED if status is None else status
         self.ongoing_games = set()
         self.nb_players = 0
@@ -285,6 +304,13 @@ class Tournament(ABC):
         self.draw = 0
         self.nb_berserk = 0
 
+        # Finished tournaments loaded from mongodb are lazy. Their players and pairings
+        # are not kept in memory, leaderboard pages and player games are read on demand.
+        self.lazy = False
+        self.sum_rating = 0
+        self.lazy_pages: dict[int, list[tuple[PlayerData, int]]] = {}
+        self.lazy_players: dict[str, PlayerData] = {}  # {username: PlayerData, ...}
+
         self.first_pairing = False
         self.top_game = None
         self.top_game_rank = 1
@@ -297,8 +323,11 @@ class Tournament(ABC):
         else:
             self.ends_at = self.starts_at + timedelta(minutes=minutes)
 
+        # resolved when the tournament is over
+        self.clock_finished = None
         if with_clock:
-            self.clock_task = asyncio.create_task(self.clock(), name="tournament-clock")
+            self.clock_finished = asyncio.get_running_loop().create_future()
+            self.schedule_clock()
 
         self.browser_title = "%s Tournament • %s" % (
             self.server_variant.display_name,
@@ -312,19 +341,33 @@ class Tournament(ABC):
     def create_pairing(self, waiting_players):
         pass
 
-    def user_status(self, user):
-        if user in self.players:
-            return (
-                "paused"
-                if self.players[user].paused
-                else "withdrawn" if self.players[user].withdrawn else "joined"
+    async def get_player(self, user):
+        """PlayerData of a user or None if not joined, read from mongodb if the tournament is lazy"""
+        if not self.lazy:
+            return self.players.get(user)
+        if user.anon:
+            return None
+
+        if user.username not in self.lazy_players:
+            doc = await self.app_state.db.tournament_player.find_one(
+                {"tid": self.id, "uid": user.username}
             )
+            if doc is None:
+                return None
+            self.lazy_players[user.username] = player_data_from_doc(doc, user.title)
+        return self.lazy_players[user.username]
+
+    async def user_status(self, user):
+        player = await self.get_player(user)
+        if player is not None:
+            return "paused" if player.paused else "withdrawn" if player.withdrawn else "joined"
         else:
             return "spectator"
 
-    def user_rating(self, user):
-        if user in self.players:
-            return self.players[user].rating
+    async def user_rating(self, user):
+        player = await self.get_player(user)
+        if player is not None:
+            return player.rating
         else:
             return "%s%s" % user.get_rating(self.variant, self.chess960).rating_prov
 
@@ -333,7 +376,7 @@ class Tournament(ABC):
             if self.players[user].page > 0:
                 page = self.players[user].page
             else:
-                div, mod = divmod(self.leaderboard.index(user) + 1, 10)
+                div, mod = divmod(self.leaderboard.rank(user), 10)
                 page = div + (1 if mod > 0 else 0)
                 if self.status == T_CREATED:
                     self.players[user].page = page
@@ -367,7 +410,7 @@ class Tournament(ABC):
         player = await self.app_state.users.get(player_name)
         return {
             "type": "get_games",
-            "rank": self.leaderboard.index(player) + 1,
+            "rank": self.leaderboard.rank(player),
             "title": player.title,
             "name": player_name,
             "perf": self.players[player].performance,
@@ -377,6 +420,117 @@ class Tournament(ABC):
             "games": [game.game_json(player) for game in self.players[player].games],
         }
 
+    async def get_players_json(self, page=None, user=None):
+        """players_json() of the given page, read from mongodb if the tournament is lazy"""
+        if not self.lazy:
+            return self.players_json(page=page, user=user)
+
+        if page is None and user is not None:
+            rank = await self.db_player_rank(user.username)
+            if rank > 0:
+                page = (rank - 1) // PLAYERS_PAGE_SIZE + 1
+        if page is None:
+            page = 1
+
+        return {
+            "type": "get_players",
+            "requestedBy": user.username if user is not None else "",
+            "nbPlayers": self.nb_players,
+            "nbGames": self.nb_games_finished,
+            "page": page,
+            "players": [
+                player_json(player, full_score, player.paused)
+                for player, full_score in await self.load_players_page(page)
+            ],
+            "podium": [
+                player_json(player, full_score, player.paused)
+                for player, full_score in (await self.load_players_page(1))[0:3]
+            ],
+        }
+
+    async def get_games_json(self, player_name):
+        """games_json() of a player, read from mongodb if the tournament is lazy"""
+        if not self.lazy:
+            return await self.games_json(player_name)
+
+        doc = await self.app_state.db.tournament_player.find_one(
+            {"tid": self.id, "uid": player_name}
+        )
+        if doc is None:
+            return None
+
+        cursor = self.app_state.db.tournament_pairing.find({"tid": self.id, "u": player_name})
+        cursor.sort("d", 1)
+        pairings = [pairing async for pairing in cursor if pairing["r"] != "d"]
+
+        titles = await self.app_state.users.get_titles(
+            {player_name} | {username for pairing in pairings for username in pairing["u"]}
+        )
+        players = {
+            username: PlayerData(title, username, 0, "") for username, title in titles.items()
+        }
+        player = players[player_name]
+
+        return {
+            "type": "get_games",
+            "rank": await self.db_player_rank(player_name, doc),
+            "title": player.title,
+            "name": player_name,
+            "perf": doc["e"],
+            "nbGames": len(doc["p"]),
+            "nbWin": doc["w"],
+            "nbBerserk": doc.get("b", 0),
+            "games": [
+                GameData(
+                    pairing["_id"],
+                    players[pairing["u"][0]],
+                    pairing["wr"],
+                    players[pairing["u"][1]],
+                    pairing["br"],
+                    C2R[pairing["r"]],
+                    pairing["d"],
+                    pairing.get("wb", False),
+                    pairing.get("bb", False),
+                ).game_json(player)
+                for pairing in pairings
+            ],
+        }
+
+    async def load_players_page(self, page):
+        """Return [(PlayerData, full_score), ...] of a lazy tournament leaderboard page.
+        Leaderboards of finished tournaments don't change, so pages are read only once."""
+        if page not in self.lazy_pages:
+            cursor = self.app_state.db.tournament_player.find(
+                {"tid": self.id, "wd": {"$ne": True}},
+                sort=[("s", -1), ("e", -1)],
+                skip=(page - 1) * PLAYERS_PAGE_SIZE,
+                limit=PLAYERS_PAGE_SIZE,
+            )
+            docs = await cursor.to_list(length=PLAYERS_PAGE_SIZE)
+            titles = await self.app_state.users.get_titles([doc["uid"] for doc in docs])
+            self.lazy_pages[page] = [
+                (player_data_from_doc(doc, titles[doc["uid"]]), SCORE_SHIFT * doc["s"] + doc["e"])
+                for doc in docs
+            ]
+        return self.lazy_pages[page]
+
+    async def db_player_rank(self, username, doc=None):
+        """Return the leaderboard rank of a lazy tournament player or 0 if not ranked"""
+        player_table = self.app_state.db.tournament_player
+        if doc is None:
+            doc = await player_table.find_one({"tid": self.id, "uid": username})
+        if doc is None or doc.get("wd", False):
+            return 0
+
+        ahead = await player_table.count_documents(
+            {
+                "tid": self.id,
+                "wd": {"$ne": True},
+                "$or": [{"s": {"$gt": doc["s"]}}, {"s": doc["s"], "e": {"$gt": doc["e"]}}],
+            }
+        )
+        return ahead + 1
+
     @property
     def spectator_list(self):
         return spectators(self)
@@ -390,8 +544,8 @@ class Tournament(ABC):
             "fen": DARK_FEN if self.top_game.fow else self.top_game.board.fen,
             "w": self.top_game.wplayer.username,
             "b": self.top_game.bplayer.username,
-            "wr": self.leaderboard_keys_view.index(self.top_game.wplayer) + 1,
-            "br": self.leaderboard_keys_view.index(self.top_game.bplayer) + 1,
+            "wr": self.leaderboard.rank(self.top_game.wplayer),
+            "br": self.leaderboard.rank(self.top_game.bplayer),
             "chess960": self.top_game.chess960,
             "base": self.top_game.base,
             "inc": self.top_game.inc,
@@ -430,91 +584,140 @@ class Tournament(ABC):
             and not self.players[p].withdrawn
         ]
 
-    async def clock(self):
-        try:
-            while self.status not in (T_ABORTED, T_FINISHED, T_ARCHIVED):
-                now = datetime.now(timezone.utc)
+    def schedule_clock(self, delay=0):
+        """Ask for a clock_tick() in delay seconds at the latest"""
+        if self.clock_finished is not None and not self.clock_finished.done():
+            self.app_state.tournament_clock.schedule(
+                self, datetime.now(timezone.utc) + timedelta(seconds=delay)
+            )
 
-                if self.status == T_CREATED:
-                    remaining_time = self.starts_at - now
-                    remaining_mins_to_start = int(
-                        ((remaining_time.days * 3600 * 24) + remaining_time.seconds) / 60
+    async def clock_tick(self, now):
+        """
+        Called by the tournament clock scheduler. Does everything due at now,
+        sends pending broadcasts and db writes, and returns the time of the next
+        timed event (None if there is no timed event to wait for).
+        """
+        if self.status in (T_ABORTED, T_FINISHED, T_ARCHIVED):
+            return None
+
+        next_time = await self.clock_event(now)
+
+        await self.flush_broadcasts()
+        await self.write_buffer.flush()
+
+        if self.status in (T_ABORTED, T_FINISHED, T_ARCHIVED):
+            return None
+        return next_time
+
+    async def clock_event(self, now):
+        if self.status == T_CREATED:
+            remaining_time = self.starts_at - now
+            remaining_mins_to_start = int(
+                ((remaining_time.days * 3600 * 24) + remaining_time.seconds) / 60
+            )
+            if now >= self.starts_at:
+                if self.system != ARENA and len(self.players) < 3:
+                    # Swiss and RR Tournaments need at least 3 players to start
+                    await self.abort()
+                    print("T_ABORTED: less than 3 player joined")
+                    return None
+
+                await self.start(now)
+                return now
+
+            elif (not self.notify2) and remaining_mins_to_start <= NOTIFY2_MINUTES:
+                self.notify1 = True
+                self.notify2 = True
+                await self.app_state.discord.send_to_discord(
+                    "notify_tournament",
+                    self.notify_discord_msg(remaining_mins_to_start),
+                )
+                return now
+
+            elif (not self.notify1) and remaining_mins_to_start <= NOTIFY1_MINUTES:
+                self.notify1 = True
+                await self.app_state.discord.send_to_discord(
+                    "notify_tournament",
+                    self.notify_discord_msg(remaining_mins_to_start),
+                )
+                asyncio.create_task(lichess_team_msg(self.app_state), name="t-lichess-team-msg")
+                return now
+
+            next_times = [self.starts_at]
+            if not self.notify2:
+                next_times.append(self.notify_time(NOTIFY2_MINUTES))
+            if not self.notify1:
+                next_times.append(self.notify_time(NOTIFY1_MINUTES))
+            return min(next_times)
+
+        elif (self.minutes is not None) and now >= self.ends_at:
+            await self.finish()
+            print("T_FINISHED: no more time left")
+            return None
+
+        elif self.status == T_STARTED:
+            if self.system == ARENA:
+                # In case of server restart
+                if self.prev_pairing is None:
+                    self.prev_pairing = now - self.wave - self.wave_delta
+
+                if self.next_wave is None:
+                    self.next_wave = (
+                        self.prev_pairing
+                        + self.wave
+                        + random.uniform(-self.wave_delta, self.wave_delta)
                     )
-                    if now >= self.starts_at:
-                        if self.system != ARENA and len(self.players) < 3:
-                            # Swiss and RR Tournaments need at least 3 players to start
-                            await self.abort()
-                            print("T_ABORTED: less than 3 player joined")
-                            break
-
-                        await self.start(now)
-                        continue
-
-                    elif (not self.notify2) and remaining_mins_to_start <= NOTIFY2_MINUTES:
-                        self.notify1 = True
-                        self.notify2 = True
-                        await self.app_state.discord.send_to_discord(
-                            "notify_tournament",
-                            self.notify_discord_msg(remaining_mins_to_start),
-                        )
-                        continue
 
-                    elif (not self.notify1) and remaining_mins_to_start <= NOTIFY1_MINUTES:
-                        self.notify1 = True
-                        await self.app_state.discord.send_to_discord(
-                            "notify_tournament",
-                            self.notify_discord_msg(remaining_mins_to_start),
-                        )
-                        asyncio.create_task(
-                            lichess_team_msg(self.app_state), name="t-lichess-team-msg"
+                if now >= self.next_wave:
+                    waiting_players = self.waiting_players()
+                    nb_waiting_players = len(waiting_players)
+                    if nb_waiting_players >= 2:
+                        log.debug("Enough player (%s), do pairing", nb_waiting_players)
+                        await self.create_new_pairings(waiting_players)
+                        self.prev_pairing = now
+                        self.next_wave = (
+                            self.prev_pairing
+                            + self.wave
+                            + random.uniform(-self.wave_delta, self.wave_delta)
                         )
-                        continue
-
-                elif (self.minutes is not None) and now >= self.ends_at:
-                    await self.finish()
-                    print("T_FINISHED: no more time left")
-                    break
-
-                elif self.status == T_STARTED:
-                    if self.system == ARENA:
-                        # In case of server restart
-                        if self.prev_pairing is None:
-                            self.prev_pairing = now - self.wave - self.wave_delta
-
-                        if now >= self.prev_pairing + self.wave + random.uniform(
-                            -self.wave_delta, self.wave_delta
-                        ):
-                            waiting_players = self.waiting_players()
-                            nb_waiting_players = len(waiting_players)
-                            if nb_waiting_players >= 2:
-                                log.debug("Enough player (%s), do pairing", nb_waiting_players)
-                                await self.create_new_pairings(waiting_players)
-                                self.prev_pairing = now
-                        else:
-                            log.debug("Waiting for new pairing wave...")
-
-                    elif len(self.ongoing_games) == 0:
-                        if self.current_round < self.rounds:
-                            self.current_round += 1
-                            log.debug("Do %s. round pairing", self.current_round)
-                            waiting_players = self.waiting_players()
-                            await self.create_new_pairings(waiting_players)
-                        else:
-                            await self.finish()
-                            log.debug("T_FINISHED: no more round left")
-                            break
                     else:
-                        print(
-                            "%s has %s ongoing game(s)..."
-                            % (
-                                "RR" if self.system == RR else "Swiss",
-                                len(self.ongoing_games),
-                            )
-                        )
+                        # check again a bit later
+                        self.next_wave = now + self.wave_delta
+                else:
+                    log.debug("Waiting for new pairing wave...")
+
+                return min(self.next_wave, self.ends_at)
+
+            elif len(self.ongoing_games) == 0:
+                if self.current_round < self.rounds:
+                    self.current_round += 1
+                    log.debug("Do %s. round pairing", self.current_round)
+                    waiting_players = self.waiting_players()
+                    await self.create_new_pairings(waiting_players)
+                    if len(self.ongoing_games) == 0:
+                        # nothing to wait for in this round
+                        return now + timedelta(seconds=1)
+                else:
+                    await self.finish()
+                    log.debug("T_FINISHED: no more round left")
+                    return None
+            else:
+                print(
+                    "%s has %s ongoing game(s)..."
+                    % (
+                        "RR" if self.system == RR else "Swiss",
+                        len(self.ongoing_games),
+                    )
+                )
 
-                await asyncio.sleep(1)
-        except Exception as exc:
-            log.critical("".join(traceback.format_exception(exc)))
+            # game_update() asks for a new clock tick when the round ends
+            return self.ends_at if self.minutes is not None else None
+
+        return None
+
+    def notify_time(self, minutes):
+        """First time when clock_event() sees remaining_mins_to_start <= minutes"""
+        return self.starts_at - timedelta(minutes=minutes + 1) + timedelta(seconds=1)
 
     async def start(self, now):
         self.status = T_STARTED
@@ -531,6 +734,7 @@ class Tournament(ABC):
         # force first pairing wave in arena
         if self.system == ARENA:
             self.prev_pairing = now - self.wave
+            self.next_wave = None
 
         if self.app_state.db is not None:
             print(
@@ -552,15 +756,22 @@ class Tournament(ABC):
             "bWin": self.b_win,
             "draw": self.draw,
             "berserk": self.nb_berserk,
-            "sumRating": sum(
-                self.players[player].rating
-                for player in self.players
-                if not self.players[player].withdrawn
+            "sumRating": (
+                self.sum_rating
+                if self.lazy
+                else sum(
+                    self.players[player].rating
+                    for player in self.players
+                    if not self.players[player].withdrawn
+                )
             ),
         }
 
     async def finalize(self, status):
         self.status = status
+        await self.flush_broadcasts()
+        if self.clock_finished is not None and not self.clock_finished.done():
+            self.clock_finished.set_result(status)
 
         if len(self.players) > 0:
             self.print_leaderboard()
@@ -596,7 +807,7 @@ class Tournament(ABC):
         await self.finalize(T_FINISHED)
 
     async def join(self, user):
-        if user.anon:
+        if user.anon or self.lazy:
             return
         log.debug("JOIN: %s in tournament %s", user.username, self.id)
 
@@ -672,8 +883,7 @@ class Tournament(ABC):
             # After first pairing it will be sorted by score points and performance
             # so we have to make a clear (all 0) leaderboard here
             new_leaderboard = [(user, 0) for user in self.leaderboard]
-            self.leaderboard = ValueSortedDict(neg, new_leaderboard)
-            self.leaderboard_keys_view = SortedKeysView(self.leaderboard)
+            self.leaderboard = Leaderboard(new_leaderboard)
 
         games = await self.create_games(pairing)
 
@@ -683,12 +893,14 @@ class Tournament(ABC):
         return (pairing, games)
 
     async def create_games(self, pairing):
+        """Create the games of a pairing wave with bulk mongodb reads/writes
+        and send the new_game messages to the players concurrently"""
         is_new_top_game = False
 
         games = []
         game_table = None if self.app_state.db is None else self.app_state.db.game
-        for wp, bp in pairing:
-            game_id = await new_id(game_table)
+        game_ids = await new_ids(game_table, len(pairing))
+        for game_id, (wp, bp) in zip(game_ids, pairing):
             game = Game(
                 self.app_state,
                 game_id,
@@ -703,54 +915,75 @@ class Tournament(ABC):
                 tournamentId=self.id,
                 chess960=self.chess960,
             )
-
-            if game.has_crosstable:
-                doc = await self.app_state.db.crosstable.find_one({"_id": game.ct_id})
-                if doc is not None:
-                    game.crosstable = doc
-
             games.append(game)
             self.app_state.games[game_id] = game
-            await insert_game_to_db(game, self.app_state)
 
+        await self.load_crosstables(games)
+        failed = await insert_games_to_db(games, self.app_state)
+        if failed:
+            # players of the games we couldn't save stay free and will be paired again
+            for game in failed:
+                game.stopwatch.stop()
+                game.stopwatch.clock_task.cancel()
+                del self.app_state.games[game.id]
+            games = [game for game in games if game not in failed]
+
+        notifications = []
+        for game in games:
             self.ongoing_games.add(game)
             self.update_players(game)
 
             response = {
                 "type": "new_game",
-                "gameId": game_id,
-                "wplayer": wp.username,
-                "bplayer": bp.username,
+                "gameId": game.id,
+                "wplayer": game.wplayer.username,
+                "bplayer": game.bplayer.username,
             }
-
-            ws_ok = False
-            if wp.title != "TEST":
-                for ws in list(wp.tournament_sockets[self.id]):
-                    ok = await ws_send_json(ws, response)
-                    ws_ok = ws_ok or ok
-            if (not ws_ok) and wp.title != "TEST":
-                await self.pause(wp)
-                log.debug("White player %s left the tournament (ws send failed)", wp.username)
-
-            ws_ok = False
-            if bp.title != "TEST":
-                for ws in list(bp.tournament_sockets[self.id]):
-                    ok = await ws_send_json(ws, response)
-                    ws_ok = ws_ok or ok
-            if (not ws_ok) and bp.title != "TEST":
-                await self.pause(bp)
-                log.debug("Black player %s left the tournament (ws send failed)", bp.username)
+            for player in (game.wplayer, game.bplayer):
+                if player.title != "TEST":
+                    notifications.append((player, response))
 
             if self.update_game_ranks(game):
                 is_new_top_game = True
 
+        results = await asyncio.gather(
+            *(self.notify_new_game(player, response) for player, response in notifications)
+        )
+        for (player, response), ws_ok in zip(notifications, results):
+            if not ws_ok:
+                await self.pause(player)
+                log.debug("Player %s left the tournament (ws send failed)", player.username)
+
         if is_new_top_game:
-            await self.broadcast(self.top_game_json)
+            self.broadcast_later("top_game", lambda: self.top_game_json)
 
-        await self.broadcast(self.duels_json)
+        self.broadcast_later("duels", lambda: self.duels_json)
 
         return games
 
+    async def load_crosstables(self, games):
+        """Set the crosstable of new games with one $in query"""
+        games_by_ct = {}
+        for game in games:
+            if game.has_crosstable:
+                games_by_ct.setdefault(game.ct_id, []).append(game)
+
+        if self.app_state.db is None or len(games_by_ct) == 0:
+            return
+
+        cursor = self.app_state.db.crosstable.find({"_id": {"$in": list(games_by_ct)}})
+        async for doc in cursor:
+            for game in games_by_ct[doc["_id"]]:
+                game.crosstable = doc
+
+    async def notify_new_game(self, player, response):
+        """Send new_game to every tournament socket of the player. Return True if any succeeded."""
+        ws_ok = False
+        for ws in list(player.tournament_sockets[self.id]):
+            ok = await ws_send_json(ws, response)
+            ws_ok = ws_ok or ok
+        return ws_ok
+
     def update_players(self, game):
         wp, bp = game.wplayer, game.bplayer
 
@@ -772,8 +1005,8 @@ class Tournament(ABC):
 
     def update_game_ranks(self, game):
         if game.status != BYEGAME:
-            brank = self.leaderboard.index(game.bplayer) + 1
-            wrank = self.leaderboard.index(game.wplayer) + 1
+            brank = self.leaderboard.rank(game.bplayer)
+            wrank = self.leaderboard.rank(game.wplayer)
             game.brank = brank
             game.wrank = wrank
             if (
@@ -979,32 +1212,35 @@ class Tournament(ABC):
             self.draw += 1
 
         self.ongoing_games.discard(game)
+        if self.system != ARENA and len(self.ongoing_games) == 0:
+            # round is over
+            self.schedule_clock()
 
         # save player points to db
         await self.db_update_player(game.wplayer, "GAME_END")
         await self.db_update_player(game.bplayer, "GAME_END")
-        await self.db_update_pairing(game)
+        self.db_update_pairing(game)
 
-        await self.broadcast(self.duels_json)
+        self.broadcast_later("duels", lambda: self.duels_json)
 
         asyncio.create_task(self.delayed_free(game), name="t-delayed-free")
 
-        await self.broadcast(
-            {
-                "type": "game_update",
-                "wname": game.wplayer.username,
-                "bname": game.bplayer.username,
-            }
-        )
+        # spectators just refresh their standings page on game_update
+        response = {
+            "type": "game_update",
+            "wname": game.wplayer.username,
+            "bname": game.bplayer.username,
+        }
+        self.broadcast_later("game_update", lambda response=response: response)
 
         if self.top_game is not None and self.top_game.id == game.id:
-            response = {
+            game_end = {
                 "type": "gameEnd",
                 "status": game.status,
                 "result": game.result,
                 "gameId": game.id,
             }
-            await self.broadcast(response)
+            await self.broadcast(game_end)
 
     async def delayed_free(self, game):
         if self.system == ARENA:
@@ -1030,15 +1266,32 @@ class Tournament(ABC):
             wplayer.free = True
             bplayer.free = True
 
+    def broadcast_later(self, msg_type, get_response):
+        """Broadcast get_response() at the next clock tick.
+        Requests of the same msg_type until then are coalesced into one message."""
+        self.pending_broadcasts[msg_type] = get_response
+        self.schedule_clock(delay=1)
+
+    async def flush_broadcasts(self):
+        pending, self.pending_broadcasts = self.pending_broadcasts, {}
+        for get_response in pending.values():
+            await self.broadcast(get_response())
+
     async def broadcast(self, response):
+        # encode once for all spectator sockets
+        msg = json.dumps(response)
         for spectator in self.spectators:
             try:
-                for ws in spectator.tournament_sockets[self.id]:
-                    await ws_send_json(ws, response)
+                sockets = spectator.tournament_sockets[self.id]
             except KeyError:
                 log.error("tournament broadcast() spectator socket was removed")
-            except Exception:
-                log.error("Exception in tournament broadcast()")
+                continue
+            for ws in sockets:
+                # ws_send_str() handles connection resets only, don't let one socket stop the rest
+                try:
+                    await ws_send_str(ws, msg)
+                except Exception:
+                    log.exception("Exception in tournament broadcast()")
 
     async def db_insert_pairing(self, games):
         if self.app_state.db is None:
@@ -1066,32 +1319,14 @@ class Tournament(ABC):
         if len(pairing_documents) > 0:
             await pairing_table.insert_many(pairing_documents)
 
-    async def db_update_pairing(self, game):
-        if self.app_state.db is None:
-            return
-        pairing_table = self.app_state.db.tournament_pairing
-
-        try:
-            new_data = {
-                "r": R2C[game.result],
-                "wb": game.wberserk,
-                "bb": game.bberserk,
-            }
-
-            print(
-                await pairing_table.find_one_and_update(
-                    {"_id": game.id},
-                    {"$set": new_data},
-                    return_document=ReturnDocument.AFTER,
-                )
-            )
-        except Exception:
-            if self.app_state.db is not None:
-                log.error(
-                    "db find_one_and_update pairing_table %s into %s failed !!!",
-                    game.id,
-                    self.id,
-                )
+    def db_update_pairing(self, game):
+        new_data = {
+            "r": R2C[game.result],
+            "wb": game.wberserk,
+            "bb": game.bberserk,
+        }
+        self.write_buffer.update_pairing(game.id, new_data)
+        self.schedule_clock(delay=1)
 
     async def db_update_player(self, user, action):
         if self.app_state.db is None:
@@ -1147,37 +1382,19 @@ class Tournament(ABC):
                 "wd": False,
             }
 
-        try:
-            doc_after = await player_table.find_one_and_update(
-                {"_id": player_id},
-                {"$set": new_data},
-                upsert=True,
-                return_document=ReturnDocument.AFTER,
-            )
-            if doc_after is None and not isinstance(self.app_state.db_client, AsyncMongoMockClient):
-                log.error("Failed to save %s player data update %s to mongodb", player_id, new_data)
-
-        except Exception:
-            if self.app_state.db is not None:
-                log.error(
-                    "db find_one_and_update tournament_player %s into %s failed !!!",
-                    player_id,
-                    self.id,
-                )
-
-        new_data = {"nbPlayers": self.nb_players, "nbBerserk": self.nb_berserk}
-        doc_after = await self.app_state.db.tournament.find_one_and_update(
-            {"_id": self.id},
-            {"$set": new_data},
-            return_document=ReturnDocument.AFTER,
+        # written by the next write_buffer.flush()
+        self.write_buffer.update_player(player_id, new_data)
+        self.write_buffer.update_tournament(
+            {"nbPlayers": self.nb_players, "nbBerserk": self.nb_berserk}
         )
-        if doc_after is None and not isinstance(self.app_state.db_client, AsyncMongoMockClient):
-            log.error("Failed to save %s player data update %s to mongodb", self.id, new_data)
+        self.schedule_clock(delay=1)
 
     async def save(self):
         if self.app_state.db is None:
             return
 
+        await self.write_buffer.flush()
+
         if self.nb_games_finished == 0:
             print(await self.app_state.db.tournament.delete_many({"_id": self.id}))
             print("--- Deleted empty tournament %s" % self.id)
@@ -1188,6 +1405,8 @@ class Tournament(ABC):
             "status": self.status,
             "nbPlayers": self.nb_players,
             "nbGames": self.nb_games_finished,
+            "nbBerserk": self.nb_berserk,
+            "sumRating": self.summary["sumRating"],
             "winner": winner,
         }
 
@@ -1203,6 +1422,7 @@ class Tournament(ABC):
             variant_name = self.variant + ("960" if self.chess960 else "")
             self.app_state.shield[variant_name].append((winner, self.starts_at, self.id))
             self.app_state.shield_owners[variant_name] = winner
+            self.app_state.trophies.set_shield_owner(variant_name, winner)
 
     def print_leaderboard(self):
         print("--- LEADERBOARD ---", self.id)
@@ -31,9 +31,9 @@ from tournament.rr import RRTournament
 from tournament.swiss import SwissTournament
 from tournament.tournament import (
     GameData,
-    PlayerData,
     SCORE_SHIFT,
     Tournament,
+    player_data_from_doc,
     upsert_tournament_to_db,
 )
 from tournament.auto_play_arena import ArenaTestTournament, AUTO_PLAY_ARENA_NAME
@@ -284,10 +284,16 @@ async def get_latest_tournaments(app_state: PychessGlobalAppState, lang):
 
 async def get_tournament_name(request, tournament_id):
     """Return Tournament name from app cache or from database"""
+    names = await get_tournament_names(request, (tournament_id,))
+    return names[tournament_id]
+
+
+async def get_tournament_names(request, tournament_ids):
+    """Return {tournament_id: name} dict resolved from app cache or with one database query"""
     app_state = get_app_state(request.app)
     # todo: similar logic for determining lang already exists in index.py, except this "l" param. If it is specific for
     #       when called via the game_api move that there and re-use the rest about session+user from index.py
-    #       finally change param of this function to get_tournament_name(app_state, tournament_id, lang)
+    #       finally change param of this function to get_tournament_names(app_state, tournament_ids, lang)
     lang = request.rel_url.query.get("l")
     if lang is None:
         session = await aiohttp_session.get_session(request)
@@ -299,32 +305,40 @@ async def get_tournament_name(request, tournament_id):
         if lang is None:
             lang = "en"
 
-    if tournament_id in app_state.tourneynames[lang]:
-        return app_state.tourneynames[lang][tournament_id]
-
+    tourneynames = app_state.tourneynames[lang]
     tournaments = app_state.tournaments
-    name = ""
-
-    if tournament_id in tournaments:
-        tournament = tournaments[tournament_id]
-        if tournament.frequency:
-            name = app_state.tourneynames[lang][
-                (
-                    tournament.variant + ("960" if tournament.chess960 else ""),
-                    tournament.frequency,
-                    tournament.system,
-                )
-            ]
+    names = {}
+    missing = []
+
+    for tournament_id in tournament_ids:
+        if tournament_id in tourneynames:
+            names[tournament_id] = tourneynames[tournament_id]
+        elif tournament_id in tournaments:
+            tournament = tournaments[tournament_id]
+            if tournament.frequency:
+                names[tournament_id] = tourneynames[
+                    (
+                        tournament.variant + ("960" if tournament.chess960 else ""),
+                        tournament.frequency,
+                        tournament.system,
+                    )
+                ]
+            else:
+                names[tournament_id] = tournament.name
         else:
-            name = tournament.name
-    else:
-        doc = await app_state.db.tournament.find_one({"_id": tournament_id})
-        if doc is not None:
+            missing.append(tournament_id)
+
+    if missing:
+        cursor = app_state.db.tournament.find(
+            {"_id": {"$in": missing}},
+            projection={"name": 1, "fr": 1, "v": 1, "z": 1, "system": 1},
+        )
+        async for doc in cursor:
             frequency = doc.get("fr", "")
             if frequency:
                 chess960 = bool(doc.get("z"))
                 try:
-                    name = app_state.tourneynames[lang][
+                    name = tourneynames[
                         (
                             C2V[doc["v"]] + ("960" if chess960 else ""),
                             frequency,
@@ -339,13 +353,20 @@ async def get_tournament_name(request, tournament_id):
                     )
             else:
                 name = doc["name"]
-        app_state.tourneynames[lang][tournament_id] = name
+            names[doc["_id"]] = name
 
-    return name
+        for tournament_id in missing:
+            name = names.setdefault(tournament_id, "")
+            tourneynames[tournament_id] = name
 
+    return names
 
-async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tournament_klass=None):
-    """Return Tournament object from app cache or from database"""
+
+async def load_tournament(
+    app_state: PychessGlobalAppState, tournament_id, tournament_klass=None, full=False
+):
+    """Return Tournament object from app cache or from database
+    Finished tournaments are loaded lazily unless full=True is given."""
     if tournament_id in app_state.tournaments:
         return app_state.tournaments[tournament_id]
 
@@ -387,6 +408,7 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
         description=doc.get("d", ""),
         frequency=doc.get("fr", ""),
         status=doc["status"],
+        with_clock=doc["status"] in (T_CREATED, T_STARTED),
     )
 
     app_state.tournaments[tournament_id] = tournament
@@ -394,8 +416,49 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
 
     tournament.winner = doc.get("winner", "")
 
+    if not full and tournament.status in (T_ABORTED, T_FINISHED, T_ARCHIVED):
+        await load_lazy_tournament(app_state, tournament, doc)
+    else:
+        await load_tournament_players_and_pairings(app_state, tournament, auto_play)
+
+    await load_tournament_chat(app_state, tournament)
+
+    return tournament
+
+
+async def load_lazy_tournament(app_state: PychessGlobalAppState, tournament, doc):
+    """Load the counters and the first leaderboard page of a finished tournament.
+    Other leaderboard pages and player games are read from mongodb on demand."""
+    tournament.lazy = True
+    tournament.nb_players = doc.get("nbPlayers", 0)
+    tournament.nb_games_finished = doc.get("nbGames", 0)
+
+    pairing_table = app_state.db.tournament_pairing
+    tournament.w_win = await pairing_table.count_documents({"tid": tournament.id, "r": "a"})
+    tournament.b_win = await pairing_table.count_documents({"tid": tournament.id, "r": "b"})
+    tournament.draw = await pairing_table.count_documents({"tid": tournament.id, "r": "c"})
+
+    if "sumRating" in doc and "nbBerserk" in doc:
+        tournament.sum_rating = doc["sumRating"]
+        tournament.nb_berserk = doc["nbBerserk"]
+    else:
+        # tournaments saved before these counters were added to the tournament document
+        cursor = app_state.db.tournament_player.find(
+            {"tid": tournament.id}, projection={"r": 1, "b": 1, "wd": 1}
+        )
+        async for player_doc in cursor:
+            tournament.nb_berserk += player_doc.get("b", 0)
+            if not player_doc.get("wd", False):
+                tournament.sum_rating += player_doc["r"]
+
+    await tournament.load_players_page(1)
+
+
+async def load_tournament_players_and_pairings(
+    app_state: PychessGlobalAppState, tournament, auto_play
+):
     player_table = app_state.db.tournament_player
-    cursor = player_table.find({"tid": tournament_id})
+    cursor = player_table.find({"tid": tournament.id})
     nb_players = 0
 
     if tournament.status == T_CREATED:
@@ -412,19 +475,9 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
         else:
             user = await app_state.users.get(uid)
 
-        withdrawn = doc.get("wd", False)
+        tournament.players[user] = player_data_from_doc(doc, user.title)
 
-        tournament.players[user] = PlayerData(user.title, user.username, doc["r"], doc["pr"])
-        tournament.players[user].id = doc["_id"]
-        tournament.players[user].paused = doc["a"]
-        tournament.players[user].withdrawn = withdrawn
-        tournament.players[user].points = doc["p"]
-        tournament.players[user].nb_win = doc["w"]
-        tournament.players[user].nb_berserk = doc.get("b", 0)
-        tournament.players[user].performance = doc["e"]
-        tournament.players[user].win_streak = doc["f"]
-
-        if not withdrawn:
+        if not tournament.players[user].withdrawn:
             tournament.leaderboard.update({user: SCORE_SHIFT * (doc["s"]) + doc["e"]})
             nb_players += 1
 
@@ -437,7 +490,7 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
     # tournament.print_leaderboard()
 
     pairing_table = app_state.db.tournament_pairing
-    cursor = pairing_table.find({"tid": tournament_id})
+    cursor = pairing_table.find({"tid": tournament.id})
     try:
         cursor.sort("d", 1)
     except AttributeError:
@@ -447,7 +500,8 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
     async for doc in cursor:
         res = doc["r"]
         result = C2R[res]
-        # Skip aborted/unfinished games if tournament is over
+
+        # unfinished games of a tournament that is over don't count
         if result == "*" and tournament.status in (T_ABORTED, T_FINISHED, T_ARCHIVED):
             continue
 
@@ -459,7 +513,7 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
         wberserk = doc.get("wb", False)
         bberserk = doc.get("bb", False)
 
-        if tournament.status in (T_CREATED, T_STARTED) and result == "*":
+        if result == "*":
             game = await load_game(app_state, _id)
             tournament.ongoing_games.add(game)
             tournament.update_game_ranks(game)
@@ -496,6 +550,8 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
     tournament.draw = draw
     tournament.nb_berserk = berserk
 
+
+async def load_tournament_chat(app_state: PychessGlobalAppState, tournament):
     cursor = app_state.db.tournament_chat.find(
         {"tid": tournament.id},
         projection={
@@ -510,8 +566,6 @@ async def load_tournament(app_state: PychessGlobalAppState, tournament_id, tourn
     docs = await cursor.to_list(length=MAX_CHAT_LINES)
     tournament.tourneychat = docs
 
-    return tournament
-
 
 def translated_tournament_name(variant, frequency, system, lang_translation):
     # Weekly makruk category == SEAturday
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from bulk_update import bulk_update
+from const import TYPE_CHECKING
+from logger import log
+
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
+
+
+class TournamentWriteBuffer:
+    """
+    Pending $set updates of one tournament and its players and pairings
+
+    Updates of the same document are merged, and flush() writes them
+    with one unordered bulk_write per collection. Updates that couldn't be
+    saved are kept for the next flush().
+    """
+
+    def __init__(self, app_state: PychessGlobalAppState, tid):
+        self.app_state = app_state
+        self.tid = tid
+        self.players: dict[str, dict] = {}  # {player_id: new_data, ...}
+        self.pairings: dict[str, dict] = {}  # {game_id: new_data, ...}
+        self.tournament: dict = {}
+
+    def __len__(self):
+        return len(self.players) + len(self.pairings) + (1 if self.tournament else 0)
+
+    def update_player(self, player_id, new_data):
+        self.players.setdefault(player_id, {}).update(new_data)
+
+    def update_pairing(self, game_id, new_data):
+        self.pairings.setdefault(game_id, {}).update(new_data)
+
+    def update_tournament(self, new_data):
+        self.tournament.update(new_data)
+
+    async def flush(self):
+        if self.app_state.db is None or len(self) == 0:
+            return
+
+        db = self.app_state.db
+        players, self.players = self.players, {}
+        pairings, self.pairings = self.pairings, {}
+        tournament, self.tournament = self.tournament, {}
+
+        failed = await bulk_update(
+            db.tournament_player,
+            {player_id: {"$set": new_data} for player_id, new_data in players.items()},
+            upsert=True,
+        )
+        self.restore(self.players, players, failed)
+
+        failed = await bulk_update(
+            db.tournament_pairing,
+            {game_id: {"$set": new_data} for game_id, new_data in pairings.items()},
+        )
+        self.restore(self.pairings, pairings, failed)
+
+        if tournament:
+            try:
+                await db.tournament.update_one({"_id": self.tid}, {"$set": tournament})
+            except Exception:
+                log.exception("Failed to save tournament %s updates to mongodb", self.tid)
+                self.tournament = {**tournament, **self.tournament}
+
+    @staticmethod
+    def restore(pending, sent, failed):
+        """Put back unsaved updates, under the ones made while flush() was running"""
+        for _id in failed:
+            pending[_id] = {**sent[_id], **pending.get(_id, {})}
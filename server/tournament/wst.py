@@ -80,7 +80,7 @@ async def handle_get_players(app, ws, user, data):
         page = data["page"]
         if user in tournament.players and tournament.players[user].page != page:
             tournament.players[user].page = page
-        response = tournament.players_json(page=page)
+        response = await tournament.get_players_json(page=page)
         await ws_send_json(ws, response)
 
 
@@ -90,15 +90,16 @@ async def handle_my_page(app, ws, user, data):
         if user in tournament.players:
             # force to get users current page by leaderboard status
             tournament.players[user].page = -1
-        response = tournament.players_json(user=user)
+        response = await tournament.get_players_json(user=user)
         await ws_send_json(ws, response)
 
 
 async def handle_get_games(app, ws, data):
     tournament = await load_tournament(app, data["tournamentId"])
     if tournament is not None:
-        response = await tournament.games_json(data["player"])
-        await ws_send_json(ws, response)
+        response = await tournament.get_games_json(data["player"])
+        if response is not None:
+            await ws_send_json(ws, response)
 
 
 async def handle_join(app, ws, user, data):
@@ -108,7 +109,7 @@ async def handle_join(app, ws, user, data):
         response = {
             "type": "ustatus",
             "username": user.username,
-            "ustatus": tournament.user_status(user),
+            "ustatus": await tournament.user_status(user),
         }
         await ws_send_json(ws, response)
 
@@ -120,7 +121,7 @@ async def handle_pause(app, ws, user, data):
         response = {
             "type": "ustatus",
             "username": user.username,
-            "ustatus": tournament.user_status(user),
+            "ustatus": await tournament.user_status(user),
         }
         await ws_send_json(ws, response)
 
@@ -132,7 +133,7 @@ async def handle_withdraw(app, ws, user, data):
         response = {
             "type": "ustatus",
             "username": user.username,
-            "ustatus": tournament.user_status(user),
+            "ustatus": await tournament.user_status(user),
         }
         await ws_send_json(ws, response)
 
@@ -156,8 +157,8 @@ async def handle_user_connected(app_state: PychessGlobalAppState, ws, user, data
     response = {
         "type": "tournament_user_connected",
         "username": user.username,
-        "ustatus": tournament.user_status(user),
-        "urating": tournament.user_rating(user),
+        "ustatus": await tournament.user_status(user),
+        "urating": await tournament.user_rating(user),
         "tstatus": tournament.status,
         "tsystem": tournament.system,
         "tminutes": tournament.minutes,
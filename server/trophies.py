@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+# Highscore ranks shown as trophies on profile pages
+TOP_TROPHY_RANK = 10
+
+
+class Trophies:
+    """
+    Reverse index of highscore and shield trophy owners
+
+    Highscore trophies are keyed by the "username|title" highscore ids,
+    shield trophies by usernames. Both are refreshed by the code changing
+    app_state.highscore and app_state.shield_owners, so profile pages
+    don't have to scan every variant.
+    """
+
+    def __init__(self):
+        self.top_ids = {}  # {variant: [highscore_id, ...], ...}
+        self.highscore = {}  # {highscore_id: {variant: "top1"|"top10", ...}, ...}
+        self.shield_owners = {}  # {variant: username, ...}
+        self.shields = {}  # {username: {variant: None, ...}, ...}
+
+    def update_highscore(self, variant, hs):
+        """Refresh the top ranks of a variant from its highscore ValueSortedDict"""
+        old_ids = self.top_ids.get(variant, [])
+        new_ids = hs.keys()[:TOP_TROPHY_RANK]
+        if old_ids == new_ids:
+            return
+
+        for _id in old_ids:
+            user_trophies = self.highscore[_id]
+            del user_trophies[variant]
+            if not user_trophies:
+                del self.highscore[_id]
+
+        for rank, _id in enumerate(new_ids):
+            self.highscore.setdefault(_id, {})[variant] = "top1" if rank == 0 else "top10"
+
+        self.top_ids[variant] = new_ids
+
+    def set_shield_owner(self, variant, username):
+        old_owner = self.shield_owners.get(variant)
+        if old_owner == username:
+            return
+
+        if old_owner is not None:
+            user_shields = self.shields[old_owner]
+            del user_shields[variant]
+            if not user_shields:
+                del self.shields[old_owner]
+
+        self.shields.setdefault(username, {})[variant] = None
+        self.shield_owners[variant] = username
+
+    def highscore_trophies(self, highscore_id):
+        trophies = self.highscore.get(highscore_id, {})
+        return sorted(trophies.items(), key=lambda x: x[1])
+
+    def shield_trophies(self, username):
+        return [(variant, "shield") for variant in self.shields.get(username, ())]
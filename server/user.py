@@ -14,7 +14,7 @@ from glicko2.glicko2 import gl2, DEFAULT_PERF, Rating
 from newid import id8
 from notify import notify
 from const import BLOCK, MAX_USER_BLOCK, TYPE_CHECKING
-from seek import Seek
+from seek import Seeks
 from websocket_utils import ws_send_json
 from variants import RATED_VARIANTS
 
@@ -69,7 +69,7 @@ class User:
         else:
             self.username = username
 
-        self.seeks: dict[int, Seek] = {}
+        self.seeks: Seeks = Seeks()
 
         self.ready_for_auto_pairing = False
         self.lobby_sockets: Set[WebSocketResponse] = set()
@@ -79,6 +79,8 @@ class User:
 
         self.puzzles = {}  # {pizzleId: vote} where vote 0 = not voted, 1 = up, -1 = down
         self.puzzle_variant = None
+        # {variant: (PuzzleIds generation, bitset of served puzzle indexes)}
+        self.puzzle_seen: dict[str, tuple[int, bytearray]] = {}
 
         self.game_sockets: dict[str, WebSocketResponse] = {}
         self.title = title
@@ -162,6 +164,32 @@ class User:
                 # TODO: message opp to let him claim win
                 pass
 
+    @property
+    def online(self):
+        return self._online
+
+    @online.setter
+    def online(self, value):
+        self._online = value
+        online_users = self.app_state.online_anons if self.anon else self.app_state.online_users
+        if value:
+            online_users.add(self)
+        else:
+            online_users.discard(self)
+
+    @property
+    def ready_for_auto_pairing(self):
+        return self._ready_for_auto_pairing
+
+    @ready_for_auto_pairing.setter
+    def ready_for_auto_pairing(self, value):
+        self._ready_for_auto_pairing = value
+        # auto_pairing_count() counts ready users having an active auto pairing only
+        if value and self in self.app_state.auto_pairing_users:
+            self.app_state.auto_pairing_ready_users.add(self)
+        else:
+            self.app_state.auto_pairing_ready_users.discard(self)
+
     def update_online(self):
         self.online = (
             len(self.game_sockets) > 0
@@ -216,6 +244,11 @@ class User:
             "nb": nb + 1,
         }
 
+        if self in self.app_state.auto_pairing_users:
+            for variant_tc, auto_pairing in self.app_state.auto_pairings.items():
+                if variant_tc[0] == variant and variant_tc[1] == chess960:
+                    auto_pairing.update_rating(self)
+
         if self.app_state.db is not None:
             await self.app_state.db.user.find_one_and_update(
                 {"_id": self.username}, {"$set": {"perfs": self.perfs}}
@@ -234,9 +267,7 @@ class User:
         }
 
         if self.app_state.db is not None:
-            await self.app_state.db.user.find_one_and_update(
-                {"_id": self.username}, {"$set": {"pperfs": self.pperfs}}
-            )
+            self.app_state.puzzle_cache.set_user_pperfs(self)
 
     async def notify_game_end(self, game):
         opp_name = (
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from collections import UserDict
+from collections import OrderedDict, UserDict
 
 from const import ANON_PREFIX, BLOCK, MAX_USER_BLOCK, NONE_USER, TYPE_CHECKING
 from glicko2.glicko2 import DEFAULT_PERF
@@ -10,6 +10,9 @@ from variants import RATED_VARIANTS
 if TYPE_CHECKING:
     from pychess_global_app_state import PychessGlobalAppState
 
+# Number of titles of users not loaded into memory kept in Users.titles
+TITLE_CACHE_SIZE = 10000
+
 
 class NotInAppUsers(Exception):
     """Raised when dict access syntax was used, but username not in Users dict"""
@@ -30,6 +33,8 @@ class Users(UserDict):
     def __init__(self, app_state: PychessGlobalAppState):
         super().__init__()
         self.app_state = app_state
+        # LRU {username: title, ...} of users we don't want to load into memory
+        self.titles: OrderedDict[str, str] = OrderedDict()
 
     def __getitem__(self, username):
         if username in self.data:
@@ -81,3 +86,40 @@ class Users(UserDict):
             user.blocked = {doc["u2"] for doc in docs}
 
             return user
+
+    async def get_titles(self, usernames):
+        """
+        Return {username: title} for every given username
+
+        Titles of users not loaded into memory are fetched with one $in query and cached.
+        """
+        titles = {}
+        missing = []
+        for username in usernames:
+            if username in self.data:
+                titles[username] = self.data[username].title
+            elif username in self.titles:
+                titles[username] = self.titles[username]
+                self.titles.move_to_end(username)
+            elif username.startswith(ANON_PREFIX):
+                titles[username] = ""
+            else:
+                missing.append(username)
+
+        if missing:
+            cursor = self.app_state.db.user.find({"_id": {"$in": missing}}, projection={"title": 1})
+            async for doc in cursor:
+                titles[doc["_id"]] = doc.get("title") or ""
+
+            for username in missing:
+                self.titles[username] = titles.setdefault(username, "")
+            while len(self.titles) > TITLE_CACHE_SIZE:
+                self.titles.popitem(last=False)
+
+        return titles
+
+    def set_title(self, username, title):
+        """Update the title of a loaded user and drop the cached one"""
+        if username in self.data:
+            self.data[username].title = title
+        self.titles.pop(username, None)
@@ -12,6 +12,7 @@ from functools import partial
 from aiohttp import web
 import aiohttp_session
 from aiohttp_sse import sse_response
+from pymongo.errors import BulkWriteError
 
 from broadcast import round_broadcast
 from const import (
@@ -58,6 +59,11 @@ async def tv_game(app_state: PychessGlobalAppState):
         return app_state.tv
     game_id = None
     # No Fog of War games to TV
+    for game in reversed(app_state.live_games.newest()):
+        if game.variant != "fogofwar":
+            app_state.tv = game.id
+            return game.id
+
     doc = await app_state.db.game.find_one({"v": {"$ne": "Q"}}, sort=[("$natural", -1)])
     if doc is not None:
         game_id = doc["_id"]
@@ -476,11 +482,8 @@ async def new_game(app_state: PychessGlobalAppState, seek, game_id=None):
     }
 
 
-async def insert_game_to_db(game, app_state: PychessGlobalAppState):
-    # unit test app may have no db
-    if app_state.db is None:
-        return
-
+def game_document(game):
+    """Return the mongodb document of a newly created game"""
     document = {
         "_id": game.id,
         "us": [game.wplayer.username, game.bplayer.username],
@@ -519,10 +522,51 @@ async def insert_game_to_db(game, app_state: PychessGlobalAppState):
     if game.initial_fen or game.chess960:
         document["if"] = game.initial_fen
 
-    result = await app_state.db.game.insert_one(document)
+    return document
+
+
+async def insert_game_to_db(game, app_state: PychessGlobalAppState):
+    # unit test app may have no db
+    if app_state.db is None:
+        return
+
+    result = await app_state.db.game.insert_one(game_document(game))
     if result.inserted_id != game.id:
         log.error("db insert game result %s failed !!!", game.id)
 
+    await update_tv(game, app_state)
+
+
+async def insert_games_to_db(games, app_state: PychessGlobalAppState):
+    """Insert many new games (f.e. a tournament pairing wave) with one insert_many().
+    Only the last of them is broadcasted to the lobby as the new TV game.
+    Returns the list of games that failed to be inserted."""
+    if app_state.db is None or len(games) == 0:
+        return []
+
+    failed = []
+    try:
+        await app_state.db.game.insert_many([game_document(game) for game in games], ordered=False)
+    except BulkWriteError as e:
+        failed = [games[error["index"]] for error in e.details["writeErrors"]]
+        log.error(
+            "db insert_many of %s games failed for %s",
+            len(games),
+            " ".join(game.id for game in failed),
+        )
+        games = [game for game in games if game not in failed]
+
+    tv_games = [game for game in games if (not game.corr) and (game.variant != "fogofwar")]
+    for game in tv_games:
+        game.wplayer.tv = game.id
+        game.bplayer.tv = game.id
+    if tv_games:
+        await update_tv(tv_games[-1], app_state)
+
+    return failed
+
+
+async def update_tv(game, app_state: PychessGlobalAppState):
     # No corr and Fog of War games to TV
     if (not game.corr) and (game.variant != "fogofwar"):
         app_state.tv = game.id
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from const import IMPORTED, STARTED, TYPE_CHECKING
+from logger import log
+
+if TYPE_CHECKING:
+    from pychess_global_app_state import PychessGlobalAppState
+
+# Monthly game counts are kept in the stats_counters collection
+# one document per (period, variant code, chess960, humans) with a "c" counter
+
+FIRST_PERIOD = "201907"
+
+ENGINE_USERNAMES = ("Fairy-Stockfish", "Random-Mover")
+
+
+def game_period(date):
+    return date.strftime("%Y%m")
+
+
+async def inc_variant_stats(app_state: PychessGlobalAppState, game):
+    """Count a finished game saved to mongodb in its monthly variant stats counter"""
+    if app_state.db is None:
+        return
+
+    counter = {
+        "p": game_period(game.date),
+        "v": game.server_variant.code,
+        "z": int(game.chess960),
+        "h": not any(player.username in ENGINE_USERNAMES for player in game.all_players),
+    }
+    try:
+        await app_state.db.stats_counters.update_one(counter, {"$inc": {"c": 1}}, upsert=True)
+    except Exception:
+        log.error("Failed to update %s variant stats counter!", counter)
+
+
+async def get_variant_stats_docs(app_state: PychessGlobalAppState, humans, last_period):
+    """Return monthly game counts grouped by period, variant and chess960 up to last_period"""
+    filter_cond = {"p": {"$gte": FIRST_PERIOD, "$lte": last_period}}
+    if humans:
+        filter_cond["h"] = True
+
+    counts: dict[tuple, int] = {}
+    async for doc in app_state.db.stats_counters.find(filter_cond):
+        key = (doc["p"], doc["v"], doc["z"])
+        counts[key] = counts.get(key, 0) + doc["c"]
+
+    return [{"_id": {"p": p, "v": v, "z": z}, "c": c} for (p, v, z), c in sorted(counts.items())]
+
+
+async def variant_counts_aggregation(app_state: PychessGlobalAppState, humans):
+    match_cond = {"s": {"$gt": STARTED}, "y": {"$ne": IMPORTED}}
+    if humans:
+        match_cond["$and"] = [
+            {"us.0": {"$nin": ENGINE_USERNAMES}},
+            {"us.1": {"$nin": ENGINE_USERNAMES}},
+        ]
+
+    pipeline = [
+        {"$match": match_cond},
+        {
+            "$group": {
+                "_id": {
+                    "p": {"$dateToString": {"format": "%Y%m", "date": "$d"}},
+                    "v": "$v",
+                    "z": {"$ifNull": ["$z", 0]},
+                },
+                "c": {"$sum": 1},
+            }
+        },
+    ]
+
+    cursor = await app_state.db.game.aggregate(pipeline)
+    counts = {}
+    async for doc in cursor:
+        counts[(doc["_id"]["p"], doc["_id"]["v"], doc["_id"]["z"])] = doc["c"]
+    return counts
+
+
+async def generate_variant_stats(app_state: PychessGlobalAppState):
+    """Fill the stats_counters collection from the whole game collection.
+    After this save_game() keeps the counters up to date with inc_variant_stats()."""
+    all_counts = await variant_counts_aggregation(app_state, False)
+    human_counts = await variant_counts_aggregation(app_state, True)
+
+    docs = []
+    for (p, v, z), c in all_counts.items():
+        human_c = human_counts.get((p, v, z), 0)
+        if human_c > 0:
+            docs.append({"p": p, "v": v, "z": int(z), "h": True, "c": human_c})
+        if c > human_c:
+            docs.append({"p": p, "v": v, "z": int(z), "h": False, "c": c - human_c})
+
+    if docs:
+        await app_state.db.stats_counters.insert_many(docs)
+    print("DONE generate_variant_stats", len(docs))
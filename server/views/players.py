@@ -11,12 +11,10 @@ async def players(request):
     user, context = await get_user_context(request)
 
     app_state = get_app_state(request.app)
-    online_users = [
-        u
-        for u in app_state.users.values()
-        if u.username == user.username or (u.online and not u.anon)
-    ]
-    anon_online = sum((1 for u in app_state.users.values() if u.anon and u.online))
+    online_users = list(app_state.online_users)
+    if user not in app_state.online_users:
+        online_users.append(user)
+    anon_online = len(app_state.online_anons)
 
     context["icons"] = VARIANT_ICONS
     context["users"] = app_state.users
@@ -48,19 +48,10 @@ async def profile(request):
     context["can_challenge"] = user.username not in profileId_user.blocked
 
     _id = "%s|%s" % (profileId, profileId_user.title)
-    context["trophies"] = [
-        (v, "top10") for v in app_state.highscore if _id in app_state.highscore[v].keys()[:10]
-    ]
-    for i, (v, kind) in enumerate(context["trophies"]):
-        if app_state.highscore[v].peekitem(0)[0] == _id:
-            context["trophies"][i] = (v, "top1")
-    context["trophies"] = sorted(context["trophies"], key=lambda x: x[1])
+    context["trophies"] = app_state.trophies.highscore_trophies(_id)
 
     if not app_state.users[profileId].bot:
-        shield_owners = app_state.shield_owners
-        context["trophies"] += [
-            (v, "shield") for v in shield_owners if shield_owners[v] == profileId
-        ]
+        context["trophies"] += app_state.trophies.shield_trophies(profileId)
 
     if profileId in CUSTOM_TROPHY_OWNERS:
         trophies = CUSTOM_TROPHY_OWNERS[profileId]
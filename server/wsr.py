@@ -10,9 +10,10 @@ from bug.wsr_bug import handle_resign_bughouse, handle_rematch_bughouse, handle_
 import game
 from broadcast import round_broadcast
 from chat import chat_response
-from const import ANON_PREFIX, ANALYSIS, STARTED
+from const import ANON_PREFIX, STARTED
 from draw import draw, reject_draw
 from fairy import WHITE, BLACK, FairyBoard
+from fishnet import game_position_keys, send_analysis
 from const import TYPE_CHECKING
 from newid import new_id
 
@@ -311,30 +312,51 @@ async def handle_analysis(app_state: PychessGlobalAppState, ws, data, game):
 
     # If there is any fishnet client, use it.
     if len(app_state.workers) > 0:
-        work_id = "".join(random.choice(string.ascii_letters + string.digits) for x in range(6))
-        work = {
-            "work": {
-                "type": "analysis",
-                "id": work_id,
-            },
-            # or:
-            # "work": {
-            #   "type": "move",
-            #   "id": "work_id",
-            #   "level": 5 // 1 to 8
-            # },
-            "username": data["username"],
-            "game_id": data["gameId"],  # optional
-            "position": game.board.initial_fen,  # start position (X-FEN)
-            "variant": game.variant,
-            "chess960": game.chess960,
-            "moves": " ".join(game.board.move_stack),  # moves of the game (UCI)
-            "nnue": game.board.nnue,
-            "nodes": 500000,  # optional limit
-            #  "skipPositions": [1, 4, 5]  # 0 is the first position
-        }
-        app_state.fishnet_works[work_id] = work
-        app_state.fishnet_queue.put_nowait((ANALYSIS, work_id))
+        # positions evaluated in earlier analyses (of this game or of a game with
+        # the same opening) are sent right away, and fishnet workers will skip them
+        keys = game_position_keys(game)
+        cached = app_state.analysis_cache.lookup(keys)
+        for ply, step in enumerate(game.steps):
+            if ply in cached:
+                step["analysis"] = cached[ply]
+                await send_analysis(app_state, data["username"], game, ply)
+            elif "analysis" in step:
+                del step["analysis"]
+
+        # fishnet_analysis() will fill this array in place. Start it with the cached plies
+        # preceding the first missing one, the rest is padded with None by mongodb as needed.
+        prefix = []
+        while len(prefix) in cached:
+            prefix.append(cached[len(prefix)])
+        await app_state.db.game.find_one_and_update({"_id": game.id}, {"$set": {"a": prefix}})
+        new_data = {"a.%s" % ply: ceval for ply, ceval in cached.items() if ply > len(prefix)}
+        if new_data:
+            await app_state.db.game.find_one_and_update({"_id": game.id}, {"$set": new_data})
+
+        if len(cached) < len(game.steps):
+            work_id = "".join(random.choice(string.ascii_letters + string.digits) for x in range(6))
+            work = {
+                "work": {
+                    "type": "analysis",
+                    "id": work_id,
+                },
+                # or:
+                # "work": {
+                #   "type": "move",
+                #   "id": "work_id",
+                #   "level": 5 // 1 to 8
+                # },
+                "username": data["username"],
+                "game_id": data["gameId"],  # optional
+                "position": game.board.initial_fen,  # start position (X-FEN)
+                "variant": game.variant,
+                "chess960": game.chess960,
+                "moves": " ".join(game.board.move_stack),  # moves of the game (UCI)
+                "nnue": game.board.nnue,
+                "nodes": 500000,  # optional limit
+                "skipPositions": sorted(cached),  # 0 is the first position
+            }
+            app_state.fishnet_works.put(work)
     else:
         engine = app_state.users["Fairy-Stockfish"]
 
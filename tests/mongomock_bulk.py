@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+async def bulk_write(self, requests, ordered=True, **kwargs):
+    """
+    bulk_write() of UpdateOne requests applied one by one with update_one()
+
+    mongomock can't run UpdateOne requests of the pymongo we use (its BulkOperationBuilder
+    doesn't know the sort argument), and it doesn't report invalid documents as write errors.
+    Failed requests are reported with BulkWriteError like the server does.
+    """
+    write_errors = []
+    for index, request in enumerate(requests):
+        assert isinstance(request, UpdateOne)
+        try:
+            await self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+        except Exception as e:
+            write_errors.append({"index": index, "code": 2, "errmsg": str(e), "op": request})
+            if ordered:
+                break
+
+    if write_errors:
+        raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": []})
+
+
+def patch_bulk_write():
+    return patch("mongomock_motor.AsyncMongoMockCollection.bulk_write", bulk_write)
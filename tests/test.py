@@ -1,27 +1,51 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import unittest
-from datetime import datetime, timezone
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from operator import neg
+from types import SimpleNamespace
+from unittest.mock import patch
 
+import pyffish as sf
 from aiohttp.test_utils import AioHTTPTestCase
 from sortedcollections import ValueSortedDict
 
 from mongomock_motor import AsyncMongoMockClient
 
 import game
-from const import CREATED, STALEMATE, MATE, reserved
+from ai import move_work_position
+from analysis_cache import AnalysisCache, position_keys
+from const import CREATED, MAX_HIGHSCORE_ITEM_LIMIT, STALEMATE, STARTED, MATE, reserved
 from fairy import FairyBoard
+from fishnet_works import MAX_LEASES, FishnetWorks
+from generate_crosstable import (
+    CROSSTABLE_RESULTS,
+    CROSSTABLE_WATERMARK,
+    add_to_crosstable,
+    generate_crosstable,
+)
+from generate_highscore import update_highscore
 from game import Game
+from live_games import LIVE_GAMES_LIMIT
+from mongomock_bulk import patch_bulk_write
+from import_puzzles import upsert_puzzles, validate_lines
 from bug.game_bug import GameBug
-from glicko2.glicko2 import DEFAULT_PERF, Glicko2, WIN, LOSS
-from newid import id8
+from glicko2.batch import rate_batch
+from glicko2.glicko2 import DEFAULT_PERF, DRAW, Glicko2, WIN, LOSS
+from newid import id8, new_ids
 from server import make_app
 from user import User
 from utils import sanitize_fen
+from puzzle import next_puzzle
+from puzzle_cache import PuzzleCache
 from pychess_global_app_state_utils import get_app_state
+from rebuild_ratings import replay_games
+from trophies import Trophies
 from variants import VARIANTS
+from variant_stats import game_period, get_variant_stats_docs
 
 game.KEEP_TIME = 0
 game.MAX_PLY = 120
@@ -107,6 +131,18 @@ class GameResultTestCase(AioHTTPTestCase):
         self.assertEqual(game.result, "0-1")
         self.assertEqual(game.status, MATE)
 
+    async def test_unfinished_analysis_steps(self):
+        game = Game(get_app_state(self.app), "12345678", "chess", "", self.wplayer, self.bplayer)
+        game.board.move_stack = ["e2e4", "e7e5", "g1f3"]
+        ceval = {"s": {"cp": 20}}
+        # fishnet results arrived for plies 0 and 2 only
+        game.analysis = [ceval, None, ceval]
+
+        game.create_steps()
+        self.assertEqual([step.get("analysis") for step in game.steps], [ceval, None, ceval, None])
+        self.assertNotIn("analysis", game.steps[1])
+        self.assertNotIn("analysis", game.steps[3])
+
     async def test_atomic_stalemate(self):
         FEN = "K7/Rk6/2B5/8/8/8/7Q/8 w - - 0 1"
         game = Game(
@@ -406,6 +442,44 @@ class HighscoreTestCase(AioHTTPTestCase):
             not in game.app_state.highscore["crazyhouse960"].keys()[:10]
         )
 
+    async def test_highscore_list_is_capped(self):
+        app_state = get_app_state(self.app)
+        scores = {"player%s|" % i: 1500 + i for i in range(MAX_HIGHSCORE_ITEM_LIMIT)}
+        await update_highscore(app_state, "crazyhouse960", scores)
+
+        hs = app_state.highscore["crazyhouse960"]
+        self.assertEqual(len(hs), MAX_HIGHSCORE_ITEM_LIMIT)
+        self.assertEqual(hs.peekitem(-1)[1], 1500 + len(ZH960))
+
+        doc = await app_state.db.highscore.find_one({"_id": "crazyhouse960"})
+        self.assertEqual(doc["scores"], {key: value for key, value in scores.items() if key in hs})
+
+
+class TrophiesTestCase(unittest.TestCase):
+    def test_highscore_trophies(self):
+        trophies = Trophies()
+        hs = ValueSortedDict(neg, ZH960)
+        trophies.update_highscore("crazyhouse960", hs)
+
+        self.assertEqual(trophies.highscore_trophies("user0|NM"), [("crazyhouse960", "top1")])
+        self.assertEqual(trophies.highscore_trophies("user9|"), [("crazyhouse960", "top10")])
+
+        hs.update({"newplayer|": 2000})
+        trophies.update_highscore("crazyhouse960", hs)
+
+        self.assertEqual(trophies.highscore_trophies("newplayer|"), [("crazyhouse960", "top1")])
+        self.assertEqual(trophies.highscore_trophies("user0|NM"), [("crazyhouse960", "top10")])
+        self.assertEqual(trophies.highscore_trophies("user9|"), [])
+
+    def test_shield_trophies(self):
+        trophies = Trophies()
+        trophies.set_shield_owner("crazyhouse", "user0")
+        trophies.set_shield_owner("atomic", "user0")
+        trophies.set_shield_owner("crazyhouse", "user1")
+
+        self.assertEqual(trophies.shield_trophies("user0"), [("atomic", "shield")])
+        self.assertEqual(trophies.shield_trophies("user1"), [("crazyhouse", "shield")])
+
 
 class RatingTestCase(AioHTTPTestCase):
     async def startup(self, app):
@@ -506,6 +580,219 @@ class RatingTestCase(AioHTTPTestCase):
         self.assertEqual(round(r1.sigma, 6), 0.059996)
 
 
+class BatchRatingTestCase(unittest.IsolatedAsyncioTestCase):
+    def test_rate_batch_equals_rate(self):
+        gl2 = Glicko2()
+        now = datetime.now(timezone.utc)
+        cases = [
+            # (mu, phi, sigma, days, other_mu, other_phi, score)
+            (1500, 350, 0.06, 0, 1500, 350, WIN),
+            (1500, 350, 0.06, 0, 1500, 350, DRAW),
+            (2100, 60, 0.05, 30, 1400, 110, LOSS),
+            (1200, 45, 0.09, 2, 2400, 80, WIN),
+            (1800, 200, 0.06, 400, 1750, 35, DRAW),
+        ]
+        mu, phi, sigma = rate_batch(
+            [case[0] for case in cases],
+            [case[1] for case in cases],
+            [case[2] for case in cases],
+            [case[4] for case in cases],
+            [case[5] for case in cases],
+            [case[6] for case in cases],
+            [case[3] for case in cases],
+        )
+        for i, (r, d, v, days, other_r, other_d, score) in enumerate(cases):
+            rating = gl2.create_rating(r, d, v, now - timedelta(days=days))
+            other = gl2.create_rating(other_r, other_d)
+            expected = gl2.rate(rating, [(score, other)])
+            self.assertAlmostEqual(mu[i], expected.mu, places=3)
+            self.assertAlmostEqual(phi[i], expected.phi, places=3)
+            self.assertAlmostEqual(sigma[i], expected.sigma, places=6)
+
+    async def test_replay_games(self):
+        db = AsyncMongoMockClient()["test"]
+        date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        await db.game.insert_many(
+            [
+                {"_id": "g1", "us": ["a", "b"], "v": "n", "z": 0, "y": 1, "r": "a", "d": date},
+                {"_id": "g2", "us": ["c", "d"], "v": "n", "z": 0, "y": 1, "r": "c", "d": date},
+                {"_id": "g3", "us": ["b", "a"], "v": "n", "z": 0, "y": 1, "r": "b", "d": date},
+                # casual, unfinished and 960 games are not counted
+                {"_id": "g4", "us": ["a", "b"], "v": "n", "z": 0, "y": 0, "r": "a", "d": date},
+                {"_id": "g5", "us": ["a", "b"], "v": "n", "z": 0, "y": 1, "r": "d", "d": date},
+                {"_id": "g6", "us": ["a", "b"], "v": "n", "z": 1, "y": 1, "r": "a", "d": date},
+            ]
+        )
+        perfs = await replay_games(db, ("chess",))
+
+        self.assertEqual(sorted(perfs["chess"]), ["a", "b", "c", "d"])
+        self.assertEqual(perfs["chess"]["a"].nb, 2)
+        self.assertEqual(perfs["chess"]["c"].nb, 1)
+        self.assertGreater(perfs["chess"]["a"].mu, 1500)
+        self.assertAlmostEqual(perfs["chess"]["c"].mu, 1500)
+
+
+class PuzzleSelectorTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_next_puzzle_serves_every_puzzle_once(self):
+        app_state = get_app_state(self.app)
+        docs = [
+            {
+                "_id": "p%04d" % i,
+                "variant": "chess",
+                "fen": FairyBoard.start_fen("chess"),
+                "moves": "e2e4",
+                "type": "mate",
+                "eval": "#2",
+                "perf": {"gl": {"r": 1000 + 100 * i, "d": 350, "v": 0.06}},
+            }
+            for i in range(10)
+        ]
+        docs[9]["cooked"] = True
+        await app_state.db.puzzle.insert_many(docs)
+
+        user = User(app_state, username="solver", perfs={}, pperfs={})
+        user.pperfs["chess"] = {"gl": {"r": 1350, "d": 350, "v": 0.06}, "la": None, "nb": 0}
+        user.puzzle_variant = "chess"
+        request = SimpleNamespace(app=self.app)
+
+        puzzle = await next_puzzle(request, user)
+        self.assertEqual(puzzle["_id"], "p0003")
+
+        served = {puzzle["_id"]}
+        for _ in range(8):
+            served.add((await next_puzzle(request, user))["_id"])
+        self.assertEqual(served, {"p%04d" % i for i in range(9)})
+
+        puzzle = await next_puzzle(request, user)
+        self.assertEqual(puzzle["_id"], "0")
+
+
+@patch_bulk_write()
+class PuzzleCacheTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_coalesced_writes(self):
+        app_state = get_app_state(self.app)
+        cache = PuzzleCache(app_state, size=1)
+        await app_state.db.puzzle.insert_many(
+            [
+                {"_id": "p0001", "variant": "chess", "eval": "#2", "played": 5},
+                {"_id": "p0002", "variant": "chess", "eval": "#3"},
+            ]
+        )
+        user = User(app_state, username="solver", perfs={}, pperfs={})
+        await app_state.db.user.insert_one({"_id": "solver", "pperfs": {}})
+
+        doc = await cache.get("p0001")
+        self.assertIs(await cache.get("p0001"), doc)
+
+        perf = {"gl": {"r": 1600, "d": 300, "v": 0.06}, "la": None, "nb": 1}
+        cache.inc("p0001", "played")
+        cache.inc("p0001", "played")
+        cache.inc("p0001", "up")
+        cache.set_perf("p0001", perf)
+        user.pperfs["chess"] = perf
+        cache.set_user_pperfs(user)
+        self.assertEqual(doc["played"], 7)
+
+        # evicted before the flush, reloaded with the pending changes
+        await cache.get("p0002")
+        doc = await cache.get("p0001")
+        self.assertEqual((doc["played"], doc["up"], doc["perf"]), (7, 1, perf))
+
+        await cache.flush()
+        self.assertEqual(len(cache), 0)
+        cache.flush_task.cancel()
+
+        doc = await app_state.db.puzzle.find_one({"_id": "p0001"})
+        self.assertEqual((doc["played"], doc["up"], doc["perf"]["gl"]["r"]), (7, 1, 1600))
+        doc = await app_state.db.user.find_one({"_id": "solver"})
+        self.assertEqual(doc["pperfs"]["chess"]["nb"], 1)
+
+    async def test_failed_flush_is_retried(self):
+        app_state = get_app_state(self.app)
+        cache = PuzzleCache(app_state)
+        await app_state.db.puzzle.insert_one({"_id": "p0001", "variant": "chess", "played": 5})
+        perf = {"gl": {"r": 1600, "d": 300, "v": 0.06}, "la": None, "nb": 1}
+
+        cache.inc("p0001", "played")
+        cache.set_perf("p0001", perf)
+        cache.flush_task.cancel()
+        with patch(
+            "mongomock_motor.AsyncMongoMockCollection.update_one", side_effect=ConnectionError
+        ):
+            await cache.flush()
+        # the unsaved changes are kept and a new flush is scheduled
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.flush_task.done())
+        cache.flush_task.cancel()
+
+        cache.inc("p0001", "played")
+        await cache.flush()
+        self.assertEqual(len(cache), 0)
+
+        doc = await app_state.db.puzzle.find_one({"_id": "p0001"})
+        self.assertEqual((doc["played"], doc["perf"]["gl"]["r"]), (7, 1600))
+
+
+class ImportPuzzlesTestCase(unittest.TestCase):
+    def test_validate_lines(self):
+        fen = "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"
+        duck_fen = FairyBoard.start_fen("duck")
+        lines = [
+            json.dumps({"_id": "a0001", "variant": "chess", "fen": fen, "moves": "a1a8"}),
+            json.dumps({"_id": "a0002", "variant": "chess", "fen": fen, "moves": "a1a9"}),
+            json.dumps({"_id": "a0003", "variant": "chess", "fen": "8/8 w - - 0 1", "moves": "a"}),
+            json.dumps({"_id": "a0004", "variant": "chess960", "fen": fen, "moves": "a1a8"}),
+            json.dumps({"_id": "a0005", "variant": "chess", "fen": fen}),
+            json.dumps(
+                {"_id": "a0006", "variant": "duck", "fen": duck_fen, "moves": "e2e4,e4e5,e7e6,e6d4"}
+            ),
+            "{",
+            "",
+        ]
+        docs, rejected = validate_lines(enumerate(lines, start=1))
+        self.assertEqual(
+            [(lineno, doc["_id"]) for lineno, doc in docs], [(1, "a0001"), (6, "a0006")]
+        )
+        self.assertEqual([lineno for lineno, _, _ in rejected], [2, 3, 4, 5, 7])
+        self.assertTrue(rejected[0][1].startswith("illegal move a1a9"))
+
+        # lines without "uploaded_by" are skipped by default
+        lines[5] = json.dumps({"uploaded_by": "user", **json.loads(lines[5])})
+        docs, rejected = validate_lines(enumerate(lines, start=1), uploaded_only=True)
+        self.assertEqual([doc["_id"] for _, doc in docs], ["a0006"])
+        self.assertEqual([lineno for lineno, _, _ in rejected], [7])
+
+
+@patch_bulk_write()
+class UpsertPuzzlesTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_writes_are_reported(self):
+        db = AsyncMongoMockClient()["test"]
+        docs = [
+            (1, {"_id": "a0001", "variant": "chess"}),
+            # mongodb refuses top level field names starting with $
+            (2, {"_id": "a0002", "variant": "chess", "$bad": 1}),
+            (3, {"_id": "a0003", "variant": "chess"}),
+        ]
+        failed = await upsert_puzzles(db, docs)
+        self.assertEqual([(lineno, reason) for lineno, reason, _ in failed], [(2, "write failed")])
+        self.assertEqual(json.loads(failed[0][2])["_id"], "a0002")
+        self.assertEqual(await db.puzzle.count_documents({}), 2)
+
+
 class FirstRatedGameTestCase(AioHTTPTestCase):
     async def startup(self, app):
         self.bplayer1 = User(get_app_state(self.app), username="bplayer", perfs=PERFS["newplayer"])
@@ -560,5 +847,454 @@ class FirstRatedGameTestCase(AioHTTPTestCase):
         self.assertEqual(round(rw.mu, 3), 1337.788)
 
 
+class OnlineCountTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_online_and_auto_pairing_count(self):
+        app_state = get_app_state(self.app)
+        online_count = app_state.online_count()
+
+        user = User(app_state, username="player", perfs=PERFS["newplayer"])
+        anon = User(app_state, username="Anon-player", anon=True)
+        user.lobby_sockets.add("ws")
+        user.update_online()
+        anon.lobby_sockets.add("ws")
+        anon.update_online()
+        self.assertEqual(app_state.online_count(), online_count + 2)
+
+        user.lobby_sockets.clear()
+        user.update_online()
+        self.assertEqual(app_state.online_count(), online_count + 1)
+
+        user.update_auto_pairing(ready=True)
+        self.assertEqual(app_state.auto_pairing_count(), 0)
+
+        app_state.auto_pairing_users[user] = (-10000, 10000)
+        user.ready_for_auto_pairing = True
+        self.assertEqual(app_state.auto_pairing_count(), 1)
+
+        user.remove_from_auto_pairings()
+        self.assertEqual(app_state.auto_pairing_count(), 0)
+
+
+class LiveGamesTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_newest_games(self):
+        app_state = get_app_state(self.app)
+        wplayer = User(app_state, username="wplayer", perfs=PERFS["newplayer"])
+        bplayer = User(app_state, username="bplayer", perfs=PERFS["newplayer"])
+
+        games = []
+        for variant, chess960 in (("chess", False), ("crazyhouse", True), ("chess", False)):
+            game = Game(app_state, id8(), variant, "", wplayer, bplayer, chess960=chess960)
+            app_state.games[game.id] = game
+            games.append(game)
+
+        self.assertEqual(app_state.live_games.newest(), [])
+
+        for game in games:
+            game.status = STARTED
+        self.assertEqual(app_state.live_games.newest(), games)
+        self.assertEqual(app_state.live_games.newest(limit=2), games[1:])
+        self.assertEqual(app_state.live_games.newest("chess"), [games[0], games[2]])
+        self.assertEqual(app_state.live_games.newest("crazyhouse", True), [games[1]])
+
+        games[0].status = MATE
+        self.assertEqual(app_state.live_games.newest("chess"), [games[2]])
+
+        # started games not in app_state.games don't take the place of live ones
+        for _ in range(LIVE_GAMES_LIMIT):
+            game = Game(app_state, id8(), "chess", "", wplayer, bplayer)
+            game.status = STARTED
+        self.assertEqual(app_state.live_games.newest(), games[1:])
+        self.assertEqual(len(app_state.live_games.games), 2)
+
+
+class UserTitlesTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_get_titles(self):
+        app_state = get_app_state(self.app)
+        await app_state.db.user.insert_many([{"_id": "gmplayer", "title": "GM"}, {"_id": "player"}])
+
+        titles = await app_state.users.get_titles(
+            ("gmplayer", "player", "Fairy-Stockfish", "notindb")
+        )
+        self.assertEqual(
+            titles, {"gmplayer": "GM", "player": "", "Fairy-Stockfish": "BOT", "notindb": ""}
+        )
+        # users not loaded into memory are cached
+        self.assertEqual(app_state.users.titles, {"gmplayer": "GM", "player": "", "notindb": ""})
+        self.assertNotIn("gmplayer", app_state.users)
+
+    async def test_titles_cache(self):
+        app_state = get_app_state(self.app)
+        await app_state.db.user.insert_many([{"_id": "p%s" % i} for i in range(3)])
+
+        with patch("users.TITLE_CACHE_SIZE", 2):
+            await app_state.users.get_titles(("p0", "p1"))
+            await app_state.users.get_titles(("p0",))
+            await app_state.users.get_titles(("p2",))
+        # the least recently used title is evicted
+        self.assertEqual(list(app_state.users.titles), ["p0", "p2"])
+
+        await app_state.db.user.update_one({"_id": "p0"}, {"$set": {"title": "GM"}})
+        app_state.users.set_title("p0", "GM")
+        titles = await app_state.users.get_titles(("p0",))
+        self.assertEqual(titles, {"p0": "GM"})
+
+
+class UserGamesStreamTestCase(AioHTTPTestCase):
+    async def startup(self, app):
+        app_state = get_app_state(self.app)
+        app_state.users["aplayer"] = User(app_state, username="aplayer", perfs=PERFS["newplayer"])
+        app_state.users["bplayer"] = User(app_state, username="bplayer", perfs=PERFS["newplayer"])
+
+        date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        await app_state.db.game.insert_many(
+            [
+                {
+                    "_id": "game%04d" % i,
+                    "us": ["aplayer", "bplayer"],
+                    "v": "n",
+                    "z": 0,
+                    "r": "a",
+                    "m": [],
+                    "d": date + timedelta(minutes=i // 2),
+                    "y": 1,
+                }
+                for i in range(6)
+            ]
+        )
+
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient(), simple_cookie_storage=True)
+        app.on_startup.append(self.startup)
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def get_games(self, **params):
+        self.client.session.cookie_jar.update_cookies(
+            {"AIOHTTP_SESSION": json.dumps({"session": {"user_name": "bplayer"}})}
+        )
+        resp = await self.client.request("GET", "/games/ndjson/aplayer", params=params)
+        self.assertEqual(resp.status, 200)
+        text = await resp.text()
+        return [json.loads(line) for line in text.splitlines()]
+
+    async def test_stream_and_resume(self):
+        games = await self.get_games()
+        self.assertEqual([game["id"] for game in games], ["game%04d" % i for i in range(6)])
+
+        # resume after the 3rd game, which has the same date as the 4th one
+        games = await self.get_games(since=games[2]["date"], id=games[2]["id"], variant="chess")
+        self.assertEqual([game["id"] for game in games], ["game0003", "game0004", "game0005"])
+
+
+class VariantStatsTestCase(AioHTTPTestCase):
+    async def startup(self, app):
+        app_state = get_app_state(self.app)
+        self.wplayer = User(app_state, username="wplayer", perfs=PERFS["newplayer"])
+        self.bplayer = User(app_state, username="bplayer", perfs=PERFS["newplayer"])
+
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        app.on_startup.append(self.startup)
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_save_game_counts(self):
+        app_state = get_app_state(self.app)
+        for wplayer in (self.wplayer, app_state.users["Random-Mover"]):
+            game = Game(app_state, id8(), "chess", "", wplayer, self.bplayer, rated=False)
+            clocks = [game.clocks_w[0], game.clocks_b[0]]
+            for i, move in enumerate(("e2e4", "e7e5", "f2f4"), start=1):
+                await game.play_move(move, clocks=clocks, ply=i)
+            await game.game_ended(self.bplayer, "resign")
+
+        period = game_period(game.date)
+        docs = await get_variant_stats_docs(app_state, False, period)
+        self.assertEqual(docs, [{"_id": {"p": period, "v": "n", "z": 0}, "c": 2}])
+
+        docs = await get_variant_stats_docs(app_state, True, period)
+        self.assertEqual(docs, [{"_id": {"p": period, "v": "n", "z": 0}, "c": 1}])
+
+
+class CrosstableTestCase(unittest.TestCase):
+    def test_add_to_crosstable(self):
+        ct = {}
+        for i in range(30):
+            doc = {
+                "_id": "game%04d" % i,
+                "us": ["bplayer", "aplayer"] if i % 2 else ["aplayer", "bplayer"],
+                "v": "n",
+                "r": "abc"[i % 3],
+            }
+            add_to_crosstable(ct, doc)
+        # games against engines are not counted
+        add_to_crosstable(
+            ct, {"_id": "x", "us": ["aplayer", "Fairy-Stockfish"], "v": "n", "r": "a"}
+        )
+
+        self.assertEqual(list(ct), ["aplayer/bplayer"])
+        self.assertEqual(ct["aplayer/bplayer"]["s1"] + ct["aplayer/bplayer"]["s2"], 300)
+        self.assertEqual(len(ct["aplayer/bplayer"]["r"]), CROSSTABLE_RESULTS)
+        self.assertEqual(ct["aplayer/bplayer"]["r"][-1], "game0029=")
+
+
+@patch_bulk_write()
+class GenerateCrosstableTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app_state = SimpleNamespace(db=AsyncMongoMockClient(tz_aware=True)["test"])
+        self.start = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=70)
+
+    def game_doc(self, i, result="abc", **kwargs):
+        doc = {
+            "_id": "game%04d" % i,
+            "us": ["bplayer", "aplayer"] if i % 2 else ["aplayer", "bplayer"],
+            "v": "n",
+            "r": result[i % len(result)],
+            "s": 1,
+            "d": self.start + timedelta(days=i),
+        }
+        doc.update(kwargs)
+        return doc
+
+    async def expected_crosstable(self):
+        ct = {}
+        async for doc in self.app_state.db.game.find().sort([("d", 1), ("_id", 1)]):
+            add_to_crosstable(ct, doc)
+        return ct
+
+    async def test_rebuild_and_watermark(self):
+        db = self.app_state.db
+        # an ongoing correspondence game and an abandoned unfinished game among 60 games
+        unfinished = {
+            20: self.game_doc(20, result="d", s=-1),
+            40: self.game_doc(40, result="d", s=-1, c=True),
+        }
+        await db.game.insert_many([unfinished.get(i, self.game_doc(i)) for i in range(60)])
+
+        await generate_crosstable(self.app_state)
+        ct = await db.crosstable.find_one({"_id": "aplayer/bplayer"})
+        self.assertEqual(ct, (await self.expected_crosstable())["aplayer/bplayer"])
+        self.assertEqual(len(ct["r"]), CROSSTABLE_RESULTS)
+
+        # the watermark stays before the unfinished game
+        watermark = await db.watermark.find_one({"_id": CROSSTABLE_WATERMARK})
+        self.assertEqual(watermark["d"], self.start + timedelta(days=40))
+
+        # 30 new games were saved live by Game.save_crosstable() and the correspondence game ended
+        await db.game.insert_many([self.game_doc(i) for i in range(60, 90)])
+        await db.game.update_one({"_id": "game0040"}, {"$set": {"r": "a", "s": 2}})
+        expected = (await self.expected_crosstable())["aplayer/bplayer"]
+        live = dict(expected)
+        live["r"] = [result for result in expected["r"] if result != "game0040+"]
+        await db.crosstable.replace_one({"_id": "aplayer/bplayer"}, live)
+
+        await generate_crosstable(self.app_state, incremental=True)
+        ct = await db.crosstable.find_one({"_id": "aplayer/bplayer"})
+        # nothing was counted twice, and the correspondence game was counted once
+        self.assertEqual(ct, expected)
+
+        # with nothing new an incremental run changes nothing
+        await generate_crosstable(self.app_state, incremental=True)
+        self.assertEqual(await db.crosstable.find_one({"_id": "aplayer/bplayer"}), expected)
+
+    async def test_incremental_without_watermark(self):
+        db = self.app_state.db
+        await db.game.insert_many([self.game_doc(i) for i in range(30)])
+        # a stale document is replaced by a full rebuild
+        await db.crosstable.insert_one({"_id": "aplayer/bplayer", "s1": 1000, "s2": 0, "r": []})
+
+        await generate_crosstable(self.app_state, incremental=True)
+        ct = await db.crosstable.find_one({"_id": "aplayer/bplayer"})
+        self.assertEqual(ct, (await self.expected_crosstable())["aplayer/bplayer"])
+
+
+class AnalysisCacheTestCase(unittest.TestCase):
+    def test_shared_prefix(self):
+        fen = FairyBoard.start_fen("chess")
+        keys1 = position_keys("chess", False, fen, ["e2e4", "e7e5", "g1f3"])
+        keys2 = position_keys("chess", False, fen, ["e2e4", "e7e5", "f1c4"])
+        keys3 = position_keys("crazyhouse", False, fen, ["e2e4", "e7e5"])
+        self.assertEqual(keys1[:3], keys2[:3])
+        self.assertNotEqual(keys1[3], keys2[3])
+        self.assertTrue(set(keys1).isdisjoint(keys3))
+
+        cache = AnalysisCache(size=3)
+        for ply, key in enumerate(keys1):
+            cache.put(key, {"s": {"cp": ply}})
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.lookup(keys2), {1: {"s": {"cp": 1}}, 2: {"s": {"cp": 2}}})
+
+
+class MoveWorkPositionTestCase(unittest.TestCase):
+    @staticmethod
+    def played_game(variant, moves):
+        board = FairyBoard(variant)
+        steps = [{"fen": board.initial_fen}]
+        for move in moves:
+            board.push(move)
+            steps.append({"fen": board.fen})
+        return SimpleNamespace(board=board, steps=steps)
+
+    def test_moves_since_last_irreversible_move(self):
+        moves = ["e2e4", "e7e5", "g1f3", "b8c6", "f3g1", "c6b8", "g1f3", "b8c6"]
+        game = self.played_game("chess", moves)
+        position, work_moves = move_work_position(game)
+        self.assertEqual(position, game.steps[2]["fen"])
+        self.assertEqual(work_moves, moves[2:])
+        self.assertEqual(sf.get_fen("chess", position, work_moves), game.board.fen)
+
+        game = self.played_game("chess", ["g1f3", "g8f6"])
+        self.assertEqual(move_work_position(game), (game.board.initial_fen, ["g1f3", "g8f6"]))
+
+    def test_captures_to_hand_repetition(self):
+        # the knights are exchanged and dropped back twice, the start position repeats
+        cycle = ["f3e5", "c6e5", "N@f3", "N@c6"]
+        moves = ["g1f3", "b8c6", "b1c3", "g8f6", "c3b1", "f6g4", "b1c3", "g4e5"] + 2 * cycle
+        game = self.played_game("crazyhouse", moves)
+        position, work_moves = move_work_position(game)
+        self.assertEqual((position, work_moves), (game.board.initial_fen, moves))
+        self.assertEqual(sf.is_optional_game_end("crazyhouse", position, work_moves), (True, 0))
+
+    def test_full_history_variants(self):
+        game = self.played_game("ataxx", [])
+        game.board.push(game.board.legal_moves()[0])
+        game.steps.append({"fen": game.board.fen})
+        self.assertEqual(move_work_position(game), (game.board.initial_fen, game.board.move_stack))
+
+
+class FishnetWorksTestCase(unittest.TestCase):
+    @staticmethod
+    def work(work_id, work_type):
+        return {"work": {"type": work_type, "id": work_id}, "moves": "e2e4"}
+
+    def test_leases(self):
+        works = FishnetWorks()
+        works.put(self.work("a1", "analysis"))
+        works.put(self.work("m1", "move"))
+
+        with patch("fishnet_works.monotonic", return_value=100.0):
+            # move works first
+            self.assertEqual(works.next_work_id(), "m1")
+            works.lease("m1", "key1")
+            self.assertEqual(works.next_work_id(), "a1")
+            works.lease("a1", "key2")
+            self.assertIsNone(works.next_work_id())
+
+        # the move lease expired, the analysis lease is renewed by a partial result
+        with patch("fishnet_works.monotonic", return_value=110.0):
+            works.renew("a1")
+            self.assertEqual(works.next_work_id(), "m1")
+            works.lease("m1", "key2")
+            self.assertEqual(works.attempts["m1"], 2)
+            self.assertTrue(works.leased_to_other("m1", "key1"))
+            self.assertFalse(works.leased_to_other("m1", "key2"))
+
+        with patch("fishnet_works.monotonic", return_value=112.0):
+            works.release("m1")
+            del works["m1"]
+            works.release("a1")
+            del works["a1"]
+            self.assertIsNone(works.next_work_id())
+
+        metrics = works.metrics()
+        self.assertEqual((metrics["works"], metrics["leased"], metrics["requeued"]), (0, 0, 1))
+        self.assertEqual(metrics["leaseLatency"]["move"]["avg"], 2.0)
+        self.assertEqual(metrics["leaseLatency"]["analysis"]["max"], 12.0)
+
+    def test_abandoned_work_dropped(self):
+        works = FishnetWorks()
+        works.put(self.work("m1", "move"))
+        for i in range(MAX_LEASES):
+            with patch("fishnet_works.monotonic", return_value=100.0 + 10 * i):
+                self.assertEqual(works.next_work_id(), "m1")
+                works.lease("m1", "key1")
+
+        with patch("fishnet_works.monotonic", return_value=200.0):
+            self.assertIsNone(works.next_work_id())
+        self.assertNotIn("m1", works)
+        self.assertEqual(works.metrics()["dropped"], 1)
+
+    def test_move_work_of_running_game_kept(self):
+        game = SimpleNamespace(status=STARTED)
+        works = FishnetWorks({"game1234": game})
+        works.put({**self.work("m1", "move"), "game_id": "game1234"})
+        for i in range(MAX_LEASES + 2):
+            with patch("fishnet_works.monotonic", return_value=100.0 + 10 * i):
+                self.assertEqual(works.next_work_id(), "m1")
+                works.lease("m1", "key1")
+
+        # the bot game still gets its move from the next worker
+        with patch("fishnet_works.monotonic", return_value=200.0):
+            self.assertEqual(works.next_work_id(), "m1")
+            works.lease("m1", "key2")
+
+        # once the game ended the work is dropped
+        game.status = MATE
+        with patch("fishnet_works.monotonic", return_value=300.0):
+            self.assertIsNone(works.next_work_id())
+        self.assertNotIn("m1", works)
+
+
+class FishnetResultTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    @patch.dict("fishnet.FISHNET_KEYS", {"key1": "worker1", "key2": "worker2"})
+    async def test_late_move_result_ignored(self):
+        app_state = get_app_state(self.app)
+        for worker in ("worker1", "worker2"):
+            app_state.fishnet_monitor[worker] = deque([], 50)
+
+        works = app_state.fishnet_works
+        works.put({"work": {"type": "move", "id": "m1"}, "game_id": "game1234"})
+        self.assertEqual(works.next_work_id(), "m1")
+        works.lease("m1", "key2")
+
+        data = {"fishnet": {"apikey": "key1"}, "move": {"bestmove": "e2e4"}}
+        response = await self.client.post("/fishnet/move/m1", json=data)
+        self.assertEqual(response.status, 204)
+        self.assertIn("m1", works)
+        self.assertEqual(works.leases["m1"].worker, "key2")
+
+
+class NewIdsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_new_ids_skip_existing(self):
+        table = AsyncMongoMockClient()["test"].game
+        await table.insert_one({"_id": "aaaaaaaa"})
+
+        with patch("newid.id8", side_effect=["aaaaaaaa", "bbbbbbbb", "cccccccc"]):
+            ids = await new_ids(table, 2)
+
+        self.assertEqual(sorted(ids), ["bbbbbbbb", "cccccccc"])
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
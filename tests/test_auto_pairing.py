@@ -6,10 +6,11 @@ from mongomock_motor import AsyncMongoMockClient
 from aiohttp.test_utils import AioHTTPTestCase
 
 from server import make_app
-from seek import Seek
+from seek import Seek, Seeks
 from user import User
 from pychess_global_app_state_utils import get_app_state
 from glicko2.glicko2 import DEFAULT_PERF
+from auto_pairing_index import AutoPairingIndex
 from auto_pair import (
     add_to_auto_pairings,
     find_matching_seek,
@@ -318,5 +319,56 @@ class AutoPairingTestCase(AioHTTPTestCase):
         self.assertEqual(result, self.aplayer)
 
 
+class RatedUser:
+    def __init__(self, username, rating):
+        self.username = username
+        self.rating = rating
+
+    def get_rating_value(self, variant, chess960):
+        return self.rating
+
+
+class AutoPairingIndexTestCase(unittest.TestCase):
+    def test_candidates_in_rating_interval(self):
+        high = RatedUser("high", 2300)
+        low = RatedUser("low", 700)
+        default = RatedUser("default", 1500)
+
+        index = AutoPairingIndex("chess", False)
+        for user in (high, low, default, low):
+            index.add(user)
+        self.assertEqual(len(index), 3)
+
+        self.assertEqual(list(index.candidates(700, 1500)), [low, default])
+        self.assertEqual(list(index.candidates(1501, 2299)), [])
+
+        high.rating = 1000
+        index.update_rating(high)
+        self.assertEqual(list(index.candidates(900, 1100)), [high])
+
+        index.discard(low)
+        index.discard(low)
+        self.assertNotIn(low, index)
+        self.assertEqual(list(index.candidates(0, 3000)), [high, default])
+
+
+class SeeksTestCase(unittest.TestCase):
+    def test_index_and_counters(self):
+        creator = RatedUser("creator", 1500)
+        seeks = Seeks()
+        seeks["live"] = Seek("live", creator, "chess", base=3, inc=2, rated=True)
+        seeks["corr"] = Seek("corr", creator, "chess", day=3, rated=True)
+        seeks["other"] = Seek("other", creator, "chess", base=3, inc=2, rated=False)
+
+        self.assertEqual((seeks.live_count, seeks.corr_count), (2, 1))
+        self.assertEqual(seeks.matching("chess", False, 3, 2, 0, True), [seeks["live"]])
+
+        del seeks["live"]
+        seeks.pop("corr")
+        self.assertEqual((seeks.live_count, seeks.corr_count), (1, 0))
+        self.assertEqual(seeks.matching("chess", False, 3, 2, 0, True), [])
+        self.assertEqual(list(seeks), ["other"])
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+from indexes import (
+    INDEXES,
+    QUERY_SHAPES,
+    collscan_query_shapes,
+    create_indexes,
+    month_range,
+    plan_stages,
+)
+from settings import MONGO_HOST
+
+TEST_DB_NAME = "pychess-variants-index-test"
+
+
+class CreateIndexesTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_create_indexes(self):
+        db = AsyncMongoMockClient()["test"]
+        await create_indexes(db)
+
+        for spec in INDEXES:
+            info = await db[spec.collection].index_information()
+            keys = [index["key"] for index in info.values()]
+            self.assertIn(spec.keys, keys, "%s %s" % (spec.collection, spec.keys))
+
+    def test_every_query_shape_has_index(self):
+        indexed_collections = {spec.collection for spec in INDEXES}
+        for shape in QUERY_SHAPES:
+            self.assertIn(shape.collection, indexed_collections, shape.name)
+
+    def test_month_range(self):
+        start, end = month_range(2023, 12)
+        self.assertEqual((start.year, start.month, start.day), (2023, 12, 1))
+        self.assertEqual((end.year, end.month, end.day), (2024, 1, 1))
+
+    def test_plan_stages(self):
+        plan = {
+            "stage": "FETCH",
+            "inputStage": {
+                "stage": "SORT_MERGE",
+                "inputStages": [
+                    {"stage": "IXSCAN", "indexName": "us.0_1_d_-1"},
+                    {"stage": "COLLSCAN"},
+                ],
+            },
+        }
+        self.assertEqual(list(plan_stages(plan)), ["FETCH", "SORT_MERGE", "IXSCAN", "COLLSCAN"])
+
+
+class ExplainQueryShapesTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs every registered query shape through explain() on a real mongodb server"""
+
+    async def asyncSetUp(self):
+        self.client = AsyncMongoClient(MONGO_HOST, serverSelectionTimeoutMS=1000)
+        try:
+            await self.client.admin.command("ping")
+        except PyMongoError:
+            await self.client.close()
+            self.skipTest("No mongodb server available at %s" % MONGO_HOST)
+        self.db = self.client[TEST_DB_NAME]
+
+    async def asyncTearDown(self):
+        await self.client.drop_database(TEST_DB_NAME)
+        await self.client.close()
+
+    async def test_no_collscan(self):
+        for collection in {shape.collection for shape in QUERY_SHAPES}:
+            await self.db[collection].insert_one({})
+        await create_indexes(self.db)
+
+        self.assertEqual(await collscan_query_shapes(self.db), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,21 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import io
+import json
+import time
 import unittest
+from collections import namedtuple
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from aiohttp.test_utils import AioHTTPTestCase
 from mongomock_motor import AsyncMongoMockClient
 
 from const import (
+    ARENA,
     BYEGAME,
     STARTED,
     T_CREATED,
     T_STARTED,
     T_FINISHED,
 )
+from mongomock_bulk import patch_bulk_write
 from newid import id8
 from pychess_global_app_state_utils import get_app_state
 from server import make_app
+from tournament.arena_new import ArenaTournament
+from tournament.clock_scheduler import TournamentClockScheduler
+from tournament.leaderboard import Leaderboard
+from tournament.tournament import PlayerData, Tournament
+from tournament.tournaments import load_tournament
+from tournament.write_buffer import TournamentWriteBuffer
+from user import User
 from tournament.auto_play_arena import (
     ArenaTestTournament,
     SwissTestTournament,
@@ -28,7 +45,10 @@ log = logging.getLogger(__name__)
 
 ONE_TEST_ONLY = False
 
+Player = namedtuple("Player", "username")
 
+
+@patch_bulk_write()
 class TournamentTestCase(AioHTTPTestCase):
     async def tearDownAsync(self):
         app_state = get_app_state(self.app)
@@ -77,7 +97,7 @@ class TournamentTestCase(AioHTTPTestCase):
         await asyncio.sleep(3)
         self.assertEqual(self.tournament.status, T_FINISHED)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
     @unittest.skipIf(ONE_TEST_ONLY, "1 test only")
     async def test_tournament_players(self):
@@ -98,7 +118,7 @@ class TournamentTestCase(AioHTTPTestCase):
         self.assertEqual(len(self.tournament.players), NB_PLAYERS)
         self.assertEqual(len(self.tournament.leaderboard), NB_PLAYERS - 1)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
         self.assertEqual(self.tournament.status, T_FINISHED)
 
@@ -118,7 +138,7 @@ class TournamentTestCase(AioHTTPTestCase):
             del list(self.tournament.players.keys())[i].tournament_sockets[self.tournament.id]
         self.assertEqual(len(self.tournament.waiting_players()), NB_PLAYERS - 12)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
         self.assertEqual(self.tournament.status, T_FINISHED)
 
@@ -136,7 +156,7 @@ class TournamentTestCase(AioHTTPTestCase):
         app_state.tournaments[tid] = self.tournament
         await self.tournament.join_players(NB_PLAYERS)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
         self.assertEqual(self.tournament.status, T_FINISHED)
         self.assertEqual(
@@ -163,7 +183,7 @@ class TournamentTestCase(AioHTTPTestCase):
 
         self.assertEqual(len(self.tournament.waiting_players()), NB_PLAYERS - 2)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
         self.assertEqual(self.tournament.status, T_FINISHED)
 
@@ -179,7 +199,7 @@ class TournamentTestCase(AioHTTPTestCase):
         app_state.tournaments[tid] = self.tournament
         await self.tournament.join_players(NB_PLAYERS)
 
-        await self.tournament.clock_task
+        await self.tournament.clock_finished
 
         self.assertEqual(self.tournament.status, T_FINISHED)
         self.assertEqual(
@@ -188,5 +208,401 @@ class TournamentTestCase(AioHTTPTestCase):
         )
 
 
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, msg):
+        self.sent.append(json.loads(msg))
+
+
+class FailingWebSocket(FakeWebSocket):
+    async def send_str(self, msg):
+        raise RuntimeError("websocket closing")
+
+
+@patch_bulk_write()
+class TournamentBroadcastTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_coalesced_broadcasts(self):
+        app_state = get_app_state(self.app)
+        tid = id8()
+        tournament = ArenaTestTournament(app_state, tid, with_clock=False)
+        spectator = User(app_state, username="spectator")
+        ws = FakeWebSocket()
+        spectator.tournament_sockets[tid] = {ws}
+        tournament.spactator_join(spectator)
+
+        for i in range(3):
+            tournament.broadcast_later("duels", lambda: tournament.duels_json)
+            tournament.broadcast_later("game_update", lambda i=i: {"type": "game_update", "i": i})
+        self.assertEqual(ws.sent, [])
+
+        await tournament.flush_broadcasts()
+        self.assertEqual([msg["type"] for msg in ws.sent], ["duels", "game_update"])
+        self.assertEqual(ws.sent[1]["i"], 2)
+
+        await tournament.flush_broadcasts()
+        self.assertEqual(len(ws.sent), 2)
+
+    async def test_top_game_end(self):
+        app_state = get_app_state(self.app)
+        tid = id8()
+        tournament = ArenaTestTournament(app_state, tid, with_clock=False)
+        app_state.tournaments[tid] = tournament
+        await tournament.join_players(2)
+        spectator = User(app_state, username="spectator")
+        ws = FakeWebSocket()
+        spectator.tournament_sockets[tid] = {ws}
+        tournament.spactator_join(spectator)
+
+        _, games = await Tournament.create_new_pairings(tournament, list(tournament.players))
+        game = games[0]
+        self.assertIs(tournament.top_game, game)
+        await tournament.flush_broadcasts()
+        ws.sent.clear()
+
+        await game.game_ended(game.wplayer, "resign")
+        await tournament.flush_broadcasts()
+        self.assertEqual([msg["type"] for msg in ws.sent], ["gameEnd", "duels", "game_update"])
+        self.assertEqual(ws.sent[2]["wname"], game.wplayer.username)
+
+    async def test_broadcast_survives_failing_socket(self):
+        app_state = get_app_state(self.app)
+        tid = id8()
+        tournament = ArenaTestTournament(app_state, tid, with_clock=False)
+        spectator = User(app_state, username="spectator")
+        # the failing socket is the first one of the spectator
+        ws = FakeWebSocket()
+        spectator.tournament_sockets[tid] = [FailingWebSocket(), ws]
+        tournament.spactator_join(spectator)
+
+        await tournament.broadcast({"type": "game_update"})
+        self.assertEqual(ws.sent, [{"type": "game_update"}])
+
+
+@patch_bulk_write()
+class CreateGamesTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_failed_game_insert(self):
+        app_state = get_app_state(self.app)
+        tid = id8()
+        tournament = ArenaTestTournament(app_state, tid, with_clock=False)
+        app_state.tournaments[tid] = tournament
+        await tournament.join_players(4)
+        await app_state.db.game.insert_one({"_id": "game0001"})
+
+        with patch("tournament.tournament.new_ids", return_value=["game0001", "game0002"]):
+            pairing, games = await Tournament.create_new_pairings(
+                tournament, list(tournament.players)
+            )
+
+        self.assertEqual(len(pairing), 2)
+        self.assertEqual([game.id for game in games], ["game0002"])
+        self.assertNotIn("game0001", app_state.games)
+        self.assertEqual([game.id for game in tournament.ongoing_games], ["game0002"])
+
+        wp, bp = pairing[0]
+        for player in (wp, bp):
+            self.assertTrue(tournament.players[player].free)
+            self.assertEqual(tournament.players[player].games, [])
+
+
+class FakeClockTournament:
+    id = "tid12345"
+
+    def __init__(self):
+        self.ticks = []
+
+    async def clock_tick(self, now):
+        self.ticks.append(now)
+        return now + timedelta(seconds=0.2) if len(self.ticks) < 3 else None
+
+
+class TournamentClockSchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_ticks_when_due(self):
+        scheduler = TournamentClockScheduler()
+        tournament = FakeClockTournament()
+
+        scheduler.schedule(tournament, datetime.now(timezone.utc) + timedelta(seconds=0.1))
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(tournament.ticks), 0)
+
+        # an earlier request wins
+        scheduler.schedule(tournament, datetime.now(timezone.utc))
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(tournament.ticks), 1)
+
+        await asyncio.sleep(0.6)
+        self.assertEqual(len(tournament.ticks), 3)
+        self.assertTrue(scheduler.task.done())
+
+
+class LeaderboardTestCase(unittest.TestCase):
+    def test_rank_keeps_setting_order_of_ties(self):
+        players = [Player("player%s" % i) for i in range(5)]
+        leaderboard = Leaderboard([(player, 0) for player in players])
+
+        self.assertEqual([leaderboard.rank(player) for player in players], [1, 2, 3, 4, 5])
+
+        leaderboard.update({players[3]: 2})
+        leaderboard.update({players[0]: 0})
+        self.assertEqual(
+            list(leaderboard), [players[3], players[1], players[2], players[4], players[0]]
+        )
+
+        leaderboard.pop(players[1])
+        self.assertEqual(leaderboard.rank(players[4]), 3)
+
+
+class FakePairingArena(ArenaTournament):
+    id = "tid12345"
+    verify_pairing = True
+
+    def __init__(self, players):
+        self.players = {
+            player: PlayerData("", player.username, 1500 + 10 * i, "")
+            for i, player in enumerate(players)
+        }
+        self.leaderboard = Leaderboard([(player, 0) for player in players])
+        self.ongoing_games = set()
+
+
+class ArenaPairingTestCase(unittest.TestCase):
+    def test_unmatched_player_gets_paired_outside_candidates(self):
+        # lonely is the first by rank and by rating, and it played with its 8 nearest
+        # neighbours, who can't play with each other or with far because of their colors
+        lonely = Player("lonely")
+        neighbours = [Player("neighbour%s" % i) for i in range(ArenaTournament.pairing_candidates)]
+        far = Player("far")
+        arena = FakePairingArena([lonely, *neighbours, far])
+        for player in neighbours:
+            arena.players[player].prev_opp = lonely.username
+            arena.players[player].color_balance = arena.color_balance_limit
+        arena.players[far].color_balance = arena.color_balance_limit
+
+        pairing = arena.create_pairing([lonely, *neighbours, far])
+        self.assertEqual(pairing, [(lonely, far)])
+
+    def test_pairing_many_players(self):
+        players = [Player("player%02d" % i) for i in range(30)]
+        arena = FakePairingArena(players)
+
+        pairing = arena.create_pairing(players)
+        self.assertEqual(len(pairing), 15)
+        self.assertEqual(len({player for pair in pairing for player in pair}), 30)
+
+    def test_pairing_large_wave(self):
+        # previous opponents are neighbours by rank and by rating, so they are
+        # the best candidates of each other if the pairing doesn't avoid them
+        players = [Player("player%04d" % i) for i in range(1500)]
+        arena = FakePairingArena(players)
+        arena.verify_pairing = False
+        for i in range(0, len(players), 2):
+            player_a, player_b = players[i], players[i + 1]
+            arena.players[player_a].prev_opp = player_b.username
+            arena.players[player_b].prev_opp = player_a.username
+            arena.players[player_a].color_balance = 1
+            arena.players[player_b].color_balance = -1
+            arena.leaderboard.update({player_a: i // 2, player_b: i // 2})
+
+        start = time.time()
+        with redirect_stdout(io.StringIO()):
+            pairing = arena.create_pairing(players)
+        self.assertLess(time.time() - start, 10)
+
+        self.assertEqual(len(pairing), 750)
+        self.assertEqual(len({player for pair in pairing for player in pair}), 1500)
+        for player_a, player_b in pairing:
+            self.assertFalse(arena.just_played_together(player_a, player_b))
+            self.assertFalse(arena.color_balance_problem(player_a, player_b))
+
+
+@patch_bulk_write()
+class TournamentWriteBufferTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_merged_updates(self):
+        client = AsyncMongoMockClient()
+        app_state = SimpleNamespace(db=client["test"], db_client=client)
+        await app_state.db.tournament.insert_one({"_id": "tid12345", "nbPlayers": 0})
+        write_buffer = TournamentWriteBuffer(app_state, "tid12345")
+
+        write_buffer.update_player("player01", {"tid": "tid12345", "s": 0, "wd": False})
+        write_buffer.update_player("player01", {"s": 2})
+        write_buffer.update_tournament({"nbPlayers": 1})
+        write_buffer.update_tournament({"nbPlayers": 2})
+        self.assertEqual(len(write_buffer), 2)
+
+        await write_buffer.flush()
+        self.assertEqual(len(write_buffer), 0)
+
+        doc = await app_state.db.tournament_player.find_one({"_id": "player01"})
+        self.assertEqual(doc, {"_id": "player01", "tid": "tid12345", "s": 2, "wd": False})
+        doc = await app_state.db.tournament.find_one({"_id": "tid12345"})
+        self.assertEqual(doc["nbPlayers"], 2)
+
+    async def test_failed_updates_are_kept(self):
+        client = AsyncMongoMockClient()
+        app_state = SimpleNamespace(db=client["test"], db_client=client)
+        await app_state.db.tournament.insert_one({"_id": "tid12345", "nbPlayers": 0})
+        write_buffer = TournamentWriteBuffer(app_state, "tid12345")
+
+        write_buffer.update_player("player01", {"tid": "tid12345", "s": 0, "wd": False})
+        write_buffer.update_pairing("game0001", {"r": "a"})
+        write_buffer.update_tournament({"nbPlayers": 1})
+
+        with patch(
+            "mongomock_motor.AsyncMongoMockCollection.update_one", side_effect=ConnectionError
+        ):
+            await write_buffer.flush()
+        self.assertEqual(len(write_buffer), 3)
+        self.assertIsNone(await app_state.db.tournament_player.find_one({"_id": "player01"}))
+
+        # newer updates win over the restored ones
+        write_buffer.update_player("player01", {"s": 2})
+        await write_buffer.flush()
+        self.assertEqual(len(write_buffer), 0)
+
+        doc = await app_state.db.tournament_player.find_one({"_id": "player01"})
+        self.assertEqual(doc, {"_id": "player01", "tid": "tid12345", "s": 2, "wd": False})
+        doc = await app_state.db.tournament.find_one({"_id": "tid12345"})
+        self.assertEqual(doc["nbPlayers"], 1)
+
+
+@patch_bulk_write()
+class LazyTournamentTestCase(AioHTTPTestCase):
+    async def get_application(self):
+        app = make_app(db_client=AsyncMongoMockClient())
+        return app
+
+    async def tearDownAsync(self):
+        await self.client.close()
+
+    async def test_finished_tournament_is_paged_from_db(self):
+        app_state = get_app_state(self.app)
+        tid = id8()
+        now = datetime.now(timezone.utc)
+        await app_state.db.tournament.insert_one(
+            {
+                "_id": tid,
+                "name": "Lazy Arena",
+                "system": ARENA,
+                "v": "n",
+                "b": 1,
+                "i": 0,
+                "rounds": 0,
+                "createdBy": "PyChess",
+                "createdAt": now,
+                "minutes": 10,
+                "startsAt": now,
+                "status": T_FINISHED,
+                "nbPlayers": 24,
+                "nbGames": 1,
+                "nbBerserk": 0,
+                "sumRating": 24 * 1500,
+                "winner": "player24",
+            }
+        )
+        await app_state.db.user.insert_many([{"_id": "player%s" % i} for i in range(25)])
+        await app_state.db.tournament_player.insert_many(
+            [
+                {
+                    "_id": "p%s" % i,
+                    "tid": tid,
+                    "uid": "player%s" % i,
+                    "r": 1400 + i,
+                    "pr": "",
+                    "a": False,
+                    "f": 0,
+                    "s": i,
+                    "w": 0,
+                    "b": 0,
+                    "e": 1500,
+                    "p": [],
+                    "wd": i == 0,
+                }
+                for i in range(25)
+            ]
+        )
+        await app_state.db.tournament_pairing.insert_many(
+            [
+                {
+                    "_id": "game1234",
+                    "tid": tid,
+                    "u": ["player24", "player23"],
+                    "r": "a",
+                    "d": now,
+                    "wr": "1500",
+                    "br": "1500?",
+                },
+                # never finished, the tournament ended before it got its result
+                {
+                    "_id": "game5678",
+                    "tid": tid,
+                    "u": ["player22", "player21"],
+                    "r": "d",
+                    "d": now,
+                    "wr": "1500",
+                    "br": "1500",
+                },
+            ]
+        )
+
+        tournament = await load_tournament(app_state, tid)
+        self.assertTrue(tournament.lazy)
+        self.assertEqual(tournament.players, {})
+        self.assertEqual(tournament.w_win, 1)
+        self.assertEqual(tournament.summary["sumRating"], 24 * 1500)
+
+        page = await tournament.get_players_json(page=3)
+        self.assertEqual(
+            [player["name"] for player in page["players"]],
+            ["player4", "player3", "player2", "player1"],
+        )
+        self.assertEqual(page["podium"][0]["name"], "player24")
+
+        user = User(app_state, username="player7")
+        page = await tournament.get_players_json(user=user)
+        self.assertEqual(page["page"], 2)
+
+        games = await tournament.get_games_json("player23")
+        self.assertEqual(games["rank"], 2)
+        self.assertEqual(games["games"][0]["name"], "player24")
+        self.assertEqual(games["games"][0]["color"], "b")
+        self.assertEqual(games["games"][0]["result"], "1-0")
+
+        self.assertEqual(await tournament.user_status(user), "joined")
+        self.assertEqual(await tournament.user_rating(user), 1407)
+        spectator = User(app_state, username="spectator")
+        self.assertEqual(await tournament.user_status(spectator), "spectator")
+        self.assertEqual(await tournament.user_rating(spectator), "1500?")
+
+        # unfinished pairings of finished tournaments are not loaded as ongoing games
+        del app_state.tournaments[tid]
+        tournament = await load_tournament(app_state, tid, full=True)
+        self.assertFalse(tournament.lazy)
+        self.assertEqual(tournament.ongoing_games, set())
+        self.assertEqual(tournament.nb_games_finished, 1)
+        player21 = tournament.players[await app_state.users.get("player21")]
+        player22 = tournament.players[await app_state.users.get("player22")]
+        self.assertEqual(player21.games, [])
+        self.assertEqual(player22.games, [])
+        player23 = tournament.players[await app_state.users.get("player23")]
+        self.assertEqual([game.id for game in player23.games], ["game1234"])
+        user = await app_state.users.get("player7")
+        self.assertEqual(await tournament.user_status(user), "joined")
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)